@@ -6,7 +6,7 @@ from sqlalchemy import pool
 from alembic import context
 from alembic.config import Config
 
-from feedback_bot.config import settings 
+from feedback_bot.config import validate_settings
 
 config = context.config
 fileConfig(config.config_file_name)
@@ -16,7 +16,7 @@ target_metadata = None
 def _configure_db_url(cfg: Config):
     preset_url = cfg.get_main_option("sqlalchemy.url")
     if not preset_url:
-        cfg.set_main_option("sqlalchemy.url", settings.DATABASE_URL)
+        cfg.set_main_option("sqlalchemy.url", validate_settings().DATABASE_URL)
 
 
 def run_migrations_offline():
@@ -0,0 +1,109 @@
+"""Partition forwarded_message table by created_at
+
+Replace forwarded_message with a table range-partitioned by month
+on created_at. Existing rows are copied into monthly partitions,
+rows outside of them go to the default partition.
+
+The primary key of a partitioned table has to include the partition key,
+so (forwarded_message_id, target_chat_id) is no longer unique by itself.
+
+Revision ID: 4c1d2b7e9a3f
+Revises: 12d601a0379f
+Create Date: 2026-10-18 05:45:12.418305
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '4c1d2b7e9a3f'
+down_revision = '12d601a0379f'
+branch_labels = None
+depends_on = None
+
+_TABLE = "forwarded_message"
+_OLD_TABLE = "forwarded_message_unpartitioned"
+_PARTITIONS_AHEAD = 2
+
+
+def upgrade():
+    op.execute(f"ALTER TABLE {_TABLE} RENAME TO {_OLD_TABLE}")
+    op.execute(
+        f"ALTER TABLE {_OLD_TABLE} RENAME CONSTRAINT {_TABLE}_pkey TO {_OLD_TABLE}_pkey"
+    )
+    op.execute(
+        f"""
+        CREATE TABLE {_TABLE} (
+            forwarded_message_id INTEGER NOT NULL,
+            target_chat_id BIGINT NOT NULL,
+            origin_chat_id BIGINT NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            PRIMARY KEY (forwarded_message_id, target_chat_id, created_at)
+        ) PARTITION BY RANGE (created_at)
+        """
+    )
+    op.execute(f"CREATE INDEX {_TABLE}_created_at_idx ON {_TABLE} USING BRIN (created_at)")
+    op.execute(f"CREATE TABLE {_TABLE}_default PARTITION OF {_TABLE} DEFAULT")
+    op.execute(
+        f"""
+        DO $$
+        DECLARE
+            current_month TIMESTAMP := date_trunc('month', now() AT TIME ZONE 'UTC');
+            month_start TIMESTAMP;
+        BEGIN
+            SELECT date_trunc('month', min(created_at) AT TIME ZONE 'UTC')
+            INTO month_start
+            FROM {_OLD_TABLE};
+
+            month_start := LEAST(COALESCE(month_start, current_month), current_month);
+            WHILE month_start <= current_month + interval '{_PARTITIONS_AHEAD} months' LOOP
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF {_TABLE} FOR VALUES FROM (%L) TO (%L)',
+                    '{_TABLE}_p' || to_char(month_start, 'YYYYMM'),
+                    month_start AT TIME ZONE 'UTC',
+                    (month_start + interval '1 month') AT TIME ZONE 'UTC'
+                );
+                month_start := month_start + interval '1 month';
+            END LOOP;
+        END
+        $$
+        """
+    )
+    op.execute(
+        f"""
+        INSERT INTO {_TABLE} (
+            forwarded_message_id, target_chat_id, origin_chat_id, created_at
+        )
+        SELECT
+            forwarded_message_id, target_chat_id, origin_chat_id, created_at
+        FROM {_OLD_TABLE}
+        """
+    )
+    op.execute(f"DROP TABLE {_OLD_TABLE}")
+
+
+def downgrade():
+    op.execute(f"ALTER TABLE {_TABLE} RENAME TO {_OLD_TABLE}")
+    op.execute(
+        f"""
+        CREATE TABLE {_TABLE} (
+            forwarded_message_id INTEGER NOT NULL,
+            target_chat_id BIGINT NOT NULL,
+            origin_chat_id BIGINT NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            PRIMARY KEY (forwarded_message_id, target_chat_id)
+        )
+        """
+    )
+    op.execute(
+        f"""
+        INSERT INTO {_TABLE} (
+            forwarded_message_id, target_chat_id, origin_chat_id, created_at
+        )
+        SELECT
+            forwarded_message_id, target_chat_id, origin_chat_id, created_at
+        FROM {_OLD_TABLE}
+        ON CONFLICT DO NOTHING
+        """
+    )
+    op.execute(f"DROP TABLE {_OLD_TABLE}")
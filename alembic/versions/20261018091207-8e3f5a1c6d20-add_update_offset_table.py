@@ -0,0 +1,33 @@
+"""Add update_offset table
+
+Store the offset of the last processed update per bot,
+so that updates received in polling mode aren't processed twice.
+
+Revision ID: 8e3f5a1c6d20
+Revises: 4c1d2b7e9a3f
+Create Date: 2026-10-18 09:12:07.503114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e3f5a1c6d20'
+down_revision = '4c1d2b7e9a3f'
+branch_labels = None
+depends_on = None
+
+_TARGET_TABLE = "update_offset"
+
+
+def upgrade():
+    op.create_table(
+        _TARGET_TABLE,
+        sa.Column("bot_id", sa.BigInteger, primary_key=True),
+        sa.Column("update_offset", sa.BigInteger, nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table(_TARGET_TABLE)
@@ -0,0 +1,45 @@
+"""Add outbox table
+
+Store Telegram requests in the same transaction as the changes they
+report, so that they're sent even if the process dies after commit.
+
+Revision ID: b7d4e2f19c35
+Revises: 8e3f5a1c6d20
+Create Date: 2026-10-18 16:05:34.271940
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d4e2f19c35'
+down_revision = '8e3f5a1c6d20'
+branch_labels = None
+depends_on = None
+
+_TARGET_TABLE = "outbox"
+
+
+def upgrade():
+    op.create_table(
+        _TARGET_TABLE,
+        sa.Column("id", sa.BigInteger, primary_key=True),
+        sa.Column("payload", postgresql.JSONB, nullable=False),
+        sa.Column("attempts", sa.Integer, nullable=False, server_default="0"),
+        sa.Column("available_at", sa.TIMESTAMP(timezone=True), nullable=False),
+        sa.Column(
+            "created_at",
+            sa.TIMESTAMP(timezone=True),
+            nullable=False,
+            server_default=sa.func.now(),
+        ),
+    )
+    op.create_index(
+        f"{_TARGET_TABLE}_available_at", _TARGET_TABLE, ["available_at"]
+    )
+
+
+def downgrade():
+    op.drop_table(_TARGET_TABLE)
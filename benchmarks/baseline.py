@@ -0,0 +1,78 @@
+"""Baselines benchmark results are compared to.
+
+Results of a benchmark are saved by scenario name into a JSON file under
+``.benchmarks``, later runs of the scenario fail if they are worse than
+the saved results by more than a tolerance.
+"""
+import json
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+BASELINES_DIR = Path(__file__).parents[1] / ".benchmarks"
+
+Results = Dict[str, Optional[float]]
+
+
+def load(path: Path) -> Dict[str, Results]:
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text())
+
+
+def save(path: Path, scenario: str, results: Results):
+    baselines = load(path)
+    baselines[scenario] = results
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(baselines, indent=2) + "\n")
+
+
+def compare(
+    results: Results,
+    baseline: Results,
+    tolerance: float,
+    higher_is_better: Iterable[str] = (),
+    lower_is_better: Iterable[str] = (),
+) -> List[str]:
+    """Describe results worse than the baseline by more than ``tolerance``.
+
+    Values missing from either results are skipped.
+    """
+    regressions = []
+    for name in higher_is_better:
+        value, expected = results.get(name), baseline.get(name)
+        if value is not None and expected is not None:
+            if value < expected * (1 - tolerance):
+                regressions.append(f"{name} {value} < {expected}")
+    for name in lower_is_better:
+        value, expected = results.get(name), baseline.get(name)
+        if value is not None and expected is not None:
+            if value > expected * (1 + tolerance):
+                regressions.append(f"{name} {value} > {expected}")
+    return regressions
+
+
+def check(
+    path: Path,
+    scenario: str,
+    results: Results,
+    save_baseline: bool,
+    tolerance: float,
+    higher_is_better: Iterable[str] = (),
+    lower_is_better: Iterable[str] = (),
+) -> int:
+    """Save or compare ``results`` and return the exit code of the benchmark."""
+    if save_baseline:
+        save(path, scenario, results)
+        print(f"Saved baseline {scenario} to {path}")
+        return 0
+
+    baseline = load(path).get(scenario)
+    if baseline is None:
+        return 0
+
+    regressions = compare(
+        results, baseline, tolerance, higher_is_better, lower_is_better
+    )
+    for regression in regressions:
+        print(f"Regression against baseline {scenario}: {regression}")
+    return 1 if regressions else 0
@@ -0,0 +1,164 @@
+"""Local stand-in for the Telegram Bot API used by benchmarks.
+
+Implements the methods the bot calls: forwardMessage, copyMessage
+and sendMessage answer after a configurable latency, and a share of them
+can be rejected with 429 Too Many Requests to exercise retries. getMe
+describes the bot by the ID in its token, getWebhookInfo returns the URL
+last passed to setWebhook, other methods succeed at once.
+
+    python -m benchmarks.fake_bot_api --port 8081 --latency 0.05
+"""
+import argparse
+import asyncio
+import itertools
+import random
+import time
+from typing import Callable, Dict, Optional
+
+from aiohttp import web
+
+# Called with the method name, its parameters and result once a request succeeds
+RequestListener = Callable[[str, Dict[str, str], dict], None]
+
+_DELAYED_METHODS = ("forwardMessage", "copyMessage", "sendMessage")
+
+
+def _chat(chat_id: int) -> dict:
+    return {"id": chat_id, "type": "private" if chat_id > 0 else "group"}
+
+
+def _bot_user(bot_id: int) -> dict:
+    return {
+        "id": bot_id,
+        "is_bot": True,
+        "first_name": "Feedback Bot",
+        "username": "feedback_bot",
+    }
+
+
+class FakeBotAPI:
+    def __init__(
+        self,
+        latency: float = 0.05,
+        jitter: float = 0.0,
+        rate_limited_share: float = 0.0,
+        retry_after: int = 1,
+        on_request: Optional[RequestListener] = None,
+        seed: Optional[int] = None,
+    ):
+        self._latency = latency
+        self._jitter = jitter
+        self._rate_limited_share = rate_limited_share
+        self._retry_after = retry_after
+        self._on_request = on_request
+        self._rng = random.Random(seed)
+        self._message_ids = itertools.count(1)
+        self._runner: Optional[web.AppRunner] = None
+        self._webhook_url = ""
+
+        self.requests: Dict[str, int] = {}
+        self.rate_limited = 0
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        return app
+
+    async def start(self, host: str, port: int):
+        self._runner = web.AppRunner(self.create_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.requests[method] = self.requests.get(method, 0) + 1
+
+        if method == "getMe":
+            bot_id = int(request.match_info["token"].split(":")[0])
+            return web.json_response({"ok": True, "result": _bot_user(bot_id)})
+        if method == "setWebhook":
+            self._webhook_url = params.get("url", "")
+        if method == "getWebhookInfo":
+            return web.json_response(
+                {
+                    "ok": True,
+                    "result": {
+                        "url": self._webhook_url,
+                        "has_custom_certificate": False,
+                        "pending_update_count": 0,
+                    },
+                }
+            )
+        if method not in _DELAYED_METHODS:
+            return web.json_response({"ok": True, "result": True})
+
+        await asyncio.sleep(
+            max(0.0, self._latency + self._rng.uniform(-self._jitter, self._jitter))
+        )
+        if self._rng.random() < self._rate_limited_share:
+            self.rate_limited += 1
+            return web.json_response(
+                {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": (
+                        f"Too Many Requests: retry after {self._retry_after}"
+                    ),
+                    "parameters": {"retry_after": self._retry_after},
+                },
+                status=429,
+            )
+
+        result = self._result(method, params)
+        if self._on_request is not None:
+            self._on_request(method, params, result)
+        return web.json_response({"ok": True, "result": result})
+
+    def _result(self, method: str, params: Dict[str, str]) -> dict:
+        message_id = next(self._message_ids)
+        if method == "copyMessage":
+            return {"message_id": message_id}
+
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": _chat(int(params["chat_id"])),
+        }
+        if method == "sendMessage":
+            message["text"] = params.get("text", "")
+        return message
+
+
+async def main(args: argparse.Namespace):
+    api = FakeBotAPI(
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_limited_share=args.rate_limited_share,
+        retry_after=args.retry_after,
+    )
+    await api.start(args.host, args.port)
+    print(f"Serving fake Bot API on http://{args.host}:{args.port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await api.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--rate-limited-share", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,146 @@
+"""Memory and time of loading models in bulk with the repository mappers.
+
+Rows are tuples, like the records of asyncpg and rows of sqlite3 the
+mappers read by position. Memory is what the loaded models keep
+allocated, as measured by tracemalloc, per model, the rows themselves
+aren't counted.
+
+    python -m benchmarks.models --rows 100000 --save-baseline
+"""
+import argparse
+import gc
+import sys
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Tuple
+
+from benchmarks import baseline
+from feedback_bot.adapters.repositories.admin import (
+    PostgresAdminRepository,
+    SqliteAdminRepository,
+)
+from feedback_bot.adapters.repositories.forwarded_message import (
+    PostgresForwardedMessageRepository,
+    SqliteForwardedMessageRepository,
+)
+from feedback_bot.adapters.repositories.target_chat import (
+    PostgresTargetChatRepository,
+    SqliteTargetChatRepository,
+)
+from feedback_bot.adapters.sqlite import to_timestamp
+
+_CREATED_AT = datetime(2021, 1, 1, tzinfo=timezone.utc)
+
+
+def _created_at(index: int) -> datetime:
+    return _CREATED_AT + timedelta(seconds=index)
+
+
+def _target_chat_rows(rows: int) -> List[tuple]:
+    return [(-1000 - index, _created_at(index)) for index in range(rows)]
+
+
+def _admin_rows(rows: int) -> List[tuple]:
+    return [(index, -1000 - index, _created_at(index)) for index in range(rows)]
+
+
+def _forwarded_message_rows(rows: int) -> List[tuple]:
+    return [(index, -1000, index, _created_at(index)) for index in range(rows)]
+
+
+def _sqlite(rows: List[tuple]) -> List[tuple]:
+    return [(*row[:-1], to_timestamp(row[-1])) for row in rows]
+
+
+SCENARIOS: Dict[str, Tuple[Callable[[Any], Any], Callable[[int], List[tuple]]]] = {
+    "postgres_target_chat": (
+        PostgresTargetChatRepository.row_to_model, _target_chat_rows
+    ),
+    "postgres_admin": (PostgresAdminRepository.row_to_model, _admin_rows),
+    "postgres_forwarded_message": (
+        PostgresForwardedMessageRepository.row_to_model, _forwarded_message_rows
+    ),
+    "sqlite_target_chat": (
+        SqliteTargetChatRepository.row_to_model,
+        lambda rows: _sqlite(_target_chat_rows(rows)),
+    ),
+    "sqlite_admin": (
+        SqliteAdminRepository.row_to_model,
+        lambda rows: _sqlite(_admin_rows(rows)),
+    ),
+    "sqlite_forwarded_message": (
+        SqliteForwardedMessageRepository.row_to_model,
+        lambda rows: _sqlite(_forwarded_message_rows(rows)),
+    ),
+}
+
+
+def _rows_per_second(row_to_model, rows: List[tuple], repeat: int) -> float:
+    best = 0.0
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            started_at = perf_counter()
+            models = [row_to_model(row) for row in rows]
+            best = max(best, len(models) / (perf_counter() - started_at))
+            del models
+    finally:
+        gc.enable()
+    return best
+
+
+def _bytes_per_model(row_to_model, rows: List[tuple]) -> float:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        models = [row_to_model(row) for row in rows]
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return (after - before) / len(models)
+
+
+def run(args: argparse.Namespace) -> Dict[str, float]:
+    results = {}
+    print(f"{'models':<28} {'rows/s':>10} {'B/model':>8}")
+    for name in args.models:
+        row_to_model, make_rows = SCENARIOS[name]
+        rows = make_rows(args.rows)
+        rows_per_second = _rows_per_second(row_to_model, rows, args.repeat)
+        bytes_per_model = _bytes_per_model(row_to_model, rows)
+        results[f"{name}_rows"] = round(rows_per_second, 1)
+        results[f"{name}_bytes"] = round(bytes_per_model, 1)
+        print(f"{name:<28} {rows_per_second:>10.0f} {bytes_per_model:>8.1f}")
+    return results
+
+
+def main(args: argparse.Namespace) -> int:
+    results = run(args)
+    return baseline.check(
+        args.baseline,
+        args.scenario,
+        results,
+        save_baseline=args.save_baseline,
+        tolerance=args.tolerance,
+        higher_is_better=[name for name in results if name.endswith("_rows")],
+        lower_is_better=[name for name in results if name.endswith("_bytes")],
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--models", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS)
+    )
+    parser.add_argument("--scenario", default="default")
+    parser.add_argument(
+        "--baseline", type=Path, default=baseline.BASELINES_DIR / "models.json"
+    )
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    sys.exit(main(parser.parse_args()))
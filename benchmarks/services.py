@@ -0,0 +1,214 @@
+"""Per-call overhead of services, measured on the in-memory fakes.
+
+Services are called the way handlers call them, with dependencies injected
+by the container and a new in-memory unit of work for every call, so the
+results cover dependency injection, units of work, the outbox, metrics
+and tracing, but neither the database nor the Telegram API.
+
+CPython doesn't count allocations, so memory is reported as the number
+of memory blocks a call leaves allocated, with garbage collection disabled.
+That covers objects kept by the call and reference cycles it creates,
+but not temporary objects freed before the call returns. Unlike the peak
+size of traced memory, the count doesn't depend on allocator and
+tracemalloc overhead, so it barely changes between runs.
+
+Requires the same settings as unit tests.
+
+    python -m benchmarks.services --calls 5000 --save-baseline
+"""
+import argparse
+import asyncio
+import gc
+import sys
+from pathlib import Path
+from time import perf_counter
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from dependency_injector import providers
+
+from benchmarks import baseline
+from benchmarks.fakes import InMemoryUnitOfWork
+from feedback_bot.main import inject_dependencies
+from feedback_bot.model import Admin, ForwardedMessage, TargetChat
+from feedback_bot.service_layer import services
+
+ADMIN_TOKEN = "admin_token"
+ADMIN = Admin(user_id=1, target_chat=TargetChat(chat_id=1))
+USER_CHAT_ID = 100
+FORWARDED_MESSAGE = ForwardedMessage(
+    forwarded_message_id=42,
+    target_chat_id=ADMIN.target_chat.chat_id,
+    origin_chat_id=USER_CHAT_ID,
+)
+
+Call = Callable[[int], Awaitable[None]]
+
+
+class State:
+    def __init__(self):
+        self.admins = {}
+        self.target_chats = {}
+        self.forwarded_messages = {}
+
+    def add_admin(self, admin: Admin):
+        self.admins[admin.user_id] = admin
+        self.target_chats[admin.target_chat.chat_id] = admin.target_chat
+
+    def uow_factory(self) -> providers.Factory:
+        return providers.Factory(
+            InMemoryUnitOfWork,
+            admins=self.admins,
+            target_chats=self.target_chats,
+            forwarded_messages=self.forwarded_messages,
+        )
+
+
+def authenticate_admin(state: State) -> Call:
+    async def call(index: int):
+        await services.authenticate_admin(
+            user_id=1000 + index, chat_id=1000 + index, token=ADMIN_TOKEN
+        )
+
+    return call
+
+
+def add_group(state: State) -> Call:
+    state.add_admin(ADMIN)
+
+    async def call(index: int):
+        await services.add_group(
+            by_user_id=ADMIN.user_id, group_chat_id=-1000 - index
+        )
+
+    return call
+
+
+def process_private_message(state: State) -> Call:
+    state.add_admin(ADMIN)
+
+    async def call(index: int):
+        await services.process_private_message(
+            chat_id=USER_CHAT_ID, message_id=index
+        )
+
+    return call
+
+
+def process_reply(state: State) -> Call:
+    state.add_admin(ADMIN)
+    state.forwarded_messages[
+        (FORWARDED_MESSAGE.forwarded_message_id, FORWARDED_MESSAGE.target_chat_id)
+    ] = FORWARDED_MESSAGE
+
+    async def call(index: int):
+        await services.process_reply(
+            chat_id=FORWARDED_MESSAGE.target_chat_id,
+            message_id=index,
+            reply_to_message_id=FORWARDED_MESSAGE.forwarded_message_id,
+        )
+
+    return call
+
+
+SCENARIOS: Dict[str, Callable[[State], Call]] = {
+    "process_private_message": process_private_message,
+    "process_reply": process_reply,
+    "add_group": add_group,
+    "authenticate_admin": authenticate_admin,
+}
+
+
+async def _ops_per_second(call: Call, calls: int) -> float:
+    # Like timeit, keep garbage collection from adding noise to timings
+    gc.disable()
+    try:
+        started_at = perf_counter()
+        for index in range(calls):
+            await call(index)
+        return calls / (perf_counter() - started_at)
+    finally:
+        gc.enable()
+
+
+async def _blocks_per_call(call: Call, calls: int) -> float:
+    gc.collect()
+    gc.disable()
+    try:
+        before = sys.getallocatedblocks()
+        for index in range(calls):
+            await call(index)
+        return (sys.getallocatedblocks() - before) / calls
+    finally:
+        gc.enable()
+        gc.collect()
+
+
+async def _measure(
+    container, setup: Callable[[State], Call], args: argparse.Namespace
+) -> Tuple[float, float]:
+    """Return the best ops/sec of all repeats and memory blocks per call."""
+    ops = []
+    for _ in range(args.repeat):
+        state = State()
+        call = setup(state)
+        with container.uow.override(state.uow_factory()):
+            for index in range(args.warmup):
+                await call(-1 - index)
+            ops.append(await _ops_per_second(call, args.calls))
+
+    state = State()
+    call = setup(state)
+    with container.uow.override(state.uow_factory()):
+        for index in range(args.warmup):
+            await call(-1 - index)
+        blocks = await _blocks_per_call(call, args.memory_calls)
+
+    return max(ops), blocks
+
+
+async def run(args: argparse.Namespace) -> Dict[str, float]:
+    container = inject_dependencies()
+    results = {}
+    print(f"{'service':<24} {'ops/s':>9} {'blocks/call':>11}")
+    try:
+        with container.config.ADMIN_TOKEN.override(ADMIN_TOKEN):
+            for name in args.services:
+                ops, blocks = await _measure(container, SCENARIOS[name], args)
+                results[f"{name}_ops"] = round(ops, 1)
+                results[f"{name}_blocks"] = round(blocks, 1)
+                print(f"{name:<24} {ops:>9.0f} {blocks:>11.1f}")
+    finally:
+        container.unwire()
+    return results
+
+
+def main(args: argparse.Namespace) -> int:
+    results = asyncio.run(run(args))
+    names: List[str] = list(results)
+    return baseline.check(
+        args.baseline,
+        args.scenario,
+        results,
+        save_baseline=args.save_baseline,
+        tolerance=args.tolerance,
+        higher_is_better=[name for name in names if name.endswith("_ops")],
+        lower_is_better=[name for name in names if name.endswith("_blocks")],
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=5000)
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--memory-calls", type=int, default=500)
+    parser.add_argument(
+        "--services", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS)
+    )
+    parser.add_argument("--scenario", default="default")
+    parser.add_argument(
+        "--baseline", type=Path, default=baseline.BASELINES_DIR / "services.json"
+    )
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    sys.exit(main(parser.parse_args()))
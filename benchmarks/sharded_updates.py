@@ -0,0 +1,124 @@
+"""Throughput of UpdateWorkerPool depending on the number of shards.
+
+Updates are processed by the bot's own dispatcher and handlers: each one
+is a private message forwarded to the Admin through a unit of work on
+a fresh SQLite database and the rate-limited Telegram API, served by
+the local fake Bot API (see ``benchmarks.fake_bot_api``) with
+``--api-latency``. Telegram rate limits are raised so they don't cap
+the throughput, which is still bounded by the single SQLite writer and
+the event loop, so more shards don't scale it indefinitely.
+
+Requires the same settings as unit tests.
+
+    python -m benchmarks.sharded_updates --updates 2000 --chats 200
+"""
+import argparse
+import asyncio
+import random
+import tempfile
+from contextlib import ExitStack
+from pathlib import Path
+from time import perf_counter
+from typing import List, Tuple
+
+from aiogram import types
+
+from benchmarks.fake_bot_api import FakeBotAPI
+from feedback_bot import bot as bot_module
+from feedback_bot.main import inject_dependencies
+from feedback_bot.service_layer import services
+from feedback_bot.updates import UpdateWorkerPool, shard_imbalance
+
+ADMIN_USER_ID = 1
+# Users chatting with the bot, distinct from the Admin
+_FIRST_USER_ID = 1_000_000
+
+
+def _updates(count: int, chats: int) -> List[types.Update]:
+    rng = random.Random(42)
+    updates = []
+    for update_id in range(count):
+        user_id = _FIRST_USER_ID + rng.randrange(chats)
+        updates.append(
+            types.Update(
+                update_id=update_id,
+                message={
+                    "message_id": update_id,
+                    "date": 0,
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": {"id": user_id, "is_bot": False, "first_name": "User"},
+                    "text": "Benchmark",
+                },
+            )
+        )
+    return updates
+
+
+async def _run(
+    shards: int, updates: List[types.Update], args: argparse.Namespace
+) -> Tuple[float, float]:
+    container = inject_dependencies()
+    config = container.config
+    with tempfile.TemporaryDirectory() as directory, ExitStack() as overrides:
+        for option, value in (
+            ("DATABASE_BACKEND", "sqlite"),
+            ("DATABASE_SQLITE_PATH", str(Path(directory) / "benchmark.sqlite3")),
+            ("TELEGRAM_API_SERVER", f"http://{args.host}:{args.api_port}"),
+            ("TELEGRAM_GLOBAL_RATE_LIMIT", args.rate_limit),
+            ("TELEGRAM_PRIVATE_CHAT_RATE_LIMIT", args.rate_limit),
+            ("TRACING_SAMPLE_RATE", 0),
+        ):
+            overrides.enter_context(getattr(config, option).override(value))
+
+        dp = bot_module.create_dispatcher(container.bot())
+        try:
+            await bot_module.warm_up(dp)
+            await services.authenticate_admin(
+                user_id=ADMIN_USER_ID, chat_id=ADMIN_USER_ID, token=config.ADMIN_TOKEN()
+            )
+
+            worker_pool = UpdateWorkerPool(shards=shards, queue_size=len(updates))
+            worker_pool.start(dp)
+            started_at = perf_counter()
+            for update in updates:
+                await worker_pool.put(update)
+            await worker_pool.close()
+            elapsed = perf_counter() - started_at
+        finally:
+            await bot_module.shutdown_resources(dp)
+            await dp.bot.session.close()
+            container.unwire()
+
+    return len(updates) / elapsed, shard_imbalance.value
+
+
+async def main(args: argparse.Namespace):
+    updates = _updates(args.updates, args.chats)
+    api = FakeBotAPI(latency=args.api_latency, seed=42)
+    await api.start(args.host, args.api_port)
+    try:
+        print(f"{'shards':>6} {'updates/s':>10} {'speedup':>8} {'imbalance':>10}")
+        baseline = None
+        for shards in args.shards:
+            throughput, imbalance = await _run(shards, updates, args)
+            baseline = baseline or throughput
+            print(
+                f"{shards:>6} {throughput:>10.0f} {throughput / baseline:>7.1f}x"
+                f" {imbalance:>10.2f}"
+            )
+    finally:
+        await api.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--api-port", type=int, default=3102)
+    parser.add_argument("--api-latency", type=float, default=0.005)
+    parser.add_argument("--rate-limit", type=float, default=1_000_000)
+    parser.add_argument(
+        "--shards", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64]
+    )
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,163 @@
+"""Throughput of the embedded SQLite backend.
+
+Units of work run against a fresh WAL database in a temporary directory,
+each operation is a whole unit of work: taking the database lock,
+the queries, the commit or rollback and releasing the lock. Concurrent
+units of work show how much waiting for the single writer costs.
+
+    python -m benchmarks.sqlite --operations 5000 --save-baseline
+"""
+import argparse
+import asyncio
+import gc
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+from typing import Awaitable, Callable, Dict
+
+from benchmarks import baseline
+from benchmarks.fakes import FakeTelegramAPI
+from feedback_bot.adapters.sqlite import SqliteDatabase
+from feedback_bot.bootstrap import sqlite_outbox_transactions
+from feedback_bot.model import Admin, ForwardedMessage, TargetChat
+from feedback_bot.service_layer.outbox import OutboxDispatcher
+from feedback_bot.service_layer.unit_of_work import SqliteUnitOfWork
+
+ADMIN = Admin(user_id=1, target_chat=TargetChat(chat_id=1))
+USER_CHAT_ID = 100
+
+Operation = Callable[[int], Awaitable[None]]
+
+
+def get_latest_target_chat(uow_factory) -> Operation:
+    async def operation(index: int):
+        uow = uow_factory()
+        async with uow:
+            await uow.target_chats.get_latest()
+
+    return operation
+
+
+def get_admin(uow_factory) -> Operation:
+    async def operation(index: int):
+        uow = uow_factory()
+        async with uow:
+            await uow.admins.get(ADMIN.user_id)
+
+    return operation
+
+
+def add_forwarded_message(uow_factory) -> Operation:
+    async def operation(index: int):
+        uow = uow_factory()
+        async with uow:
+            await uow.forwarded_messages.add(
+                ForwardedMessage(
+                    forwarded_message_id=index,
+                    target_chat_id=ADMIN.target_chat.chat_id,
+                    origin_chat_id=USER_CHAT_ID,
+                )
+            )
+            await uow.commit()
+
+    return operation
+
+
+def get_forwarded_message(uow_factory) -> Operation:
+    async def operation(index: int):
+        uow = uow_factory()
+        async with uow:
+            await uow.forwarded_messages.get(
+                forwarded_message_id=index,
+                target_chat_id=ADMIN.target_chat.chat_id,
+            )
+
+    return operation
+
+
+# Forwarded messages are read after they're added, so the order matters
+SCENARIOS: Dict[str, Callable[..., Operation]] = {
+    "get_latest_target_chat": get_latest_target_chat,
+    "get_admin": get_admin,
+    "add_forwarded_message": add_forwarded_message,
+    "get_forwarded_message": get_forwarded_message,
+}
+
+
+async def _ops_per_second(
+    operation: Operation, operations: int, concurrency: int
+) -> float:
+    async def worker(start: int):
+        for index in range(start, operations, concurrency):
+            await operation(index)
+
+    gc.disable()
+    try:
+        started_at = perf_counter()
+        await asyncio.gather(*(worker(start) for start in range(concurrency)))
+        return operations / (perf_counter() - started_at)
+    finally:
+        gc.enable()
+
+
+async def run(args: argparse.Namespace) -> Dict[str, float]:
+    results = {}
+    print(f"{'operation':<24} {'ops/s':>9}")
+    with tempfile.TemporaryDirectory() as directory:
+        database = SqliteDatabase(str(Path(directory) / "benchmark.sqlite3"))
+        await database.open()
+        try:
+            dispatcher = OutboxDispatcher(
+                FakeTelegramAPI(), transactions=sqlite_outbox_transactions(database)
+            )
+
+            def uow_factory() -> SqliteUnitOfWork:
+                return SqliteUnitOfWork(outbox_dispatcher=dispatcher, database=database)
+
+            uow = uow_factory()
+            async with uow:
+                await uow.admins.add(ADMIN)
+                await uow.commit()
+
+            for name in args.operations_to_run:
+                operation = SCENARIOS[name](uow_factory)
+                ops = await _ops_per_second(
+                    operation, args.operations, args.concurrency
+                )
+                results[f"{name}_ops"] = round(ops, 1)
+                print(f"{name:<24} {ops:>9.0f}")
+        finally:
+            await database.close()
+    return results
+
+
+def main(args: argparse.Namespace) -> int:
+    results = asyncio.run(run(args))
+    return baseline.check(
+        args.baseline,
+        args.scenario,
+        results,
+        save_baseline=args.save_baseline,
+        tolerance=args.tolerance,
+        higher_is_better=list(results),
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--operations", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument(
+        "--operations-to-run",
+        nargs="+",
+        choices=list(SCENARIOS),
+        default=list(SCENARIOS),
+    )
+    parser.add_argument("--scenario", default="default")
+    parser.add_argument(
+        "--baseline", type=Path, default=baseline.BASELINES_DIR / "sqlite.json"
+    )
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,198 @@
+"""Startup time of the bot: imports and time until its webhook accepts updates.
+
+Imports are timed with ``python -X importtime``, the slowest of them are
+reported. Readiness is timed from starting the bot process in webhook
+mode, with a local fake Bot API and the SQLite backend on a temporary
+file, until its webhook first accepts an update, which is what a platform
+router waits for after a restart.
+
+    python -m benchmarks.startup --runs 5 --save-baseline
+"""
+import argparse
+import asyncio
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+from typing import Dict, List, Mapping, NamedTuple, Optional
+
+import aiohttp
+
+from benchmarks import baseline
+from benchmarks.fake_bot_api import FakeBotAPI
+
+_ROOT = Path(__file__).parents[1]
+
+WEBHOOK_PATH = "/webhook"
+# An update type the bot drops right away, so polling doesn't touch the database
+_PROBE_UPDATE = {"update_id": 0, "poll": {"id": "0"}}
+
+_IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+class ImportTime(NamedTuple):
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def parse_import_times(report: str) -> List[ImportTime]:
+    """Parse the ``-X importtime`` report written to stderr."""
+    times = []
+    for line in report.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if match is not None:
+            self_us, cumulative_us, indent, module = match.groups()
+            times.append(
+                ImportTime(module, int(self_us), int(cumulative_us), len(indent) // 2)
+            )
+    return times
+
+
+def measure_imports(
+    module: str, env: Optional[Mapping[str, str]] = None
+) -> List[ImportTime]:
+    """Import ``module`` in a new interpreter and return the import times."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=_ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return parse_import_times(result.stderr)
+
+
+async def _wait_until_ready(
+    session: aiohttp.ClientSession,
+    webhook_url: str,
+    process: asyncio.subprocess.Process,
+    timeout: float,
+):
+    deadline = perf_counter() + timeout
+    while perf_counter() < deadline:
+        if process.returncode is not None:
+            raise RuntimeError(f"Bot exited with code {process.returncode}")
+        try:
+            async with session.post(webhook_url, json=_PROBE_UPDATE) as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.01)
+
+    raise RuntimeError(f"Bot didn't start in {timeout:.0f}s")
+
+
+async def time_to_ready(args: argparse.Namespace) -> float:
+    """Start the bot and return the seconds it took its webhook to accept an update."""
+    with tempfile.TemporaryDirectory() as directory:
+        env = {
+            **os.environ,
+            "TELEGRAM_BOT_TOKEN": "123:benchmark",
+            "TELEGRAM_API_SERVER": f"http://{args.host}:{args.api_port}",
+            "TELEGRAM_UPDATES_MODE": "webhook",
+            "TELEGRAM_WEBHOOK_HOST": f"http://{args.host}:{args.port}",
+            "TELEGRAM_WEBHOOK_PATH": WEBHOOK_PATH,
+            "ADMIN_TOKEN": "benchmark",
+            "DATABASE_BACKEND": "sqlite",
+            "DATABASE_SQLITE_PATH": str(Path(directory) / "startup.sqlite3"),
+            "HOST": args.host,
+            "PORT": str(args.port),
+        }
+        async with aiohttp.ClientSession() as session:
+            started_at = perf_counter()
+            process = await asyncio.create_subprocess_exec(
+                sys.executable,
+                "-m",
+                "feedback_bot",
+                cwd=_ROOT,
+                env=env,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+            try:
+                await _wait_until_ready(
+                    session,
+                    f"http://{args.host}:{args.port}{WEBHOOK_PATH}",
+                    process,
+                    args.timeout,
+                )
+                return perf_counter() - started_at
+            finally:
+                if process.returncode is None:
+                    process.terminate()
+                    await process.wait()
+
+
+async def run(args: argparse.Namespace) -> Dict[str, float]:
+    import_runs = [measure_imports("feedback_bot.main") for _ in range(args.runs)]
+    import_us = [
+        next(time.cumulative_us for time in times if time.module == "feedback_bot.main")
+        for times in import_runs
+    ]
+
+    print("Slowest imports of feedback_bot.main, cumulative:")
+    slowest = sorted(
+        (time for time in import_runs[-1] if time.depth <= args.import_depth),
+        key=lambda time: time.cumulative_us,
+        reverse=True,
+    )
+    for time in slowest[: args.top]:
+        print(f"  {time.cumulative_us / 1000:>8.1f} ms  {'  ' * time.depth}{time.module}")
+
+    api = FakeBotAPI()
+    await api.start(args.host, args.api_port)
+    try:
+        ready_seconds = [await time_to_ready(args) for _ in range(args.runs)]
+    finally:
+        await api.close()
+
+    results = {
+        "import_ms": round(statistics.median(import_us) / 1000, 1),
+        "ready_ms": round(statistics.median(ready_seconds) * 1000, 1),
+    }
+    print(f"import_ms {results['import_ms']}")
+    print(f"ready_ms {results['ready_ms']}")
+    return results
+
+
+def main(args: argparse.Namespace) -> int:
+    results = asyncio.run(run(args))
+    return baseline.check(
+        args.baseline,
+        args.scenario,
+        results,
+        save_baseline=args.save_baseline,
+        tolerance=args.tolerance,
+        lower_is_better=list(results),
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--api-port", type=int, default=8081)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument(
+        "--import-depth",
+        type=int,
+        default=2,
+        help="Nesting level of imports to report, 1 for direct imports",
+    )
+    parser.add_argument("--scenario", default="default")
+    parser.add_argument(
+        "--baseline", type=Path, default=baseline.BASELINES_DIR / "startup.json"
+    )
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,182 @@
+"""CPU time per update of lean decoding and routing against
+the aiogram objects and dispatcher handlers.
+
+Each update is processed from its raw JSON body up to the handler,
+handlers are replaced with no-ops, so the results cover decoding,
+filters and routing only.
+
+    python -m benchmarks.update_decoding --updates 20000 --save-baseline
+"""
+import argparse
+import asyncio
+import gc
+import json
+import sys
+from pathlib import Path
+from time import process_time
+from typing import Callable, Dict
+from unittest import mock
+
+from aiogram import Bot, types
+
+from benchmarks import baseline
+from feedback_bot import bot as bot_module
+from feedback_bot.routing import decode_update
+
+USER = {
+    "id": 42,
+    "is_bot": False,
+    "first_name": "Spam",
+    "last_name": "Eggs",
+    "username": "spam_eggs",
+    "language_code": "en",
+}
+PRIVATE_CHAT = {
+    "id": 42,
+    "first_name": "Spam",
+    "last_name": "Eggs",
+    "username": "spam_eggs",
+    "type": "private",
+}
+GROUP_CHAT = {"id": -1001, "title": "Feedback", "type": "supergroup"}
+PHOTO = [
+    {
+        "file_id": f"file_{size}",
+        "file_unique_id": f"unique_{size}",
+        "file_size": size * 100,
+        "width": size,
+        "height": size,
+    }
+    for size in (90, 320, 800, 1280)
+]
+
+
+def _message(message_id: int, chat: dict, **fields) -> dict:
+    return {"message_id": message_id, "from": USER, "chat": chat, "date": 0, **fields}
+
+
+PAYLOADS: Dict[str, dict] = {
+    "private_text": {
+        "update_id": 1,
+        "message": _message(
+            1,
+            PRIVATE_CHAT,
+            text="Hello, https://example.com is down again",
+            entities=[{"type": "url", "offset": 7, "length": 19}],
+        ),
+    },
+    "private_photo": {
+        "update_id": 2,
+        "message": _message(2, PRIVATE_CHAT, photo=PHOTO, caption="Screenshot"),
+    },
+    "group_reply": {
+        "update_id": 3,
+        "message": _message(
+            3,
+            GROUP_CHAT,
+            text="Thanks, fixed",
+            reply_to_message=_message(
+                2,
+                GROUP_CHAT,
+                photo=PHOTO,
+                caption="Screenshot",
+                forward_from=USER,
+                forward_date=0,
+            ),
+        ),
+    },
+    "edited_message": {
+        "update_id": 4,
+        "edited_message": _message(1, PRIVATE_CHAT, text="Hello", edit_date=0),
+    },
+}
+
+
+async def _noop(event):
+    pass
+
+
+def _full(dp) -> Callable[[bytes], object]:
+    async def process(body: bytes):
+        await dp.process_update(types.Update(**json.loads(body)))
+
+    return process
+
+
+def _lean(dp) -> Callable[[bytes], object]:
+    async def process(body: bytes):
+        update = decode_update(json.loads(body))
+        if update is not None:
+            await dp.process_update(update)
+
+    return process
+
+
+async def _us_per_update(process, body: bytes, updates: int) -> float:
+    gc.disable()
+    try:
+        started_at = process_time()
+        for _ in range(updates):
+            await process(body)
+        return (process_time() - started_at) / updates * 1e6
+    finally:
+        gc.enable()
+
+
+async def run(args: argparse.Namespace) -> Dict[str, float]:
+    bot = Bot(token="123:abc")
+    Bot.set_current(bot)
+    with mock.patch.multiple(
+        bot_module,
+        handle_auth_command=_noop,
+        handle_my_chat_member_update=_noop,
+        handle_private_message=_noop,
+        handle_reply=_noop,
+    ):
+        dp = bot_module.create_dispatcher(bot)
+
+    results = {}
+    print(f"{'update':<16} {'full us':>9} {'lean us':>9} {'speedup':>8}")
+    for name, payload in PAYLOADS.items():
+        body = json.dumps(payload).encode()
+        timings = {}
+        for path, process in (("full", _full(dp)), ("lean", _lean(dp))):
+            timings[path] = min(
+                [
+                    await _us_per_update(process, body, args.updates)
+                    for _ in range(args.repeat)
+                ]
+            )
+            results[f"{name}_{path}_us"] = round(timings[path], 2)
+        print(
+            f"{name:<16} {timings['full']:>9.1f} {timings['lean']:>9.1f}"
+            f" {timings['full'] / timings['lean']:>7.1f}x"
+        )
+    return results
+
+
+def main(args: argparse.Namespace) -> int:
+    results = asyncio.run(run(args))
+    return baseline.check(
+        args.baseline,
+        args.scenario,
+        results,
+        save_baseline=args.save_baseline,
+        tolerance=args.tolerance,
+        lower_is_better=[name for name in results if name.endswith("_lean_us")],
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--scenario", default="default")
+    parser.add_argument(
+        "--baseline",
+        type=Path,
+        default=baseline.BASELINES_DIR / "update_decoding.json",
+    )
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    sys.exit(main(parser.parse_args()))
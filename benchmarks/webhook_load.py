@@ -0,0 +1,522 @@
+"""End-to-end load test of the bot in webhook mode.
+
+Starts the bot as a separate process talking to a local fake Bot API
+(see ``benchmarks.fake_bot_api``) and to a fresh database created next to
+the one in ``--database-url``, then posts synthetic updates to its webhook
+at a fixed rate:
+
+* ``private`` - a user message, forwarded to the latest target chat;
+* ``reply`` - an Admin reply to a forwarded message, copied to its user;
+* ``member`` - the bot added to a group by the Admin, who is notified.
+
+Reports throughput, latency of webhook responses and end-to-end latency
+of updates (until the bot sends the resulting Telegram request), and how
+saturated the database pool was. Results can be saved as a baseline which
+later runs are compared to, failing when they are slower.
+
+    python -m benchmarks.webhook_load --rate 100 --duration 30 \\
+        --mix private=0.7,reply=0.2,member=0.1 --save-baseline
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import re
+import sys
+import time
+from collections import deque
+from pathlib import Path
+from time import perf_counter
+from typing import Deque, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import aiohttp
+import asyncpg
+from alembic.command import upgrade as alembic_upgrade
+from alembic.config import Config as AlembicConfig
+
+from benchmarks import baseline
+from benchmarks.fake_bot_api import FakeBotAPI
+
+_ROOT = Path(__file__).parents[1]
+
+BOT_TOKEN = "123:benchmark"
+BOT_USER = {"id": 123, "is_bot": True, "first_name": "Feedback Bot"}
+ADMIN_USER_ID = 1
+# The Admin authenticated in the private chat with the bot
+ADMIN_CHAT_ID = ADMIN_USER_ID
+WEBHOOK_PATH = "/webhook"
+UPDATE_KINDS = ("private", "reply", "member")
+
+# Replies are made to messages forwarded at least this number of seconds ago,
+# so that the bot has saved them even with write-behind enabled
+_REPLY_AFTER = 2.0
+
+# Metrics sampled to estimate pool saturation
+_POOL_GAUGES = ("postgres_pool_size", "postgres_pool_idle", "postgres_pool_waiters")
+_METRIC_LINE = re.compile(r"^(\w+) (\S+)$", re.MULTILINE)
+
+# Results which are worse when higher
+_LATENCIES = ("webhook_p95", "webhook_p99", "e2e_p95", "e2e_p99")
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        kind, _, share = part.partition("=")
+        if kind not in UPDATE_KINDS:
+            raise argparse.ArgumentTypeError(f"Unknown update kind {kind}")
+        mix[kind] = float(share)
+
+    total = sum(mix.values())
+    if total <= 0:
+        raise argparse.ArgumentTypeError("Update shares must be positive")
+    return {kind: share / total for kind, share in mix.items()}
+
+
+def percentile(values: List[float], share: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+class Tracker:
+    """Matches requests received by the fake Bot API to the updates
+    which caused them.
+    """
+
+    def __init__(self):
+        self._sent_at: Dict[Tuple, float] = {}
+        self._forwarded: Deque[Tuple[float, int, int]] = deque()
+        self.repliable: List[Tuple[int, int]] = []
+        self.latencies: List[float] = []
+
+    def expect(self, key: Tuple):
+        self._sent_at[key] = perf_counter()
+
+    @property
+    def pending(self) -> int:
+        return len(self._sent_at)
+
+    def on_request(self, method: str, params: Dict[str, str], result: dict):
+        if method == "forwardMessage":
+            key = ("forward", int(params["from_chat_id"]), int(params["message_id"]))
+            self._forwarded.append(
+                (perf_counter(), int(params["chat_id"]), result["message_id"])
+            )
+        elif method == "copyMessage":
+            key = ("copy", int(params["from_chat_id"]), int(params["message_id"]))
+        else:
+            key = ("send", params.get("text"))
+
+        sent_at = self._sent_at.pop(key, None)
+        if sent_at is not None:
+            self.latencies.append(perf_counter() - sent_at)
+
+    def pick_forwarded(self, rng: random.Random) -> Optional[Tuple[int, int]]:
+        now = perf_counter()
+        while self._forwarded and now - self._forwarded[0][0] >= _REPLY_AFTER:
+            _, chat_id, message_id = self._forwarded.popleft()
+            self.repliable.append((chat_id, message_id))
+
+        if not self.repliable:
+            return None
+        return rng.choice(self.repliable)
+
+
+class UpdateFactory:
+    def __init__(self, tracker: Tracker, users: int, seed: int):
+        self._tracker = tracker
+        self._users = users
+        self._rng = random.Random(seed)
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._group_ids = itertools.count(1)
+
+    def create(self, kind: str) -> Tuple[str, dict]:
+        """Return the kind of the created update, which is ``private``
+        for replies until some messages have been forwarded.
+        """
+        if kind == "reply":
+            forwarded = self._tracker.pick_forwarded(self._rng)
+            if forwarded is not None:
+                return kind, self._reply(*forwarded)
+            kind = "private"
+
+        if kind == "member":
+            return kind, self._member()
+        return kind, self._private_message()
+
+    def _message(self, chat_id: int, user_id: int) -> dict:
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "User"},
+            "text": "Benchmark",
+        }
+
+    def _private_message(self) -> dict:
+        user_id = 1_000_000 + self._rng.randrange(self._users)
+        message = self._message(chat_id=user_id, user_id=user_id)
+        self._tracker.expect(("forward", user_id, message["message_id"]))
+        return {"update_id": next(self._update_ids), "message": message}
+
+    def _reply(self, chat_id: int, forwarded_message_id: int) -> dict:
+        message = self._message(chat_id=chat_id, user_id=ADMIN_USER_ID)
+        message["reply_to_message"] = {
+            "message_id": forwarded_message_id,
+            "date": int(time.time()),
+            "chat": message["chat"],
+        }
+        self._tracker.expect(("copy", chat_id, message["message_id"]))
+        return {"update_id": next(self._update_ids), "message": message}
+
+    def _member(self) -> dict:
+        group_id = -1_000_000_000 - next(self._group_ids)
+        self._tracker.expect(("send", f"Group chat {group_id} added"))
+        return {
+            "update_id": next(self._update_ids),
+            "my_chat_member": {
+                "chat": {"id": group_id, "type": "group", "title": "Benchmark"},
+                "from": {"id": ADMIN_USER_ID, "is_bot": False, "first_name": "Admin"},
+                "date": int(time.time()),
+                "old_chat_member": {"user": BOT_USER, "status": "left"},
+                "new_chat_member": {"user": BOT_USER, "status": "member"},
+            },
+        }
+
+
+def _database_url(url: str, name: str) -> str:
+    return urlsplit(url)._replace(path=f"/{name}").geturl()
+
+
+async def create_database(url: str) -> str:
+    """Create and migrate an empty database next to the one at ``url``,
+    with the Admin authenticated in their private chat.
+    """
+    name = urlsplit(url).path.lstrip("/") + "_benchmark"
+    conn = await asyncpg.connect(url)
+    try:
+        await conn.execute(f"DROP DATABASE IF EXISTS {name}")
+        await conn.execute(f"CREATE DATABASE {name}")
+    finally:
+        await conn.close()
+
+    benchmark_url = _database_url(url, name)
+    alembic_cfg = AlembicConfig(str(_ROOT / "alembic.ini"))
+    alembic_cfg.set_main_option("sqlalchemy.url", benchmark_url)
+    await asyncio.get_event_loop().run_in_executor(
+        None, alembic_upgrade, alembic_cfg, "head"
+    )
+
+    conn = await asyncpg.connect(benchmark_url)
+    try:
+        await conn.execute(
+            "INSERT INTO target_chat (chat_id, created_at) VALUES ($1, now())",
+            ADMIN_CHAT_ID,
+        )
+        await conn.execute(
+            "INSERT INTO admin (user_id, target_chat_id) VALUES ($1, $2)",
+            ADMIN_USER_ID,
+            ADMIN_CHAT_ID,
+        )
+    finally:
+        await conn.close()
+
+    return benchmark_url
+
+
+async def drop_database(url: str, benchmark_url: str):
+    conn = await asyncpg.connect(url)
+    try:
+        await conn.execute(
+            f"DROP DATABASE IF EXISTS {urlsplit(benchmark_url).path.lstrip('/')}"
+        )
+    finally:
+        await conn.close()
+
+
+async def start_bot(
+    args: argparse.Namespace, database_url: str
+) -> asyncio.subprocess.Process:
+    env = {
+        **os.environ,
+        "TELEGRAM_BOT_TOKEN": BOT_TOKEN,
+        "TELEGRAM_API_SERVER": f"http://{args.host}:{args.api_port}",
+        "TELEGRAM_UPDATES_MODE": "webhook",
+        "TELEGRAM_WEBHOOK_HOST": f"http://{args.host}:{args.port}",
+        "TELEGRAM_WEBHOOK_PATH": WEBHOOK_PATH,
+        # Rate limits of the real Bot API would cap the throughput
+        "TELEGRAM_GLOBAL_RATE_LIMIT": "100000",
+        "TELEGRAM_PRIVATE_CHAT_RATE_LIMIT": "100000",
+        "TELEGRAM_GROUP_CHAT_RATE_LIMIT": "100000",
+        "ADMIN_TOKEN": "benchmark",
+        "DATABASE_URL": database_url,
+        "HOST": args.host,
+        "PORT": str(args.port),
+    }
+    for setting in args.bot_setting:
+        key, _, value = setting.partition("=")
+        env[key.upper()] = value
+
+    return await asyncio.create_subprocess_exec(
+        sys.executable, "-m", "feedback_bot", cwd=_ROOT, env=env
+    )
+
+
+async def stop_bot(process: asyncio.subprocess.Process):
+    if process.returncode is None:
+        process.terminate()
+        await process.wait()
+
+
+async def wait_until_ready(
+    session: aiohttp.ClientSession,
+    metrics_url: str,
+    process: asyncio.subprocess.Process,
+    timeout: float = 30.0,
+):
+    deadline = perf_counter() + timeout
+    while perf_counter() < deadline:
+        if process.returncode is not None:
+            raise RuntimeError(f"Bot exited with code {process.returncode}")
+        try:
+            async with session.get(metrics_url) as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+
+    raise RuntimeError(f"Bot didn't start in {timeout:.0f}s")
+
+
+class PoolSampler:
+    """Samples pool gauges from the metrics of the bot.
+
+    With several workers each sample comes from one of them.
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, metrics_url: str):
+        self._session = session
+        self._metrics_url = metrics_url
+        self.samples: List[Dict[str, float]] = []
+
+    async def run(self, interval: float):
+        while True:
+            try:
+                async with self._session.get(self._metrics_url) as response:
+                    text = await response.text()
+            except aiohttp.ClientError:
+                pass
+            else:
+                values = {
+                    name: float(value)
+                    for name, value in _METRIC_LINE.findall(text)
+                    if name in _POOL_GAUGES
+                }
+                if len(values) == len(_POOL_GAUGES):
+                    self.samples.append(values)
+            await asyncio.sleep(interval)
+
+    def summary(self) -> Dict[str, Optional[float]]:
+        if not self.samples:
+            return {"pool_exhausted_share": None, "pool_max_waiters": None}
+
+        exhausted = sum(
+            1
+            for sample in self.samples
+            if sample["postgres_pool_idle"] == 0 and sample["postgres_pool_size"] > 0
+        )
+        return {
+            "pool_exhausted_share": exhausted / len(self.samples),
+            "pool_max_waiters": max(
+                sample["postgres_pool_waiters"] for sample in self.samples
+            ),
+        }
+
+
+async def post_update(
+    session: aiohttp.ClientSession,
+    webhook_url: str,
+    update: dict,
+    latencies: List[float],
+    errors: List[int],
+):
+    started_at = perf_counter()
+    try:
+        async with session.post(webhook_url, json=update) as response:
+            await response.read()
+            status = response.status
+    except aiohttp.ClientError:
+        status = 0
+
+    if status == 200:
+        latencies.append(perf_counter() - started_at)
+    else:
+        errors.append(status)
+
+
+async def drive_load(
+    session: aiohttp.ClientSession,
+    webhook_url: str,
+    factory: UpdateFactory,
+    args: argparse.Namespace,
+) -> Tuple[List[float], List[int], Dict[str, int], float]:
+    """Post updates at ``args.rate`` per second, not waiting for responses,
+    so that a slow bot doesn't lower the offered load.
+    """
+    rng = random.Random(args.seed)
+    kinds, weights = zip(*args.mix.items())
+    latencies: List[float] = []
+    errors: List[int] = []
+    sent = dict.fromkeys(UPDATE_KINDS, 0)
+    requests = []
+
+    started_at = perf_counter()
+    for index in range(int(args.rate * args.duration)):
+        delay = started_at + index / args.rate - perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        kind, update = factory.create(rng.choices(kinds, weights)[0])
+        sent[kind] += 1
+        requests.append(
+            asyncio.ensure_future(
+                post_update(session, webhook_url, update, latencies, errors)
+            )
+        )
+
+    await asyncio.gather(*requests)
+    return latencies, errors, sent, perf_counter() - started_at
+
+
+async def wait_for_requests(tracker: Tracker, timeout: float):
+    deadline = perf_counter() + timeout
+    while tracker.pending and perf_counter() < deadline:
+        await asyncio.sleep(0.1)
+
+
+def _ms(value: Optional[float]) -> Optional[float]:
+    return round(value * 1000, 1) if value is not None else None
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Optional[float]]:
+    tracker = Tracker()
+    api = FakeBotAPI(
+        latency=args.api_latency,
+        jitter=args.api_jitter,
+        rate_limited_share=args.rate_limited_share,
+        retry_after=args.retry_after,
+        on_request=tracker.on_request,
+        seed=args.seed,
+    )
+    base_url = f"http://{args.host}:{args.port}"
+    connector = aiohttp.TCPConnector(limit=args.connections)
+    timeout = aiohttp.ClientTimeout(total=60)
+
+    benchmark_url = await create_database(args.database_url)
+    await api.start(args.host, args.api_port)
+    process = await start_bot(args, benchmark_url)
+    try:
+        async with aiohttp.ClientSession(
+            connector=connector, timeout=timeout
+        ) as session:
+            await wait_until_ready(session, base_url + "/metrics", process)
+
+            sampler = PoolSampler(session, base_url + "/metrics")
+            sampling = asyncio.ensure_future(sampler.run(args.sample_interval))
+            try:
+                factory = UpdateFactory(tracker, args.users, args.seed)
+                latencies, errors, sent, elapsed = await drive_load(
+                    session, base_url + WEBHOOK_PATH, factory, args
+                )
+                await wait_for_requests(tracker, args.drain_timeout)
+            finally:
+                sampling.cancel()
+    finally:
+        await stop_bot(process)
+        await api.close()
+        await drop_database(args.database_url, benchmark_url)
+
+    total = sum(sent.values())
+    return {
+        **{f"sent_{kind}": count for kind, count in sent.items()},
+        "throughput": round(len(latencies) / elapsed, 1),
+        "errors": len(errors),
+        "webhook_p50": _ms(percentile(latencies, 0.50)),
+        "webhook_p95": _ms(percentile(latencies, 0.95)),
+        "webhook_p99": _ms(percentile(latencies, 0.99)),
+        "e2e_p50": _ms(percentile(tracker.latencies, 0.50)),
+        "e2e_p95": _ms(percentile(tracker.latencies, 0.95)),
+        "e2e_p99": _ms(percentile(tracker.latencies, 0.99)),
+        "incomplete": tracker.pending,
+        "incomplete_share": round(tracker.pending / total, 4) if total else 0,
+        "rate_limited": api.rate_limited,
+        **sampler.summary(),
+    }
+
+
+def _print_results(results: Dict[str, Optional[float]]):
+    width = max(len(name) for name in results)
+    for name, value in results.items():
+        print(f"{name:<{width}} {'-' if value is None else value}")
+
+
+def main(args: argparse.Namespace) -> int:
+    if not args.database_url:
+        print("Database URL is required, pass --database-url or set DATABASE_URL")
+        return 2
+
+    results = asyncio.run(run(args))
+    _print_results(results)
+    return baseline.check(
+        args.baseline,
+        args.scenario,
+        results,
+        save_baseline=args.save_baseline,
+        tolerance=args.tolerance,
+        higher_is_better=("throughput",),
+        lower_is_better=_LATENCIES,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default=os.environ.get("DATABASE_URL"))
+    parser.add_argument("--rate", type=float, default=50, help="updates per second")
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument(
+        "--mix", type=parse_mix, default=parse_mix("private=0.7,reply=0.2,member=0.1")
+    )
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--api-latency", type=float, default=0.05)
+    parser.add_argument("--api-jitter", type=float, default=0.02)
+    parser.add_argument("--rate-limited-share", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3100)
+    parser.add_argument("--api-port", type=int, default=3101)
+    parser.add_argument(
+        "--connections", type=int, default=100, help="webhook connections"
+    )
+    parser.add_argument("--sample-interval", type=float, default=0.5)
+    parser.add_argument("--drain-timeout", type=float, default=30)
+    parser.add_argument(
+        "--bot-setting",
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="bot option, for example workers=4",
+    )
+    parser.add_argument("--scenario", default="default")
+    parser.add_argument(
+        "--baseline", type=Path, default=baseline.BASELINES_DIR / "webhook_load.json"
+    )
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    sys.exit(main(parser.parse_args()))
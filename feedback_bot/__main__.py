@@ -1,5 +1,3 @@
-from dependency_injector import providers
-
 from feedback_bot.main import main
 
 
@@ -0,0 +1,148 @@
+import asyncio
+from abc import ABC, abstractmethod
+from typing import (
+    Awaitable,
+    Callable,
+    Dict,
+    Generic,
+    Hashable,
+    Iterable,
+    List,
+    Optional,
+    TypeVar,
+)
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Deduplicates concurrent loads of the same key.
+
+    While a load for a key is in progress, other callers asking for the same
+    key await its result instead of starting a load of their own.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+
+    def _forget(self, key: Hashable, future: asyncio.Future):
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+
+    async def do(self, key: Hashable, load: Callable[[], Awaitable[T]]) -> T:
+        while True:
+            future = self._in_flight.get(key)
+            if future is None:
+                future = asyncio.ensure_future(load())
+                self._in_flight[key] = future
+                future.add_done_callback(lambda f: self._forget(key, f))
+                return await future
+
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # Caller that started the load has been cancelled,
+                # so the load has to be started again.
+                if not future.cancelled():
+                    raise
+
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class Registry(ABC, Generic[K, V]):
+    """Process-wide in-memory copy of a small table.
+
+    The registry is loaded in full on first use and then kept up to date
+    by cached repositories, which apply their changes after the unit
+    of work commits.
+    """
+
+    hits: int
+    misses: int
+
+    def __init__(self):
+        self._items: Optional[Dict[K, V]] = None
+        self._loads = SingleFlight()
+        # Changes committed while the registry is being loaded. The snapshot
+        # may predate them, so they are replayed once the load finishes.
+        self._changes_during_load: Optional[List[Callable[[], None]]] = None
+        self._generation = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    @abstractmethod
+    def key(item: V) -> K:
+        raise NotImplementedError
+
+    @property
+    def loaded(self) -> bool:
+        return self._items is not None
+
+    async def load(self, load_all: Callable[[], Awaitable[Iterable[V]]]):
+        if self._items is not None:
+            self.hits += 1
+            return
+
+        self.misses += 1
+        while self._items is None:
+            await self._loads.do(None, lambda: self._load(load_all))
+
+    async def _load(self, load_all: Callable[[], Awaitable[Iterable[V]]]):
+        generation = self._generation
+        self._changes_during_load = []
+        try:
+            items = await load_all()
+        finally:
+            changes, self._changes_during_load = self._changes_during_load, None
+
+        if generation != self._generation:
+            # Invalidated while loading, the snapshot may already be stale.
+            return
+
+        self._items = {self.key(item): item for item in items}
+        self._on_loaded()
+        for change in changes:
+            change()
+
+    def invalidate(self):
+        """Drop the loaded items, so they are reloaded on next use."""
+        self._generation += 1
+        self._items = None
+
+    def get(self, key: K) -> Optional[V]:
+        return self._items.get(key)
+
+    def get_all(self) -> List[V]:
+        return list(self._items.values())
+
+    def add(self, item: V):
+        if self._changes_during_load is not None:
+            self._changes_during_load.append(lambda: self.add(item))
+        if self._items is None:
+            return
+
+        self._items[self.key(item)] = item
+        self._on_added(item)
+
+    def remove(self, key: K):
+        if self._changes_during_load is not None:
+            self._changes_during_load.append(lambda: self.remove(key))
+        if self._items is None:
+            return
+
+        removed = self._items.pop(key, None)
+        if removed is not None:
+            self._on_removed(removed)
+
+    def _on_loaded(self):
+        pass
+
+    def _on_added(self, item: V):
+        pass
+
+    def _on_removed(self, item: V):
+        pass
@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import asyncio
+from contextlib import asynccontextmanager
+from time import perf_counter
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, Iterable, Optional, Sequence
+
+from feedback_bot import metrics, tracing
+from feedback_bot.adapters import statements
+from feedback_bot.adapters.query_log import SlowQueryLog
+
+if TYPE_CHECKING:
+    import asyncpg
+
+pool_wait = metrics.histogram(
+    "postgres_pool_acquire_wait_seconds",
+    "Time spent waiting for a connection from the pool",
+)
+connection_hold = metrics.histogram(
+    "postgres_connection_hold_seconds",
+    "Time a unit of work holds a pool connection",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+pool_waiters = metrics.gauge(
+    "postgres_pool_waiters",
+    "Units of work waiting for a connection from the pool",
+)
+statement_duration = metrics.labeled_histogram(
+    "postgres_statement_duration_seconds",
+    "Execution time of statements by name, ad hoc queries are labeled ad_hoc",
+    labelnames=("statement",),
+)
+connections_acquired = metrics.counter(
+    "postgres_connections_acquired_total",
+    "Pool connections acquired by units of work",
+)
+connections_skipped = metrics.counter(
+    "postgres_connections_skipped_total",
+    "Units of work finished without acquiring a pool connection",
+)
+
+
+class LazyConnection:
+    """Connection of a unit of work, acquired from the pool on first query.
+
+    The first query acquires a connection and starts a transaction,
+    so units of work that never touch the database don't hold
+    a pool connection at all. Acquiring fails with ``asyncio.TimeoutError``
+    after ``acquire_timeout`` seconds, if given. With ``autocommit``
+    no transaction is started, every statement commits on its own
+    unless it runs in a ``transaction`` block.
+
+    Used as an async context manager, the transaction is committed
+    unless the block raises, and the connection is released.
+
+    Execution time of every query is recorded by statement name,
+    slow queries are reported to ``slow_query_log``.
+    """
+
+    _conn: Optional[asyncpg.Connection]
+    _transaction: Optional[asyncpg.transaction.Transaction]
+    _acquired_at: float
+
+    def __init__(
+        self,
+        pool: asyncpg.Pool,
+        acquire_timeout: Optional[float] = None,
+        slow_query_log: Optional[SlowQueryLog] = None,
+        autocommit: bool = False,
+    ):
+        self._pool = pool
+        self._acquire_timeout = acquire_timeout
+        self._slow_query_log = slow_query_log
+        self._autocommit = autocommit
+        self._lock = asyncio.Lock()
+        self._conn = None
+        self._transaction = None
+
+    async def __aenter__(self) -> "LazyConnection":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                await self.commit()
+            else:
+                await self.rollback()
+        finally:
+            await self.release()
+
+    @property
+    def acquired(self) -> bool:
+        return self._conn is not None
+
+    async def _get(self) -> asyncpg.Connection:
+        if self._conn is not None:
+            return self._conn
+
+        async with self._lock:
+            if self._conn is None:
+                started_at = perf_counter()
+                pool_waiters.inc()
+                try:
+                    with tracing.span("postgres.acquire"):
+                        conn = await self._pool.acquire(timeout=self._acquire_timeout)
+                finally:
+                    pool_waiters.dec()
+                self._acquired_at = perf_counter()
+                pool_wait.observe(self._acquired_at - started_at)
+                connections_acquired.inc()
+
+                transaction = None
+                if not self._autocommit:
+                    try:
+                        transaction = conn.transaction()
+                        await transaction.start()
+                    except BaseException:
+                        await self._pool.release(conn)
+                        raise
+                self._conn, self._transaction = conn, transaction
+
+        return self._conn
+
+    async def _run(
+        self, method: str, query: str, args: Sequence[Any], kwargs: Dict[str, Any]
+    ) -> Any:
+        conn = await self._get()
+        name = statements.name_of(query)
+        started_at = perf_counter()
+        try:
+            with tracing.span("postgres.query") as span:
+                span.set("statement", name)
+                result = await getattr(conn, method)(query, *args, **kwargs)
+        finally:
+            duration = perf_counter() - started_at
+            statement_duration.labels(name).observe(duration)
+
+        if self._slow_query_log is not None and self._slow_query_log.is_slow(duration):
+            await self._slow_query_log.record(conn, name, query, args, duration)
+        return result
+
+    async def fetch(self, query: str, *args, **kwargs) -> list:
+        return await self._run("fetch", query, args, kwargs)
+
+    async def fetchrow(self, query: str, *args, **kwargs) -> Optional[asyncpg.Record]:
+        return await self._run("fetchrow", query, args, kwargs)
+
+    async def fetchval(self, query: str, *args, **kwargs) -> Any:
+        return await self._run("fetchval", query, args, kwargs)
+
+    async def execute(self, query: str, *args, **kwargs) -> str:
+        return await self._run("execute", query, args, kwargs)
+
+    async def executemany(self, command: str, args: Iterable, **kwargs):
+        # Explaining one statement for a batch of parameters is meaningless
+        conn = await self._get()
+        name = statements.name_of(command)
+        started_at = perf_counter()
+        try:
+            with tracing.span("postgres.query") as span:
+                span.set("statement", name)
+                return await conn.executemany(command, args, **kwargs)
+        finally:
+            statement_duration.labels(name).observe(perf_counter() - started_at)
+
+    async def copy_records_to_table(self, table_name: str, **kwargs) -> str:
+        conn = await self._get()
+        name = f"{table_name}.copy"
+        started_at = perf_counter()
+        try:
+            with tracing.span("postgres.query") as span:
+                span.set("statement", name)
+                return await conn.copy_records_to_table(table_name, **kwargs)
+        finally:
+            statement_duration.labels(name).observe(perf_counter() - started_at)
+
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator[None]:
+        """Run the block in a transaction, or a savepoint unless ``autocommit``."""
+        conn = await self._get()
+        async with conn.transaction():
+            yield
+
+    async def commit(self):
+        if self._transaction is not None:
+            await self._transaction.commit()
+
+    async def rollback(self):
+        if self._transaction is not None:
+            await self._transaction.rollback()
+
+    async def release(self):
+        if self._conn is None:
+            connections_skipped.inc()
+            return
+
+        conn, self._conn, self._transaction = self._conn, None, None
+        await self._pool.release(conn)
+        connection_hold.observe(perf_counter() - self._acquired_at)
@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import asyncio
+import json
+from logging import getLogger
+from typing import TYPE_CHECKING, Awaitable, Callable, Dict, Iterable, Optional
+
+from feedback_bot import metrics
+from feedback_bot.adapters.cache import Registry
+
+if TYPE_CHECKING:
+    import asyncpg
+
+log = getLogger(__name__)
+
+CHANNEL = "feedback_bot_cache_invalidation"
+
+# Names of the registries in notifications
+TARGET_CHAT_REGISTRY = "target_chat"
+ADMIN_DIRECTORY = "admin"
+
+notifications_received = metrics.counter(
+    "cache_invalidation_notifications_received_total",
+    "Cache invalidation notifications received from other nodes",
+)
+listener_reconnects = metrics.counter(
+    "cache_invalidation_listener_reconnects_total",
+    "Reconnections of the cache invalidation listener",
+)
+
+
+class CacheInvalidationBus:
+    """Keeps registries of several bot nodes sharing a database in sync.
+
+    A unit of work changing cached tables notifies the other nodes
+    with NOTIFY in its transaction, so the notification is delivered
+    only if the transaction commits. Every node listens on a dedicated
+    connection and invalidates the changed registries, which are then
+    reloaded on next use. Notifications sent while the listener is
+    disconnected are lost, so all registries are invalidated whenever
+    the listener (re)connects.
+    """
+
+    def __init__(
+        self,
+        dsn: str,
+        registries: Dict[str, Registry],
+        node_id: str,
+        reconnect_interval: float = 5.0,
+        keepalive_interval: float = 30.0,
+        connect: Optional[Callable[[str], Awaitable[asyncpg.Connection]]] = None,
+    ):
+        self._dsn = dsn
+        self._registries = registries
+        self._node_id = node_id
+        self._reconnect_interval = reconnect_interval
+        self._keepalive_interval = keepalive_interval
+        self._connect = connect
+        self._listening = asyncio.Event()
+
+    async def notify(self, conn: asyncpg.Connection, registry_names: Iterable[str]):
+        """Notify other nodes about changes made in the transaction of ``conn``."""
+        payload = json.dumps({"node": self._node_id, "registries": list(registry_names)})
+        await conn.execute("SELECT pg_notify($1, $2)", CHANNEL, payload)
+
+    async def wait_listening(self):
+        """Wait until the listener is subscribed, having invalidated
+        the registries for the changes it missed.
+        """
+        await self._listening.wait()
+
+    async def listen(self):
+        """Apply notifications of other nodes until cancelled."""
+        import asyncpg
+
+        connect = self._connect or asyncpg.connect
+        connected_once = False
+        while True:
+            try:
+                conn = await connect(self._dsn)
+            except (OSError, asyncpg.PostgresError):
+                log.exception("Failed to connect cache invalidation listener")
+                await asyncio.sleep(self._reconnect_interval)
+                continue
+
+            if connected_once:
+                listener_reconnects.inc()
+            connected_once = True
+
+            try:
+                await self._listen(conn)
+            except (
+                OSError,
+                asyncio.TimeoutError,
+                asyncpg.PostgresError,
+                asyncpg.InterfaceError,
+            ):
+                log.exception("Cache invalidation listener disconnected")
+            finally:
+                self._listening.clear()
+                if not conn.is_closed():
+                    conn.terminate()
+
+            await asyncio.sleep(self._reconnect_interval)
+
+    async def _listen(self, conn: asyncpg.Connection):
+        terminated = asyncio.Event()
+        conn.add_termination_listener(lambda conn: terminated.set())
+        await conn.add_listener(CHANNEL, self._handle_notification)
+
+        # Changes made while disconnected have been missed
+        self._invalidate(self._registries)
+        self._listening.set()
+        log.info("Listening for cache invalidation notifications")
+
+        while not terminated.is_set():
+            try:
+                await asyncio.wait_for(terminated.wait(), self._keepalive_interval)
+            except asyncio.TimeoutError:
+                await asyncio.wait_for(
+                    conn.execute("SELECT 1"), self._keepalive_interval
+                )
+
+    def _handle_notification(
+        self, conn: asyncpg.Connection, pid: int, channel: str, payload: str
+    ):
+        try:
+            message = json.loads(payload)
+            node_id, registry_names = message["node"], message["registries"]
+        except (ValueError, KeyError, TypeError):
+            log.warning("Ignoring malformed cache invalidation payload %r", payload)
+            return
+
+        if node_id == self._node_id:
+            # Own changes are applied to the registries on commit
+            return
+
+        notifications_received.inc()
+        self._invalidate(registry_names)
+
+    def _invalidate(self, registry_names: Iterable[str]):
+        for name in registry_names:
+            registry: Optional[Registry] = self._registries.get(name)
+            if registry is not None:
+                registry.invalidate()
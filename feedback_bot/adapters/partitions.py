@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, List, Optional
+
+from feedback_bot import metrics
+
+if TYPE_CHECKING:
+    import asyncpg
+
+FORWARDED_MESSAGE_TABLE = "forwarded_message"
+DEFAULT_PARTITION = f"{FORWARDED_MESSAGE_TABLE}_default"
+
+default_partition_rows = metrics.gauge(
+    "forwarded_message_default_partition_rows",
+    "Forwarded messages in the default partition, outside of monthly partitions",
+)
+
+_PARTITION_NAME_RE = re.compile(rf"^{FORWARDED_MESSAGE_TABLE}_p(\d{{4}})(\d{{2}})$")
+
+
+def _month_start(dt: datetime) -> datetime:
+    dt = dt.astimezone(timezone.utc)
+    return datetime(dt.year, dt.month, 1, tzinfo=timezone.utc)
+
+
+def _add_months(month_start: datetime, months: int) -> datetime:
+    month_index = month_start.year * 12 + month_start.month - 1 + months
+    return datetime(month_index // 12, month_index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+@dataclass(frozen=True)
+class Partition:
+    """Monthly partition of the forwarded_message table."""
+
+    name: str
+    start: datetime
+    end: datetime
+
+    @classmethod
+    def for_month(cls, month_start: datetime) -> "Partition":
+        return cls(
+            name=f"{FORWARDED_MESSAGE_TABLE}_p{month_start:%Y%m}",
+            start=month_start,
+            end=_add_months(month_start, 1),
+        )
+
+    @classmethod
+    def from_name(cls, name: str) -> Optional["Partition"]:
+        match = _PARTITION_NAME_RE.match(name)
+        if not match:
+            return None
+
+        year, month = (int(group) for group in match.groups())
+        return cls.for_month(datetime(year, month, 1, tzinfo=timezone.utc))
+
+
+class ForwardedMessagePartitionManager:
+    """Creates and drops monthly partitions of the forwarded_message table.
+
+    Rows of months without a partition end up in the default partition,
+    so inserts never fail. Partitions are created ahead of time, a partition
+    created for a month with rows in the default partition takes them over.
+    """
+
+    def __init__(self, conn: asyncpg.Connection, lock_timeout: float = 5.0):
+        self._conn = conn
+        self._lock_timeout = lock_timeout
+
+    async def get_partitions(self) -> List[Partition]:
+        rows = await self._conn.fetch(
+            """
+            SELECT
+                child.relname AS name
+            FROM
+                pg_inherits INNER JOIN pg_class AS child
+                    ON pg_inherits.inhrelid = child.oid
+            WHERE
+                pg_inherits.inhparent = $1::regclass
+            """,
+            FORWARDED_MESSAGE_TABLE,
+        )
+        partitions = (Partition.from_name(row["name"]) for row in rows)
+        return sorted(
+            (partition for partition in partitions if partition),
+            key=lambda partition: partition.start,
+        )
+
+    async def create_partitions(
+        self, months_ahead: int, now: Optional[datetime] = None
+    ) -> List[Partition]:
+        """Create partitions from the current month up to ``months_ahead``
+        months ahead and return the created ones.
+        """
+        current_month = _month_start(now or datetime.now(timezone.utc))
+        existing = {partition.name for partition in await self.get_partitions()}
+
+        created = []
+        for months in range(months_ahead + 1):
+            partition = Partition.for_month(_add_months(current_month, months))
+            if partition.name in existing:
+                continue
+
+            async with self._conn.transaction():
+                await self._set_lock_timeout()
+                if await self._has_default_rows(partition):
+                    await self._create_from_default(partition)
+                else:
+                    await self._create(partition)
+            created.append(partition)
+
+        return created
+
+    async def count_default_rows(self) -> int:
+        """Count rows of the default partition and report them
+        as ``forwarded_message_default_partition_rows``.
+        """
+        count = await self._conn.fetchval(f"SELECT count(*) FROM {DEFAULT_PARTITION}")
+        default_partition_rows.set(count)
+        return count
+
+    async def _has_default_rows(self, partition: Partition) -> bool:
+        return await self._conn.fetchval(
+            f"""
+            SELECT EXISTS (
+                SELECT
+                FROM
+                    {DEFAULT_PARTITION}
+                WHERE
+                    created_at >= $1
+                    AND created_at < $2
+            )
+            """,
+            partition.start,
+            partition.end,
+        )
+
+    async def _create(self, partition: Partition):
+        await self._conn.execute(
+            f"""
+            CREATE TABLE {partition.name}
+            PARTITION OF {FORWARDED_MESSAGE_TABLE}
+            FOR VALUES
+                FROM ('{partition.start.isoformat()}')
+                TO ('{partition.end.isoformat()}')
+            """
+        )
+
+    async def _create_from_default(self, partition: Partition):
+        # A partition can't be created while the default partition has
+        # rows of its range, so they're moved over with the default
+        # partition detached, in the transaction of the caller.
+        await self._conn.execute(
+            f"""
+            ALTER TABLE {FORWARDED_MESSAGE_TABLE}
+            DETACH PARTITION {DEFAULT_PARTITION}
+            """
+        )
+        await self._create(partition)
+        await self._conn.execute(
+            f"""
+            WITH moved AS (
+                DELETE
+                FROM
+                    {DEFAULT_PARTITION}
+                WHERE
+                    created_at >= $1
+                    AND created_at < $2
+                RETURNING
+                    forwarded_message_id,
+                    target_chat_id,
+                    origin_chat_id,
+                    created_at
+            )
+            INSERT INTO {partition.name} (
+                forwarded_message_id,
+                target_chat_id,
+                origin_chat_id,
+                created_at
+            )
+            SELECT
+                forwarded_message_id,
+                target_chat_id,
+                origin_chat_id,
+                created_at
+            FROM
+                moved
+            """,
+            partition.start,
+            partition.end,
+        )
+        await self._conn.execute(
+            f"""
+            ALTER TABLE {FORWARDED_MESSAGE_TABLE}
+            ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT
+            """
+        )
+
+    async def drop_partitions(self, before: datetime) -> List[Partition]:
+        """Drop partitions containing only rows created before ``before``
+        and return the dropped ones.
+        """
+        dropped = []
+        for partition in await self.get_partitions():
+            if partition.end > before:
+                break
+
+            async with self._conn.transaction():
+                await self._set_lock_timeout()
+                await self._conn.execute(
+                    f"""
+                    ALTER TABLE {FORWARDED_MESSAGE_TABLE}
+                    DETACH PARTITION {partition.name}
+                    """
+                )
+                await self._conn.execute(f"DROP TABLE {partition.name}")
+            dropped.append(partition)
+
+        return dropped
+
+    async def _set_lock_timeout(self):
+        # Partition DDL locks the parent table, so don't queue up behind
+        # long transactions and block message processing meanwhile.
+        await self._conn.execute(
+            f"SET LOCAL lock_timeout = '{int(self._lock_timeout * 1000)}ms'"
+        )
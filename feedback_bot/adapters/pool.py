@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import asyncio
+from logging import getLogger
+from typing import TYPE_CHECKING, Optional, Set
+
+from feedback_bot import metrics
+
+if TYPE_CHECKING:
+    import asyncpg
+
+log = getLogger(__name__)
+
+pool_size = metrics.gauge(
+    "postgres_pool_size",
+    "Open connections of the pool",
+)
+pool_idle = metrics.gauge(
+    "postgres_pool_idle",
+    "Open connections of the pool not used by anyone",
+)
+health_check_failures = metrics.counter(
+    "postgres_pool_health_check_failures_total",
+    "Idle pool connections closed after failing a health check",
+)
+
+
+def bind_metrics(pool: Optional[asyncpg.Pool]):
+    """Report the connections of ``pool``, or nothing once it is ``None``."""
+    pool_size.set_function(pool.get_size if pool is not None else None)
+    pool_idle.set_function(pool.get_idle_size if pool is not None else None)
+
+
+class PoolHealthCheck:
+    """Pings idle pool connections every ``interval`` seconds.
+
+    A connection that doesn't respond within ``timeout`` seconds is closed,
+    so the pool opens a new one instead of handing out a connection
+    dropped by the server or a proxy while it was idle.
+    """
+
+    def __init__(self, pool: asyncpg.Pool, interval: float, timeout: float):
+        self._pool = pool
+        self._interval = interval
+        self._timeout = timeout
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self._interval)
+            try:
+                await self.check()
+            except Exception:
+                log.exception("Failed to check idle pool connections")
+
+    async def check(self) -> int:
+        """Check idle connections and return the number of closed ones.
+
+        Connections are checked one at a time, so the check never holds
+        more than one connection the application could use. The pool hands
+        out the most recently released connection first, so the check stops
+        once it gets a connection it has already checked.
+        """
+        checked_pids: Set[int] = set()
+        failed = 0
+        for _ in range(self._pool.get_idle_size()):
+            conn = await self._pool.acquire(timeout=self._timeout)
+            try:
+                pid = conn.get_server_pid()
+                if pid in checked_pids:
+                    break
+                checked_pids.add(pid)
+                if not await self._ping(conn):
+                    failed += 1
+            finally:
+                await self._pool.release(conn)
+
+        if failed:
+            health_check_failures.inc(failed)
+            log.warning("Closed %d broken idle pool connections", failed)
+        return failed
+
+    async def _ping(self, conn: asyncpg.Connection) -> bool:
+        import asyncpg
+
+        try:
+            await conn.execute("SELECT 1", timeout=self._timeout)
+        except (
+            OSError,
+            asyncio.TimeoutError,
+            asyncpg.PostgresError,
+            asyncpg.InterfaceError,
+        ):
+            conn.terminate()
+            return False
+
+        return True
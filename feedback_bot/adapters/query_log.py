@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+from logging import getLogger
+from time import monotonic
+from typing import TYPE_CHECKING, Any, Callable, Dict, Sequence
+
+from feedback_bot import metrics
+from feedback_bot.adapters import statements
+
+if TYPE_CHECKING:
+    import asyncpg
+
+log = getLogger(__name__)
+
+slow_statements = metrics.labeled_counter(
+    "postgres_slow_statements_total",
+    "Statements that took longer than the slow query threshold",
+    labelnames=("statement",),
+)
+
+
+def redact(args: Sequence[Any]) -> str:
+    """Describe query parameters by their types only,
+    as they carry user and chat ids.
+    """
+    return ", ".join(
+        f"${position}: {type(arg).__name__}"
+        for position, arg in enumerate(args, start=1)
+    )
+
+
+class SlowQueryLog:
+    """Logs statements running ``threshold`` seconds or longer.
+
+    With ``explain`` the plan of a slow statement is captured with
+    ``EXPLAIN (ANALYZE, BUFFERS)``, at most once per ``explain_interval``
+    seconds for each statement. ANALYZE executes the statement again,
+    so it runs in a savepoint which is rolled back afterwards, and it
+    delays the unit of work that ran the slow statement.
+    """
+
+    def __init__(
+        self,
+        threshold: float,
+        explain: bool = False,
+        explain_interval: float = 60.0,
+        clock: Callable[[], float] = monotonic,
+    ):
+        self._threshold = threshold
+        self._explain = explain
+        self._explain_interval = explain_interval
+        self._clock = clock
+        self._explained_at: Dict[str, float] = {}
+
+    def is_slow(self, duration: float) -> bool:
+        return duration >= self._threshold
+
+    async def record(
+        self,
+        conn: asyncpg.Connection,
+        name: str,
+        query: str,
+        args: Sequence[Any],
+        duration: float,
+    ):
+        slow_statements.labels(name).inc()
+        log.warning(
+            "Slow statement %s took %.3fs, parameters: (%s)",
+            name if name != statements.AD_HOC else " ".join(query.split()),
+            duration,
+            redact(args),
+        )
+
+        if self._explain and self._should_explain(name):
+            await self._log_plan(conn, name, query, args)
+
+    def _should_explain(self, name: str) -> bool:
+        now = self._clock()
+        explained_at = self._explained_at.get(name)
+        if explained_at is not None and now - explained_at < self._explain_interval:
+            return False
+
+        self._explained_at[name] = now
+        return True
+
+    async def _log_plan(
+        self, conn: asyncpg.Connection, name: str, query: str, args: Sequence[Any]
+    ):
+        import asyncpg
+
+        # Changes made by the analyzed statement are rolled back
+        savepoint = conn.transaction()
+        await savepoint.start()
+        try:
+            rows = await conn.fetch(f"EXPLAIN (ANALYZE, BUFFERS) {query}", *args)
+        except asyncpg.PostgresError:
+            log.warning("Failed to explain slow statement %s", name, exc_info=True)
+            return
+        finally:
+            await savepoint.rollback()
+
+        plan = "\n".join(row[0] for row in rows)
+        log.warning("Plan of slow statement %s:\n%s", name, plan)
@@ -0,0 +1,7 @@
+from feedback_bot import metrics
+
+method_duration = metrics.labeled_histogram(
+    "repository_method_duration_seconds",
+    "Time spent in methods of database repositories",
+    labelnames=("repository", "method"),
+)
@@ -1,10 +1,83 @@
-from abc import abstractmethod, ABC
-from typing import Iterable, Optional, List, Dict
+from __future__ import annotations
 
-import asyncpg
+from abc import abstractmethod, ABC
+from typing import TYPE_CHECKING, Callable, Iterable, Optional, List, Dict
 
+from feedback_bot import metrics
+from feedback_bot.adapters.cache import Registry
+from feedback_bot.adapters.repositories import method_duration
+from feedback_bot.adapters.repositories.target_chat import (
+    AbstractTargetChatRepository,
+    PostgresTargetChatRepository,
+    SqliteTargetChatRepository,
+)
+from feedback_bot.adapters.sqlite import SqliteTransaction, from_timestamp
+from feedback_bot.adapters.statements import statement
 from feedback_bot.model import Admin, TargetChat
 
+if TYPE_CHECKING:
+    import asyncpg
+
+_GET = statement(
+    "admin.get",
+    """
+    SELECT
+        admin.user_id AS user_id,
+        target_chat.chat_id AS target_chat_id,
+        target_chat.created_at AS target_chat_created_at
+    FROM
+        admin INNER JOIN target_chat
+            ON admin.target_chat_id = target_chat.chat_id
+    WHERE
+        admin.user_id = $1
+    """,
+)
+_GET_ALL = statement(
+    "admin.get_all",
+    """
+    SELECT
+        admin.user_id AS user_id,
+        target_chat.chat_id AS target_chat_id,
+        target_chat.created_at AS target_chat_created_at
+    FROM
+        admin INNER JOIN target_chat
+            ON admin.target_chat_id = target_chat.chat_id
+    """,
+)
+_ADD = statement(
+    "admin.add",
+    """
+    INSERT INTO admin (user_id, target_chat_id)
+    VALUES ($1, $2)
+    """,
+)
+
+
+_SQLITE_GET = """
+    SELECT
+        admin.user_id AS user_id,
+        target_chat.chat_id AS target_chat_id,
+        target_chat.created_at AS target_chat_created_at
+    FROM
+        admin INNER JOIN target_chat
+            ON admin.target_chat_id = target_chat.chat_id
+    WHERE
+        admin.user_id = ?
+"""
+_SQLITE_GET_ALL = """
+    SELECT
+        admin.user_id AS user_id,
+        target_chat.chat_id AS target_chat_id,
+        target_chat.created_at AS target_chat_created_at
+    FROM
+        admin INNER JOIN target_chat
+            ON admin.target_chat_id = target_chat.chat_id
+"""
+_SQLITE_ADD = """
+    INSERT INTO admin (user_id, target_chat_id)
+    VALUES (?, ?)
+"""
+
 
 class AbstractAdminRepository(ABC):
     @abstractmethod
@@ -21,63 +94,141 @@ class AbstractAdminRepository(ABC):
 
 
 class PostgresAdminRepository(AbstractAdminRepository):
-    def __init__(self, conn: asyncpg.Connection):
+    def __init__(
+        self,
+        conn: asyncpg.Connection,
+        target_chats: Optional[AbstractTargetChatRepository] = None,
+    ):
         self._conn = conn
+        self._target_chats = target_chats or PostgresTargetChatRepository(conn)
 
     @staticmethod
     def row_to_model(row: asyncpg.Record) -> Admin:
-        target_chat = TargetChat(
-            chat_id=row["target_chat_id"],
-            created_at=row["target_chat_created_at"],
-        )
-        return Admin(user_id=row["user_id"], target_chat=target_chat)
+        # Columns are read by position, in the order of the statements above
+        return Admin(row[0], TargetChat(row[1], row[2]))
 
+    @metrics.timed(method_duration.labels("admin", "get"))
     async def get(self, user_id: int):
-        row = await self._conn.fetchrow(
-            """
-            SELECT
-                admin.user_id AS user_id,
-                target_chat.chat_id AS target_chat_id,
-                target_chat.created_at AS target_chat_created_at
-            FROM
-                admin INNER JOIN target_chat
-                    ON admin.target_chat_id = target_chat.chat_id
-            WHERE
-                admin.user_id = $1
-            """,
-            user_id,
-        )
+        row = await self._conn.fetchrow(_GET, user_id)
         if not row:
             return None
         
         return self.row_to_model(row)
 
+    @metrics.timed(method_duration.labels("admin", "get_all"))
     async def get_all(self):
-        rows = await self._conn.fetch(
-            """
-            SELECT
-                admin.user_id AS user_id,
-                target_chat.chat_id AS target_chat_id,
-                target_chat.created_at AS target_chat_created_at
-            FROM
-                admin INNER JOIN target_chat
-                    ON admin.target_chat_id = target_chat.chat_id
-            """
-        )
+        rows = await self._conn.fetch(_GET_ALL)
         return [self.row_to_model(row) for row in rows]
 
+    @metrics.timed(method_duration.labels("admin", "add"))
     async def add(self, admin: Admin):
+        await self._target_chats.add(admin.target_chat)
         await self._conn.execute(
-            """
-            INSERT INTO target_chat (chat_id, created_at)
-            VALUES ($1, $2)
-            """,
-            admin.target_chat.chat_id, admin.target_chat.created_at
+            _ADD,
+            admin.user_id, admin.target_chat.chat_id
         )
+
+
+class SqliteAdminRepository(AbstractAdminRepository):
+    def __init__(
+        self,
+        conn: SqliteTransaction,
+        target_chats: Optional[AbstractTargetChatRepository] = None,
+    ):
+        self._conn = conn
+        self._target_chats = target_chats or SqliteTargetChatRepository(conn)
+
+    @staticmethod
+    def row_to_model(row: tuple) -> Admin:
+        return Admin(row[0], TargetChat(row[1], from_timestamp(row[2])))
+
+    @metrics.timed(method_duration.labels("admin", "get"))
+    async def get(self, user_id: int):
+        row = await self._conn.fetchrow(_SQLITE_GET, user_id)
+        if not row:
+            return None
+
+        return self.row_to_model(row)
+
+    @metrics.timed(method_duration.labels("admin", "get_all"))
+    async def get_all(self):
+        rows = await self._conn.fetch(_SQLITE_GET_ALL)
+        return [self.row_to_model(row) for row in rows]
+
+    @metrics.timed(method_duration.labels("admin", "add"))
+    async def add(self, admin: Admin):
+        await self._target_chats.add(admin.target_chat)
         await self._conn.execute(
-            """
-            INSERT INTO admin (user_id, target_chat_id)
-            VALUES ($1, $2)
-            """,
-            admin.user_id, admin.target_chat.chat_id
+            _SQLITE_ADD, admin.user_id, admin.target_chat.chat_id
         )
+
+
+class AdminDirectory(Registry[int, Admin]):
+    """Process-wide in-memory copy of all admins and their target chats."""
+
+    @staticmethod
+    def key(admin: Admin) -> int:
+        return admin.user_id
+
+
+class CachedAdminRepository(AbstractAdminRepository):
+    """Serves reads from an AdminDirectory.
+
+    Added admins are written to the wrapped repository right away
+    and are applied to the directory by ``publish`` once the unit of work
+    has committed. Like CachedTargetChatRepository, reads go to the wrapped
+    repository instead of loading the directory once the unit of work
+    has uncommitted changes of cached tables.
+    """
+
+    def __init__(
+        self,
+        repository: AbstractAdminRepository,
+        directory: AdminDirectory,
+        has_changes: Optional[Callable[[], bool]] = None,
+    ):
+        self._repository = repository
+        self._directory = directory
+        self._has_changes = has_changes
+
+        self._added: Dict[int, Admin] = {}
+
+    @property
+    def changed(self) -> bool:
+        return bool(self._added)
+
+    async def _load(self) -> bool:
+        """Load the directory and return whether reads can be served from it."""
+        if not self._directory.loaded and (
+            self.changed or (self._has_changes is not None and self._has_changes())
+        ):
+            return False
+
+        await self._directory.load(self._repository.get_all)
+        return True
+
+    async def get(self, user_id: int):
+        if user_id in self._added:
+            return self._added[user_id]
+
+        if not await self._load():
+            return await self._repository.get(user_id)
+        return self._directory.get(user_id)
+
+    async def get_all(self):
+        if not await self._load():
+            return await self._repository.get_all()
+        admins = {admin.user_id: admin for admin in self._directory.get_all()}
+        admins.update(self._added)
+        return list(admins.values())
+
+    async def add(self, admin: Admin):
+        await self._repository.add(admin)
+        self._added[admin.user_id] = admin
+
+    async def publish(self):
+        """Apply committed changes to the directory."""
+        for admin in self._added.values():
+            self._directory.add(admin)
+
+        self._added.clear()
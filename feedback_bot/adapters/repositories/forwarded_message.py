@@ -1,10 +1,157 @@
-from abc import ABC, abstractmethod
-from typing import Dict, Iterable, Optional, Tuple
+from __future__ import annotations
 
-import asyncpg
+import asyncio
+import contextlib
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from logging import getLogger
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
 
+from feedback_bot import metrics
+from feedback_bot.adapters.connection import LazyConnection
+from feedback_bot.adapters.query_log import SlowQueryLog
+from feedback_bot.adapters.repositories import method_duration
+from feedback_bot.adapters.repositories.outbox import PostgresOutboxRepository
+from feedback_bot.adapters.sqlite import SqliteTransaction, from_timestamp, to_timestamp
+from feedback_bot.adapters.statements import statement
 from feedback_bot.model import ForwardedMessage
 
+if TYPE_CHECKING:
+    import asyncpg
+
+log = getLogger(__name__)
+
+messages_dropped = metrics.counter(
+    "forwarded_messages_dropped_total",
+    "Buffered forwarded messages dropped as they couldn't be written",
+)
+
+_GET = statement(
+    "forwarded_message.get",
+    """
+    SELECT
+        forwarded_message_id,
+        target_chat_id,
+        origin_chat_id,
+        created_at
+    FROM
+        forwarded_message
+    WHERE
+        forwarded_message_id = $1
+        AND target_chat_id = $2
+    ORDER BY created_at DESC
+    LIMIT 1
+    """,
+)
+# Bounded by created_at, so that only the recent partitions are scanned
+_GET_CREATED_SINCE = statement(
+    "forwarded_message.get_created_since",
+    """
+    SELECT
+        forwarded_message_id,
+        target_chat_id,
+        origin_chat_id,
+        created_at
+    FROM
+        forwarded_message
+    WHERE
+        forwarded_message_id = $1
+        AND target_chat_id = $2
+        AND created_at >= $3
+    ORDER BY created_at DESC
+    LIMIT 1
+    """,
+)
+_ADD = statement(
+    "forwarded_message.add",
+    """
+    INSERT INTO forwarded_message (
+        forwarded_message_id,
+        target_chat_id,
+        origin_chat_id,
+        created_at
+    )
+    VALUES ($1, $2, $3, $4)
+    """,
+)
+_ADD_IF_ABSENT = statement(
+    "forwarded_message.add_if_absent",
+    """
+    INSERT INTO forwarded_message (
+        forwarded_message_id,
+        target_chat_id,
+        origin_chat_id,
+        created_at
+    )
+    VALUES ($1, $2, $3, $4)
+    ON CONFLICT DO NOTHING
+    """,
+)
+_REMOVE_CREATED_BEFORE = statement(
+    "forwarded_message.remove_created_before",
+    """
+    WITH batch AS (
+        SELECT
+            forwarded_message_id,
+            target_chat_id,
+            created_at
+        FROM
+            forwarded_message
+        WHERE
+            created_at < $1
+        ORDER BY created_at
+        LIMIT $2
+    )
+    DELETE
+    FROM
+        forwarded_message
+    USING batch
+    WHERE
+        forwarded_message.forwarded_message_id = batch.forwarded_message_id
+        AND forwarded_message.target_chat_id = batch.target_chat_id
+        AND forwarded_message.created_at = batch.created_at
+    """,
+)
+_COUNT_CREATED_BEFORE = statement(
+    "forwarded_message.count_created_before",
+    """
+    SELECT
+        count(*)
+    FROM
+        forwarded_message
+    WHERE
+        created_at < $1
+    """,
+)
+
+_SQLITE_GET = """
+    SELECT
+        forwarded_message_id,
+        target_chat_id,
+        origin_chat_id,
+        created_at
+    FROM
+        forwarded_message
+    WHERE
+        forwarded_message_id = ?
+        AND target_chat_id = ?
+"""
+_SQLITE_ADD = """
+    INSERT INTO forwarded_message (
+        forwarded_message_id,
+        target_chat_id,
+        origin_chat_id,
+        created_at
+    )
+    VALUES (?, ?, ?, ?)
+"""
+
+_ForwardedMessageKey = Tuple[int, int]
+
+
+def _key(forwarded_message: ForwardedMessage) -> _ForwardedMessageKey:
+    return forwarded_message.forwarded_message_id, forwarded_message.target_chat_id
+
 
 class AbstractForwardedMessageRepository(ABC):
     @abstractmethod
@@ -17,48 +164,412 @@ class AbstractForwardedMessageRepository(ABC):
     async def add(self, forwarded_message: ForwardedMessage):
         raise NotImplementedError
 
+    async def add_many(self, forwarded_messages: Iterable[ForwardedMessage]):
+        for forwarded_message in forwarded_messages:
+            await self.add(forwarded_message)
+
 
 class PostgresForwardedMessageRepository(AbstractForwardedMessageRepository):
-    def __init__(self, conn: asyncpg.Connection):
+    """Forwarded messages in the table partitioned by ``created_at``.
+
+    The primary key of a partitioned table has to include ``created_at``,
+    so a message ID of a chat isn't unique by itself: ``get`` returns
+    the latest of the messages. With ``lookup_window``, ``get`` only looks
+    at messages created within it, which skips the older partitions.
+    """
+
+    def __init__(
+        self, conn: asyncpg.Connection, lookup_window: Optional[timedelta] = None
+    ):
         self._conn = conn
+        self._lookup_window = lookup_window
 
+    @staticmethod
+    def row_to_model(row: asyncpg.Record) -> ForwardedMessage:
+        # Columns are read by position, in the order of the statements above
+        return ForwardedMessage(row[0], row[1], row[2], row[3])
+
+    @metrics.timed(method_duration.labels("forwarded_message", "get"))
     async def get(
         self, forwarded_message_id: int, target_chat_id: int
     ):
-        row = await self._conn.fetchrow(
-            """
-            SELECT
+        if self._lookup_window is None:
+            row = await self._conn.fetchrow(
+                _GET, forwarded_message_id, target_chat_id
+            )
+        else:
+            row = await self._conn.fetchrow(
+                _GET_CREATED_SINCE,
                 forwarded_message_id,
                 target_chat_id,
-                origin_chat_id,
-                created_at
-            FROM
-                forwarded_message
-            WHERE
-                forwarded_message_id = $1
-                AND target_chat_id = $2
-            """,
-            forwarded_message_id,
-            target_chat_id,
-        )
+                datetime.now(timezone.utc) - self._lookup_window,
+            )
         if not row:
             return None
 
-        return ForwardedMessage(**row)
+        return self.row_to_model(row)
 
+    @metrics.timed(method_duration.labels("forwarded_message", "add"))
     async def add(self, forwarded_message: ForwardedMessage):
         await self._conn.execute(
-            """
-            INSERT INTO forwarded_message (
-                forwarded_message_id,
-                target_chat_id,
-                origin_chat_id,
-                created_at
-            )
-            VALUES ($1, $2, $3, $4)
-            """,
+            _ADD,
+            forwarded_message.forwarded_message_id,
+            forwarded_message.target_chat_id,
+            forwarded_message.origin_chat_id,
+            forwarded_message.created_at,
+        )
+
+    @metrics.timed(method_duration.labels("forwarded_message", "add_if_absent"))
+    async def add_if_absent(self, forwarded_message: ForwardedMessage) -> bool:
+        """Add the message unless it is already there, return whether it was added."""
+        status = await self._conn.execute(
+            _ADD_IF_ABSENT,
             forwarded_message.forwarded_message_id,
             forwarded_message.target_chat_id,
             forwarded_message.origin_chat_id,
             forwarded_message.created_at,
         )
+        # Command status has "INSERT 0 <count>" format
+        return status.split()[-1] == "1"
+
+    @metrics.timed(method_duration.labels("forwarded_message", "add_many"))
+    async def add_many(self, forwarded_messages: Iterable[ForwardedMessage]):
+        await self._conn.copy_records_to_table(
+            "forwarded_message",
+            columns=(
+                "forwarded_message_id",
+                "target_chat_id",
+                "origin_chat_id",
+                "created_at",
+            ),
+            records=[
+                (
+                    forwarded_message.forwarded_message_id,
+                    forwarded_message.target_chat_id,
+                    forwarded_message.origin_chat_id,
+                    forwarded_message.created_at,
+                )
+                for forwarded_message in forwarded_messages
+            ],
+        )
+
+    @metrics.timed(method_duration.labels("forwarded_message", "remove_created_before"))
+    async def remove_created_before(self, before: datetime, limit: int) -> int:
+        """Remove up to ``limit`` oldest forwarded messages created before
+        ``before`` and return the number of removed messages.
+        """
+        status = await self._conn.execute(
+            _REMOVE_CREATED_BEFORE, before, limit
+        )
+        # Command status has "DELETE <count>" format
+        return int(status.split()[-1])
+
+    @metrics.timed(method_duration.labels("forwarded_message", "count_created_before"))
+    async def count_created_before(self, before: datetime) -> int:
+        return await self._conn.fetchval(_COUNT_CREATED_BEFORE, before)
+
+
+class SqliteForwardedMessageRepository(AbstractForwardedMessageRepository):
+    def __init__(self, conn: SqliteTransaction):
+        self._conn = conn
+
+    @staticmethod
+    def row_to_model(row: tuple) -> ForwardedMessage:
+        return ForwardedMessage(row[0], row[1], row[2], from_timestamp(row[3]))
+
+    @staticmethod
+    def _to_row(forwarded_message: ForwardedMessage) -> tuple:
+        return (
+            forwarded_message.forwarded_message_id,
+            forwarded_message.target_chat_id,
+            forwarded_message.origin_chat_id,
+            to_timestamp(forwarded_message.created_at),
+        )
+
+    @metrics.timed(method_duration.labels("forwarded_message", "get"))
+    async def get(
+        self, forwarded_message_id: int, target_chat_id: int
+    ):
+        row = await self._conn.fetchrow(
+            _SQLITE_GET, forwarded_message_id, target_chat_id
+        )
+        if not row:
+            return None
+
+        return self.row_to_model(row)
+
+    @metrics.timed(method_duration.labels("forwarded_message", "add"))
+    async def add(self, forwarded_message: ForwardedMessage):
+        await self._conn.execute(_SQLITE_ADD, *self._to_row(forwarded_message))
+
+    @metrics.timed(method_duration.labels("forwarded_message", "add_many"))
+    async def add_many(self, forwarded_messages: Iterable[ForwardedMessage]):
+        await self._conn.executemany(
+            _SQLITE_ADD,
+            [
+                self._to_row(forwarded_message)
+                for forwarded_message in forwarded_messages
+            ],
+        )
+
+
+class ForwardedMessageWriteBuffer:
+    """Bounded write-behind buffer for forwarded messages.
+
+    Buffered messages are written with a single ``add_many`` call once
+    ``batch_size`` of them have accumulated or ``flush_interval`` seconds
+    have passed. Messages stay readable from the buffer until they are
+    written. When the buffer holds ``max_size`` messages, adding more waits
+    for a flush.
+
+    A row rejected by the database fails the whole batch, so the batch is
+    then inserted row by row, skipping existing messages and dropping
+    the rejected ones. Messages failing to be written ``max_attempts``
+    times, e.g. while the database is unavailable, are dropped as well.
+
+    Messages sent by outbox commands are put with the IDs of the commands,
+    which are removed from the outbox table in the same transaction as
+    the messages are written. The commands of dropped messages are left
+    in the table unless the database rejected the messages, so they're
+    sent and saved again once their lease expires.
+
+    Buffered messages are only readable in this process: with several
+    worker processes, a reply handled by another worker before the message
+    is written doesn't find it.
+    """
+
+    def __init__(
+        self,
+        pool: asyncpg.Pool,
+        batch_size: int,
+        max_size: int,
+        flush_interval: float,
+        max_attempts: int = 5,
+        slow_query_log: Optional[SlowQueryLog] = None,
+    ):
+        self._pool = pool
+        self._slow_query_log = slow_query_log
+        self._batch_size = batch_size
+        self._max_size = max_size
+        self._flush_interval = flush_interval
+        self._max_attempts = max_attempts
+
+        self._pending: Dict[_ForwardedMessageKey, ForwardedMessage] = {}
+        self._flushing: Dict[_ForwardedMessageKey, ForwardedMessage] = {}
+        self._attempts: Dict[_ForwardedMessageKey, int] = {}
+        self._outbox_ids: Dict[_ForwardedMessageKey, int] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._timer_task: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return len(self._pending) + len(self._flushing)
+
+    def start(self):
+        self._timer_task = asyncio.ensure_future(self._flush_periodically())
+
+    async def close(self) -> int:
+        """Write buffered messages and return the number of messages
+        dropped because they couldn't be written, doesn't raise.
+        """
+        for task in (self._timer_task, self._flush_task):
+            if task is not None and not task.done():
+                task.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await task
+        self._timer_task = self._flush_task = None
+
+        await self._try_flush()
+        dropped = len(self)
+        if dropped:
+            # Messages sent by outbox commands are still in the outbox
+            # table, so they're sent and saved again
+            messages_dropped.inc(dropped)
+            log.error("Dropped %d unwritten forwarded messages on close", dropped)
+            self._pending = {}
+            self._attempts = {}
+            self._outbox_ids = {}
+        return dropped
+
+    def get(
+        self, forwarded_message_id: int, target_chat_id: int
+    ) -> Optional[ForwardedMessage]:
+        key = (forwarded_message_id, target_chat_id)
+        return self._pending.get(key) or self._flushing.get(key)
+
+    async def put(
+        self,
+        forwarded_messages: Iterable[ForwardedMessage],
+        outbox_ids: Optional[Iterable[int]] = None,
+    ):
+        """Buffer committed messages, failures to write them aren't raised.
+
+        ``outbox_ids`` are the IDs of the outbox commands the messages
+        were sent by, in the same order.
+        """
+        forwarded_messages = list(forwarded_messages)
+        if outbox_ids is not None:
+            for forwarded_message, outbox_id in zip(forwarded_messages, outbox_ids):
+                self._outbox_ids[_key(forwarded_message)] = outbox_id
+
+        for forwarded_message in forwarded_messages:
+            while len(self) >= self._max_size:
+                if not await self._try_flush():
+                    # Failed messages are dropped after a few attempts,
+                    # which eventually frees up space
+                    await asyncio.sleep(self._flush_interval)
+
+            self._pending[_key(forwarded_message)] = forwarded_message
+
+        if len(self._pending) >= self._batch_size:
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._try_flush())
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            await self._try_flush()
+
+    async def _try_flush(self) -> bool:
+        try:
+            await self.flush()
+        except Exception:
+            log.exception("Failed to flush forwarded messages")
+            return False
+        return True
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending:
+                return
+
+            self._flushing, self._pending = self._pending, {}
+            count = len(self._flushing)
+            try:
+                await self._write(list(self._flushing.values()))
+            except BaseException:
+                # Including cancellation, so the batch isn't lost on close
+                self._retry_later(self._flushing)
+                raise
+            else:
+                for key in self._flushing:
+                    self._attempts.pop(key, None)
+                    self._outbox_ids.pop(key, None)
+            finally:
+                self._flushing = {}
+
+            log.debug("Flushed %d forwarded messages", count)
+
+    async def _write(self, forwarded_messages: List[ForwardedMessage]):
+        import asyncpg
+
+        # Errors caused by the rows themselves, rather than by the connection
+        row_errors = (asyncpg.IntegrityConstraintViolationError, asyncpg.DataError)
+        try:
+            async with self._connect() as conn:
+                repository = PostgresForwardedMessageRepository(conn)
+                await repository.add_many(forwarded_messages)
+                await PostgresOutboxRepository(conn).remove(
+                    self._outbox_ids_of(forwarded_messages)
+                )
+            return
+        except row_errors:
+            log.warning(
+                "Failed to copy %d forwarded messages, inserting them one by one",
+                len(forwarded_messages),
+                exc_info=True,
+            )
+
+        dropped = 0
+        # Outside of a transaction, a rejected row doesn't affect the rest
+        async with self._connect(autocommit=True) as conn:
+            repository = PostgresForwardedMessageRepository(conn)
+            outbox = PostgresOutboxRepository(conn)
+            for forwarded_message in forwarded_messages:
+                try:
+                    await repository.add_if_absent(forwarded_message)
+                except row_errors:
+                    log.exception("Dropping forwarded message %s", forwarded_message)
+                    dropped += 1
+                # Sending a rejected message again wouldn't help either
+                await outbox.remove(self._outbox_ids_of([forwarded_message]))
+        messages_dropped.inc(dropped)
+
+    def _outbox_ids_of(self, forwarded_messages: List[ForwardedMessage]) -> List[int]:
+        return [
+            self._outbox_ids[_key(forwarded_message)]
+            for forwarded_message in forwarded_messages
+            if _key(forwarded_message) in self._outbox_ids
+        ]
+
+    def _connect(self, autocommit: bool = False) -> LazyConnection:
+        return LazyConnection(
+            self._pool, slow_query_log=self._slow_query_log, autocommit=autocommit
+        )
+
+    def _retry_later(
+        self, forwarded_messages: Dict[_ForwardedMessageKey, ForwardedMessage]
+    ):
+        retried = {}
+        for key, forwarded_message in forwarded_messages.items():
+            attempts = self._attempts.get(key, 0) + 1
+            if attempts < self._max_attempts:
+                self._attempts[key] = attempts
+                retried[key] = forwarded_message
+            else:
+                self._attempts.pop(key, None)
+                self._outbox_ids.pop(key, None)
+
+        dropped = len(forwarded_messages) - len(retried)
+        if dropped:
+            messages_dropped.inc(dropped)
+            log.error(
+                "Dropped %d forwarded messages after %d failed writes",
+                dropped,
+                self._max_attempts,
+            )
+        self._pending = {**retried, **self._pending}
+
+
+class BufferedForwardedMessageRepository(AbstractForwardedMessageRepository):
+    """Defers forwarded message writes to a ForwardedMessageWriteBuffer.
+
+    Added messages are handed to the buffer by ``publish``
+    once the unit of work has committed.
+    """
+
+    def __init__(
+        self,
+        repository: AbstractForwardedMessageRepository,
+        buffer: ForwardedMessageWriteBuffer,
+    ):
+        self._repository = repository
+        self._buffer = buffer
+
+        self._added: Dict[_ForwardedMessageKey, ForwardedMessage] = {}
+
+    async def get(self, forwarded_message_id: int, target_chat_id: int):
+        key = (forwarded_message_id, target_chat_id)
+        forwarded_message = self._added.get(key) or self._buffer.get(*key)
+        if forwarded_message:
+            return forwarded_message
+
+        return await self._repository.get(forwarded_message_id, target_chat_id)
+
+    async def add(self, forwarded_message: ForwardedMessage):
+        self._added[_key(forwarded_message)] = forwarded_message
+
+    async def add_many(self, forwarded_messages: Iterable[ForwardedMessage]):
+        for forwarded_message in forwarded_messages:
+            await self.add(forwarded_message)
+
+    async def publish(self):
+        """Hand committed messages to the write buffer.
+
+        Doesn't raise, as the unit of work has committed already.
+        """
+        added, self._added = self._added, {}
+        await self._buffer.put(added.values())
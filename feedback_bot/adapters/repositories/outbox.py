@@ -0,0 +1,223 @@
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime
+from typing import TYPE_CHECKING, List, Sequence
+
+from feedback_bot import metrics
+from feedback_bot.adapters.repositories import method_duration
+from feedback_bot.adapters.sqlite import SqliteTransaction, to_timestamp
+from feedback_bot.adapters.statements import statement
+
+if TYPE_CHECKING:
+    import asyncpg
+
+_ADD = statement(
+    "outbox.add",
+    """
+    INSERT INTO outbox (
+        payload,
+        available_at
+    )
+    VALUES ($1, $2)
+    RETURNING id
+    """,
+)
+# Records claimed by another process are skipped rather than waited for
+_CLAIM = statement(
+    "outbox.claim",
+    """
+    UPDATE outbox
+    SET
+        available_at = $3
+    WHERE
+        id IN (
+            SELECT
+                id
+            FROM
+                outbox
+            WHERE
+                available_at <= $1
+            ORDER BY id
+            LIMIT $2
+            FOR UPDATE SKIP LOCKED
+        )
+    RETURNING
+        id,
+        payload,
+        attempts
+    """,
+)
+_REMOVE = statement(
+    "outbox.remove",
+    """
+    DELETE
+    FROM
+        outbox
+    WHERE
+        id = ANY($1::bigint[])
+    """,
+)
+_RETRY_LATER = statement(
+    "outbox.retry_later",
+    """
+    UPDATE outbox
+    SET
+        attempts = attempts + 1,
+        available_at = $2
+    WHERE
+        id = $1
+    """,
+)
+
+_SQLITE_ADD = """
+    INSERT INTO outbox (
+        payload,
+        available_at
+    )
+    VALUES (?, ?)
+"""
+_SQLITE_LAST_ID = "SELECT last_insert_rowid()"
+_SQLITE_GET_AVAILABLE = """
+    SELECT
+        id,
+        payload,
+        attempts
+    FROM
+        outbox
+    WHERE
+        available_at <= ?
+    ORDER BY id
+    LIMIT ?
+"""
+_SQLITE_LEASE = """
+    UPDATE outbox
+    SET
+        available_at = ?
+    WHERE
+        id = ?
+"""
+_SQLITE_REMOVE = """
+    DELETE
+    FROM
+        outbox
+    WHERE
+        id = ?
+"""
+_SQLITE_RETRY_LATER = """
+    UPDATE outbox
+    SET
+        attempts = attempts + 1,
+        available_at = ?
+    WHERE
+        id = ?
+"""
+
+
+@dataclass(frozen=True)
+class OutboxRecord:
+    id: int
+    # Serialized command
+    payload: str
+    # Number of failed attempts to send the command
+    attempts: int = 0
+
+
+class AbstractOutboxRepository(ABC):
+    """Commands to send, each of them available to be sent once
+    its ``available_at`` has passed.
+    """
+
+    @abstractmethod
+    async def add(self, payload: str, available_at: datetime) -> int:
+        """Add a record and return its ID."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def claim(
+        self, now: datetime, leased_until: datetime, limit: int
+    ) -> List[OutboxRecord]:
+        """Return up to ``limit`` oldest records available at ``now``,
+        making them unavailable until ``leased_until``.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def remove(self, record_ids: Sequence[int]):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def retry_later(self, record_id: int, available_at: datetime):
+        """Count a failed attempt and make the record available again at
+        ``available_at``.
+        """
+        raise NotImplementedError
+
+
+class PostgresOutboxRepository(AbstractOutboxRepository):
+    def __init__(self, conn: asyncpg.Connection):
+        self._conn = conn
+
+    @staticmethod
+    def row_to_record(row: asyncpg.Record) -> OutboxRecord:
+        return OutboxRecord(row[0], row[1], row[2])
+
+    @metrics.timed(method_duration.labels("outbox", "add"))
+    async def add(self, payload: str, available_at: datetime):
+        return await self._conn.fetchval(_ADD, payload, available_at)
+
+    @metrics.timed(method_duration.labels("outbox", "claim"))
+    async def claim(self, now: datetime, leased_until: datetime, limit: int):
+        rows = await self._conn.fetch(_CLAIM, now, limit, leased_until)
+        # UPDATE doesn't keep the order of the subquery
+        return sorted(map(self.row_to_record, rows), key=lambda record: record.id)
+
+    @metrics.timed(method_duration.labels("outbox", "remove"))
+    async def remove(self, record_ids: Sequence[int]):
+        if record_ids:
+            await self._conn.execute(_REMOVE, list(record_ids))
+
+    @metrics.timed(method_duration.labels("outbox", "retry_later"))
+    async def retry_later(self, record_id: int, available_at: datetime):
+        await self._conn.execute(_RETRY_LATER, record_id, available_at)
+
+
+class SqliteOutboxRepository(AbstractOutboxRepository):
+    def __init__(self, conn: SqliteTransaction):
+        self._conn = conn
+
+    @staticmethod
+    def row_to_record(row: tuple) -> OutboxRecord:
+        return OutboxRecord(row[0], row[1], row[2])
+
+    @metrics.timed(method_duration.labels("outbox", "add"))
+    async def add(self, payload: str, available_at: datetime):
+        await self._conn.execute(_SQLITE_ADD, payload, to_timestamp(available_at))
+        # The transaction holds the database lock, so no other insert
+        # can happen in between
+        return await self._conn.fetchval(_SQLITE_LAST_ID)
+
+    @metrics.timed(method_duration.labels("outbox", "claim"))
+    async def claim(self, now: datetime, leased_until: datetime, limit: int):
+        rows = await self._conn.fetch(_SQLITE_GET_AVAILABLE, to_timestamp(now), limit)
+        records = [self.row_to_record(row) for row in rows]
+        if records:
+            await self._conn.executemany(
+                _SQLITE_LEASE,
+                [(to_timestamp(leased_until), record.id) for record in records],
+            )
+        return records
+
+    @metrics.timed(method_duration.labels("outbox", "remove"))
+    async def remove(self, record_ids: Sequence[int]):
+        if record_ids:
+            await self._conn.executemany(
+                _SQLITE_REMOVE, [(record_id,) for record_id in record_ids]
+            )
+
+    @metrics.timed(method_duration.labels("outbox", "retry_later"))
+    async def retry_later(self, record_id: int, available_at: datetime):
+        await self._conn.execute(
+            _SQLITE_RETRY_LATER, to_timestamp(available_at), record_id
+        )
@@ -1,10 +1,109 @@
-from abc import ABC, abstractmethod
-from typing import Dict, Iterable, Optional
+from __future__ import annotations
 
-import asyncpg
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Set
 
+from feedback_bot import metrics
+from feedback_bot.adapters.cache import Registry
+from feedback_bot.adapters.repositories import method_duration
+from feedback_bot.adapters.sqlite import SqliteTransaction, from_timestamp, to_timestamp
+from feedback_bot.adapters.statements import statement
 from feedback_bot.model import TargetChat
 
+if TYPE_CHECKING:
+    import asyncpg
+
+_GET = statement(
+    "target_chat.get",
+    """
+    SELECT
+        chat_id,
+        created_at
+    FROM
+        target_chat
+    WHERE
+        chat_id = $1
+    """,
+)
+_GET_LATEST = statement(
+    "target_chat.get_latest",
+    """
+    SELECT
+        chat_id,
+        created_at
+    FROM
+        target_chat
+    ORDER BY created_at DESC
+    LIMIT 1
+    """,
+)
+_GET_ALL = statement(
+    "target_chat.get_all",
+    """
+    SELECT
+        chat_id,
+        created_at
+    FROM
+        target_chat
+    """,
+)
+_REMOVE = statement(
+    "target_chat.remove",
+    """
+    DELETE
+    FROM
+        target_chat
+    WHERE
+        chat_id = $1
+    RETURNING chat_id, created_at
+    """,
+)
+_ADD = statement(
+    "target_chat.add",
+    """
+    INSERT INTO target_chat (chat_id, created_at)
+    VALUES ($1, $2)
+    """,
+)
+
+
+_SQLITE_GET = """
+    SELECT
+        chat_id,
+        created_at
+    FROM
+        target_chat
+    WHERE
+        chat_id = ?
+"""
+_SQLITE_GET_LATEST = """
+    SELECT
+        chat_id,
+        created_at
+    FROM
+        target_chat
+    ORDER BY created_at DESC
+    LIMIT 1
+"""
+_SQLITE_GET_ALL = """
+    SELECT
+        chat_id,
+        created_at
+    FROM
+        target_chat
+"""
+_SQLITE_REMOVE = """
+    DELETE
+    FROM
+        target_chat
+    WHERE
+        chat_id = ?
+"""
+_SQLITE_ADD = """
+    INSERT INTO target_chat (chat_id, created_at)
+    VALUES (?, ?)
+"""
+
 
 class AbstractTargetChatRepository(ABC):
     @abstractmethod
@@ -15,6 +114,10 @@ class AbstractTargetChatRepository(ABC):
     async def get_latest(self) -> Optional[TargetChat]:
         raise NotImplementedError
 
+    @abstractmethod
+    async def get_all(self) -> List[TargetChat]:
+        raise NotImplementedError
+
     @abstractmethod
     async def remove(self, chat_id: int) -> Optional[TargetChat]:
         raise NotImplementedError
@@ -30,65 +133,219 @@ class PostgresTargetChatRepository(AbstractTargetChatRepository):
 
     @staticmethod
     def row_to_model(row: asyncpg.Record) -> TargetChat:
-        return TargetChat(**row)
+        # Columns are read by position, in the order of the statements above
+        return TargetChat(row[0], row[1])
 
+    @metrics.timed(method_duration.labels("target_chat", "get"))
     async def get(self, chat_id: int):
-        row = await self._conn.fetchrow(
-            """
-            SELECT
-                chat_id,
-                created_at
-            FROM
-                target_chat
-            WHERE
-                chat_id = $1
-            """,
-            chat_id
-        )
+        row = await self._conn.fetchrow(_GET, chat_id)
         if not row:
             return None
         
         return self.row_to_model(row)
 
+    @metrics.timed(method_duration.labels("target_chat", "get_latest"))
     async def get_latest(self):
-        row = await self._conn.fetchrow(
-            """
-            SELECT
-                chat_id,
-                created_at
-            FROM
-                target_chat
-            ORDER BY created_at DESC
-            LIMIT 1
-            """
-        )
+        row = await self._conn.fetchrow(_GET_LATEST)
         if not row:
             return None
         
         return self.row_to_model(row)
 
+    @metrics.timed(method_duration.labels("target_chat", "get_all"))
+    async def get_all(self):
+        rows = await self._conn.fetch(_GET_ALL)
+        return [self.row_to_model(row) for row in rows]
+
+    @metrics.timed(method_duration.labels("target_chat", "remove"))
     async def remove(self, chat_id: int):
-        row = await self._conn.fetchrow(
-            """
-            DELETE
-            FROM
-                target_chat
-            WHERE
-                chat_id = $1
-            RETURNING chat_id, created_at
-            """,
-            chat_id
-        )
+        row = await self._conn.fetchrow(_REMOVE, chat_id)
         if not row:
             return None
         
         return self.row_to_model(row)
 
+    @metrics.timed(method_duration.labels("target_chat", "add"))
+    async def add(self, target_chat: TargetChat):
+        await self._conn.execute(
+            _ADD, target_chat.chat_id, target_chat.created_at
+        )
+
+
+class SqliteTargetChatRepository(AbstractTargetChatRepository):
+    def __init__(self, conn: SqliteTransaction):
+        self._conn = conn
+
+    @staticmethod
+    def row_to_model(row: tuple) -> TargetChat:
+        return TargetChat(row[0], from_timestamp(row[1]))
+
+    @metrics.timed(method_duration.labels("target_chat", "get"))
+    async def get(self, chat_id: int):
+        row = await self._conn.fetchrow(_SQLITE_GET, chat_id)
+        if not row:
+            return None
+
+        return self.row_to_model(row)
+
+    @metrics.timed(method_duration.labels("target_chat", "get_latest"))
+    async def get_latest(self):
+        row = await self._conn.fetchrow(_SQLITE_GET_LATEST)
+        if not row:
+            return None
+
+        return self.row_to_model(row)
+
+    @metrics.timed(method_duration.labels("target_chat", "get_all"))
+    async def get_all(self):
+        rows = await self._conn.fetch(_SQLITE_GET_ALL)
+        return [self.row_to_model(row) for row in rows]
+
+    @metrics.timed(method_duration.labels("target_chat", "remove"))
+    async def remove(self, chat_id: int):
+        # DELETE ... RETURNING needs SQLite 3.35, the transaction
+        # holds the database, so nothing changes in between
+        row = await self._conn.fetchrow(_SQLITE_GET, chat_id)
+        if not row:
+            return None
+
+        await self._conn.execute(_SQLITE_REMOVE, chat_id)
+        return self.row_to_model(row)
+
+    @metrics.timed(method_duration.labels("target_chat", "add"))
     async def add(self, target_chat: TargetChat):
         await self._conn.execute(
-            """
-            INSERT INTO target_chat (chat_id, created_at)
-            VALUES ($1, $2)
-            """,
-            target_chat.chat_id, target_chat.created_at
+            _SQLITE_ADD, target_chat.chat_id, to_timestamp(target_chat.created_at)
+        )
+
+
+class TargetChatRegistry(Registry[int, TargetChat]):
+    """Process-wide in-memory copy of all target chats."""
+
+    _latest: Optional[TargetChat] = None
+
+    @staticmethod
+    def key(target_chat: TargetChat) -> int:
+        return target_chat.chat_id
+
+    def invalidate(self):
+        super().invalidate()
+        self._latest = None
+
+    def get_latest(self) -> Optional[TargetChat]:
+        return self._latest
+
+    def _on_loaded(self):
+        self._latest = self._find_latest()
+
+    def _on_added(self, target_chat: TargetChat):
+        if self._latest is None or target_chat.created_at >= self._latest.created_at:
+            self._latest = target_chat
+
+    def _on_removed(self, target_chat: TargetChat):
+        if target_chat.chat_id == self._latest.chat_id:
+            self._latest = self._find_latest()
+
+    def _find_latest(self) -> Optional[TargetChat]:
+        return max(
+            self._items.values(),
+            key=lambda target_chat: target_chat.created_at,
+            default=None,
         )
+
+
+class CachedTargetChatRepository(AbstractTargetChatRepository):
+    """Serves reads from a TargetChatRegistry.
+
+    Writes go to the wrapped repository right away and are applied
+    to the registry by ``publish`` once the unit of work has committed.
+
+    The registry is loaded through the wrapped repository, in the
+    transaction of the unit of work. Once ``has_changes`` reports
+    uncommitted changes of cached tables, the snapshot would include them,
+    so an unloaded registry isn't loaded and reads go to the wrapped
+    repository instead.
+    """
+
+    def __init__(
+        self,
+        repository: AbstractTargetChatRepository,
+        registry: TargetChatRegistry,
+        has_changes: Optional[Callable[[], bool]] = None,
+    ):
+        self._repository = repository
+        self._registry = registry
+        self._has_changes = has_changes
+
+        self._added: Dict[int, TargetChat] = {}
+        self._removed: Set[int] = set()
+
+    @property
+    def changed(self) -> bool:
+        return bool(self._added or self._removed)
+
+    async def _load(self) -> bool:
+        """Load the registry and return whether reads can be served from it."""
+        if not self._registry.loaded and (
+            self.changed or (self._has_changes is not None and self._has_changes())
+        ):
+            return False
+
+        await self._registry.load(self._repository.get_all)
+        return True
+
+    async def get(self, chat_id: int):
+        if chat_id in self._added:
+            return self._added[chat_id]
+        if chat_id in self._removed:
+            return None
+
+        if not await self._load():
+            return await self._repository.get(chat_id)
+        return self._registry.get(chat_id)
+
+    async def get_latest(self):
+        if not await self._load():
+            return await self._repository.get_latest()
+        if not self._added and not self._removed:
+            return self._registry.get_latest()
+
+        return max(
+            await self.get_all(),
+            key=lambda target_chat: target_chat.created_at,
+            default=None,
+        )
+
+    async def get_all(self):
+        if not await self._load():
+            return await self._repository.get_all()
+        target_chats = {
+            target_chat.chat_id: target_chat
+            for target_chat in self._registry.get_all()
+            if target_chat.chat_id not in self._removed
+        }
+        target_chats.update(self._added)
+        return list(target_chats.values())
+
+    async def remove(self, chat_id: int):
+        removed = await self._repository.remove(chat_id)
+        if removed:
+            self._added.pop(chat_id, None)
+            self._removed.add(chat_id)
+
+        return removed
+
+    async def add(self, target_chat: TargetChat):
+        await self._repository.add(target_chat)
+        self._removed.discard(target_chat.chat_id)
+        self._added[target_chat.chat_id] = target_chat
+
+    async def publish(self):
+        """Apply committed changes to the registry."""
+        for chat_id in self._removed:
+            self._registry.remove(chat_id)
+        for target_chat in self._added.values():
+            self._registry.add(target_chat)
+
+        self._added.clear()
+        self._removed.clear()
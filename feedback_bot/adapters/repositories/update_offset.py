@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, AsyncContextManager, Callable, Optional
+
+from feedback_bot import metrics
+from feedback_bot.adapters.repositories import method_duration
+from feedback_bot.adapters.sqlite import SqliteTransaction
+from feedback_bot.adapters.statements import statement
+
+if TYPE_CHECKING:
+    import asyncpg
+
+_GET = statement(
+    "update_offset.get",
+    """
+    SELECT
+        update_offset
+    FROM
+        update_offset
+    WHERE
+        bot_id = $1
+    """,
+)
+_SAVE = statement(
+    "update_offset.save",
+    """
+    INSERT INTO update_offset (
+        bot_id,
+        update_offset
+    )
+    VALUES ($1, $2)
+    ON CONFLICT (bot_id) DO UPDATE
+    SET
+        update_offset = EXCLUDED.update_offset
+    """,
+)
+
+
+_SQLITE_GET = """
+    SELECT
+        update_offset
+    FROM
+        update_offset
+    WHERE
+        bot_id = ?
+"""
+_SQLITE_SAVE = """
+    INSERT INTO update_offset (
+        bot_id,
+        update_offset
+    )
+    VALUES (?, ?)
+    ON CONFLICT (bot_id) DO UPDATE
+    SET
+        update_offset = excluded.update_offset
+"""
+
+
+class AbstractUpdateOffsetRepository(ABC):
+    @abstractmethod
+    async def get(self, bot_id: int) -> Optional[int]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def save(self, bot_id: int, update_offset: int):
+        raise NotImplementedError
+
+
+# Opens a repository for loading or saving the offset
+UpdateOffsets = Callable[[], AsyncContextManager[AbstractUpdateOffsetRepository]]
+
+
+class PostgresUpdateOffsetRepository(AbstractUpdateOffsetRepository):
+    def __init__(self, conn: asyncpg.Connection):
+        self._conn = conn
+
+    @metrics.timed(method_duration.labels("update_offset", "get"))
+    async def get(self, bot_id: int):
+        return await self._conn.fetchval(_GET, bot_id)
+
+    @metrics.timed(method_duration.labels("update_offset", "save"))
+    async def save(self, bot_id: int, update_offset: int):
+        await self._conn.execute(_SAVE, bot_id, update_offset)
+
+
+class SqliteUpdateOffsetRepository(AbstractUpdateOffsetRepository):
+    def __init__(self, conn: SqliteTransaction):
+        self._conn = conn
+
+    @metrics.timed(method_duration.labels("update_offset", "get"))
+    async def get(self, bot_id: int):
+        return await self._conn.fetchval(_SQLITE_GET, bot_id)
+
+    @metrics.timed(method_duration.labels("update_offset", "save"))
+    async def save(self, bot_id: int, update_offset: int):
+        await self._conn.execute(_SQLITE_SAVE, bot_id, update_offset)
@@ -0,0 +1,300 @@
+"""Embedded SQLite storage for single-node deployments.
+
+The database file is used in WAL mode through a single connection,
+owned by a dedicated thread, so blocking SQLite calls never run
+on the event loop. SQLite allows one writer at a time, so units of work
+take turns: ``SqliteTransaction`` takes the database lock on its first
+query and holds it until it's released.
+
+Statements are plain constants, so the statement cache of the connection
+compiles each of them once and reuses the prepared statement afterwards.
+Rows are plain tuples, repositories read their columns by position.
+"""
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from logging import getLogger
+from time import perf_counter
+from typing import Any, Callable, Iterable, List, Optional, Sequence, TypeVar
+
+from feedback_bot import metrics, tracing
+
+log = getLogger(__name__)
+
+T = TypeVar("T")
+
+lock_wait = metrics.histogram(
+    "sqlite_lock_wait_seconds",
+    "Time spent waiting for other units of work to release the database",
+)
+
+# Schema versions, the statements of each one are applied in a transaction
+# to databases whose user_version is lower than the version number.
+_MIGRATIONS = [
+    [
+        """
+        CREATE TABLE target_chat (
+            chat_id INTEGER PRIMARY KEY,
+            created_at INTEGER NOT NULL
+        )
+        """,
+        "CREATE INDEX target_chat_created_at ON target_chat (created_at)",
+        """
+        CREATE TABLE admin (
+            user_id INTEGER PRIMARY KEY,
+            target_chat_id INTEGER NOT NULL REFERENCES target_chat (chat_id)
+        )
+        """,
+        """
+        CREATE TABLE forwarded_message (
+            forwarded_message_id INTEGER NOT NULL,
+            target_chat_id INTEGER NOT NULL,
+            origin_chat_id INTEGER NOT NULL,
+            created_at INTEGER NOT NULL,
+            PRIMARY KEY (forwarded_message_id, target_chat_id)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE INDEX forwarded_message_created_at
+        ON forwarded_message (created_at)
+        """,
+        """
+        CREATE TABLE update_offset (
+            bot_id INTEGER PRIMARY KEY,
+            update_offset INTEGER NOT NULL
+        )
+        """,
+    ],
+    [
+        """
+        CREATE TABLE outbox (
+            id INTEGER PRIMARY KEY,
+            payload TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            available_at INTEGER NOT NULL
+        )
+        """,
+        "CREATE INDEX outbox_available_at ON outbox (available_at)",
+    ],
+]
+
+# Comfortably more than the number of statements used by repositories
+_CACHED_STATEMENTS = 256
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def to_timestamp(dt: datetime) -> int:
+    """Microseconds since the epoch, naive datetimes are taken as UTC.
+
+    Integers keep the order of datetimes, so they can be indexed and sorted.
+    """
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return (dt - _EPOCH) // timedelta(microseconds=1)
+
+
+def from_timestamp(timestamp: int) -> datetime:
+    return _EPOCH + timedelta(microseconds=timestamp)
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Bring the schema up to date and return its version."""
+    (version,) = conn.execute("PRAGMA user_version").fetchone()
+    for number, statements in enumerate(_MIGRATIONS[version:], start=version + 1):
+        conn.execute("BEGIN")
+        try:
+            for statement in statements:
+                conn.execute(statement)
+            # PRAGMA doesn't accept parameters
+            conn.execute(f"PRAGMA user_version = {number:d}")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        log.info("Migrated SQLite database to version %d", number)
+        version = number
+
+    return version
+
+
+class SqliteDatabase:
+    """SQLite database file accessed from a thread of its own."""
+
+    _conn: Optional[sqlite3.Connection]
+
+    def __init__(self, path: str, busy_timeout: float = 5.0):
+        self._path = path
+        self._busy_timeout = busy_timeout
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="sqlite"
+        )
+        self._conn = None
+        self.lock = asyncio.Lock()
+
+    async def open(self):
+        self._conn = await self._call(self._connect)
+
+    def _connect(self) -> sqlite3.Connection:
+        # Transactions are managed explicitly by SqliteTransaction
+        conn = sqlite3.connect(
+            self._path,
+            timeout=self._busy_timeout,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=_CACHED_STATEMENTS,
+        )
+        conn.execute("PRAGMA journal_mode = WAL")
+        # Durable as of the last checkpoint, which is enough with WAL
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA foreign_keys = ON")
+        migrate(conn)
+        return conn
+
+    async def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            await self._call(conn.close)
+        self._executor.shutdown(wait=True)
+
+    async def _call(self, func: Callable[..., T], *args) -> T:
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args))
+
+    async def run(self, func: Callable[..., T], *args) -> T:
+        """Call ``func`` with the connection and ``args`` in the database thread."""
+        return await self._call(func, self._conn, *args)
+
+
+def _fetch(conn: sqlite3.Connection, query: str, args: Sequence[Any]) -> List[tuple]:
+    return conn.execute(query, args).fetchall()
+
+
+def _fetchrow(
+    conn: sqlite3.Connection, query: str, args: Sequence[Any]
+) -> Optional[tuple]:
+    return conn.execute(query, args).fetchone()
+
+
+def _execute(conn: sqlite3.Connection, query: str, args: Sequence[Any]) -> int:
+    return conn.execute(query, args).rowcount
+
+
+def _executemany(
+    conn: sqlite3.Connection, query: str, args: Iterable[Sequence[Any]]
+) -> int:
+    return conn.executemany(query, args).rowcount
+
+
+class SqliteTransaction:
+    """Transaction of a unit of work, started on the first query.
+
+    The first query takes the database lock and begins a transaction,
+    so units of work that never touch the database don't wait for others.
+    Taking the lock fails with ``asyncio.TimeoutError`` after
+    ``lock_timeout`` seconds, if given.
+    """
+
+    def __init__(self, database: SqliteDatabase, lock_timeout: Optional[float] = None):
+        self._database = database
+        self._lock_timeout = lock_timeout
+        self._begin_lock = asyncio.Lock()
+        self._started = False
+        self._finished = False
+
+    @property
+    def started(self) -> bool:
+        return self._started
+
+    async def __aenter__(self) -> "SqliteTransaction":
+        return self
+
+    async def __aexit__(self, *args):
+        await self.release()
+
+    async def _begin(self):
+        if self._started:
+            return
+
+        async with self._begin_lock:
+            if self._started:
+                return
+
+            started_at = perf_counter()
+            with tracing.span("sqlite.lock"):
+                await self._acquire_lock()
+            lock_wait.observe(perf_counter() - started_at)
+
+            try:
+                await self._database.run(_execute, "BEGIN", ())
+            except BaseException:
+                self._database.lock.release()
+                raise
+            self._started = True
+            self._finished = False
+
+    async def _acquire_lock(self):
+        lock = self._database.lock
+        acquire = asyncio.ensure_future(lock.acquire())
+        try:
+            await asyncio.wait_for(asyncio.shield(acquire), self._lock_timeout)
+        except BaseException:
+            # The lock may be acquired right as waiting times out or is
+            # cancelled, release it then instead of leaking it
+            def release_acquired(task: asyncio.Future):
+                if not task.cancelled() and task.exception() is None:
+                    lock.release()
+
+            acquire.add_done_callback(release_acquired)
+            acquire.cancel()
+            raise
+
+    async def _run(self, func: Callable[..., T], query: str, args: Any) -> T:
+        await self._begin()
+        with tracing.span("sqlite.query"):
+            return await self._database.run(func, query, args)
+
+    async def fetch(self, query: str, *args) -> List[tuple]:
+        return await self._run(_fetch, query, args)
+
+    async def fetchrow(self, query: str, *args) -> Optional[tuple]:
+        return await self._run(_fetchrow, query, args)
+
+    async def fetchval(self, query: str, *args) -> Any:
+        row = await self._run(_fetchrow, query, args)
+        return row[0] if row is not None else None
+
+    async def execute(self, query: str, *args) -> int:
+        """Execute ``query`` and return the number of changed rows."""
+        return await self._run(_execute, query, args)
+
+    async def executemany(self, query: str, args: Iterable[Sequence[Any]]) -> int:
+        return await self._run(_executemany, query, list(args))
+
+    async def commit(self):
+        await self._finish("COMMIT")
+
+    async def rollback(self):
+        await self._finish("ROLLBACK")
+
+    async def _finish(self, command: str):
+        if not self._started or self._finished:
+            return
+
+        await self._database.run(_execute, command, ())
+        self._finished = True
+
+    async def release(self):
+        if not self._started:
+            return
+
+        try:
+            await self.rollback()
+        finally:
+            self._release_lock()
+
+    def _release_lock(self):
+        self._started = False
+        self._database.lock.release()
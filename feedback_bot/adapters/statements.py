@@ -0,0 +1,73 @@
+"""Registry of the SQL statements used by repositories.
+
+Repositories declare their statements at import time with ``statement``,
+so new pool connections can prepare all of them up front with
+``prepare_all`` instead of paying for a parse/plan round trip on the first
+use of every statement.
+"""
+from __future__ import annotations
+
+import functools
+from logging import getLogger
+from typing import TYPE_CHECKING, Dict, List
+
+if TYPE_CHECKING:
+    import asyncpg
+
+log = getLogger(__name__)
+
+# Name of queries which aren't registered statements
+AD_HOC = "ad_hoc"
+
+_statements: Dict[str, str] = {}
+_names: Dict[str, str] = {}
+
+
+def statement(name: str, sql: str) -> str:
+    """Register ``sql`` under ``name`` and return it unchanged."""
+    if name in _statements:
+        raise ValueError(f"Statement {name} is already registered")
+
+    _statements[name] = sql
+    _names[sql] = name
+    return sql
+
+
+def registered() -> Dict[str, str]:
+    return dict(_statements)
+
+
+def name_of(sql: str) -> str:
+    """Name of a registered statement, ``AD_HOC`` for other queries."""
+    return _names.get(sql, AD_HOC)
+
+
+async def prepare_all(conn: asyncpg.Connection) -> List[str]:
+    """Prepare registered statements on ``conn`` and return the names
+    of statements that failed to prepare.
+
+    Statements are put into the statement cache of the connection,
+    which ``fetch``, ``execute`` and friends look queries up in. Public
+    ``prepare`` bypasses that cache, so the private ``_prepare`` of the
+    asyncpg version pinned in pyproject.toml is used, falling back to
+    ``prepare`` to at least check the statements if it goes away.
+    A statement failing to prepare doesn't prevent the connection from being
+    used, the error will surface when the statement is executed.
+    """
+    try:
+        prepare = functools.partial(conn._prepare, use_cache=True)
+    except AttributeError:
+        log.warning("Statement cache isn't available, only checking statements")
+        prepare = conn.prepare
+
+    import asyncpg
+
+    failed = []
+    for name, sql in _statements.items():
+        try:
+            await prepare(sql)
+        except asyncpg.PostgresError:
+            log.warning("Failed to prepare statement %s", name, exc_info=True)
+            failed.append(name)
+
+    return failed
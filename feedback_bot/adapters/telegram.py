@@ -1,6 +1,27 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import time
 from abc import ABC, abstractmethod
+from enum import IntEnum
+from logging import getLogger
+from typing import Awaitable, Callable, Dict, List, Optional, TypeVar
 
 from aiogram import Bot
+from aiogram.utils.exceptions import RetryAfter
+
+from feedback_bot import metrics, tracing
+
+log = getLogger(__name__)
+
+T = TypeVar("T")
+
+request_duration = metrics.labeled_histogram(
+    "telegram_request_duration_seconds",
+    "Time spent in Telegram Bot API requests",
+    labelnames=("method",),
+)
 
 
 class AbstractTelegramAPI(ABC):
@@ -25,9 +46,13 @@ class TelegramAPI(AbstractTelegramAPI):
     def __init__(self, bot: Bot):
         self._bot = bot
 
+    @metrics.timed(request_duration.labels("sendMessage"))
+    @tracing.traced("telegram.sendMessage")
     async def send_message(self, to_chat_id: int, text: str):
         await self._bot.send_message(chat_id=to_chat_id, text=text)
 
+    @metrics.timed(request_duration.labels("forwardMessage"))
+    @tracing.traced("telegram.forwardMessage")
     async def forward_message(
         self, from_chat_id: int, to_chat_id: int, message_id: int
     ):
@@ -36,9 +61,276 @@ class TelegramAPI(AbstractTelegramAPI):
         )
         return tg_forwarded_message.message_id
     
+    @metrics.timed(request_duration.labels("copyMessage"))
+    @tracing.traced("telegram.copyMessage")
     async def copy_message(
         self, from_chat_id: int, to_chat_id: int, message_id: int
     ):
         return await self._bot.copy_message(
             chat_id=to_chat_id, from_chat_id=from_chat_id, message_id=message_id
         )
+
+
+class Priority(IntEnum):
+    """Outbound request priority, lower values are sent first."""
+
+    REPLY = 0
+    FORWARD = 1
+    NOTIFICATION = 2
+
+
+class TokenBucket:
+    """Token bucket holding at most one token, refilled at ``rate`` tokens
+    per second. Sending is additionally blocked until ``blocked_until``.
+    """
+
+    __slots__ = ("rate", "tokens", "updated_at", "blocked_until")
+
+    def __init__(self, rate: float, now: float):
+        self.rate = rate
+        self.tokens = 1.0
+        self.updated_at = now
+        self.blocked_until = 0.0
+
+    def wait_time(self, now: float) -> float:
+        """Return time until a token is available, 0 if it's available now."""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+
+        self.tokens = min(1.0, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1.0:
+            return 0.0
+
+        return (1.0 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1.0
+
+    def block(self, until: float):
+        self.blocked_until = max(self.blocked_until, until)
+
+
+class _OutboundRequest:
+    __slots__ = ("priority", "seq", "chat_id", "send", "future", "attempts", "span")
+
+    def __init__(
+        self,
+        priority: Priority,
+        seq: int,
+        chat_id: int,
+        send: Callable[[], Awaitable],
+        future: asyncio.Future,
+        span: Optional[tracing.Span] = None,
+    ):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.send = send
+        self.future = future
+        self.attempts = 0
+        # Requests are sent by other tasks, this span is the parent of theirs
+        self.span = span
+
+    def __lt__(self, other: "_OutboundRequest"):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class OutboundScheduler:
+    """Sends Telegram requests within Bot API rate limits.
+
+    Requests are sent in priority order, subject to a global token bucket
+    and a token bucket per chat. Group chats (negative chat IDs) have
+    a separate per-chat rate. When Telegram responds with "Retry After",
+    all requests are paused for the requested time, as flood control
+    applies to the whole bot, and the request is retried up to
+    ``max_retries`` times.
+    """
+
+    _MAX_IDLE_CHAT_BUCKETS = 1000
+
+    def __init__(
+        self,
+        global_rate: float,
+        private_chat_rate: float,
+        group_chat_rate: float,
+        max_retries: int = 3,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._private_chat_rate = private_chat_rate
+        self._group_chat_rate = group_chat_rate
+        self._max_retries = max_retries
+        self._clock = clock
+
+        self._global_bucket = TokenBucket(global_rate, clock())
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._queue: List[_OutboundRequest] = []
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._runner: Optional[asyncio.Task] = None
+        self._in_flight = 0
+
+    def __len__(self):
+        """Number of queued and in-flight requests."""
+        return len(self._queue) + self._in_flight
+
+    async def submit(
+        self, chat_id: int, priority: Priority, send: Callable[[], Awaitable[T]]
+    ) -> T:
+        if self._runner is None:
+            self._wakeup = asyncio.Event()
+            # The runner must not inherit the context of the first request
+            self._runner = contextvars.Context().run(asyncio.ensure_future, self._run())
+
+        with tracing.span("telegram.outbound") as span:
+            span.set("chat_id", chat_id)
+            span.set("priority", priority.name)
+            future = asyncio.get_event_loop().create_future()
+            request = _OutboundRequest(
+                priority, next(self._seq), chat_id, send, future, tracing.current_span()
+            )
+            heapq.heappush(self._queue, request)
+            self._wakeup.set()
+            return await future
+
+    async def close(self) -> int:
+        """Stop sending requests and return the number of abandoned ones,
+        queued or in flight.
+        """
+        if self._runner is not None:
+            self._runner.cancel()
+            self._runner = None
+        return len(self)
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            rate = self._group_chat_rate if chat_id < 0 else self._private_chat_rate
+            bucket = self._chat_buckets[chat_id] = TokenBucket(rate, self._clock())
+
+        return bucket
+
+    async def _run(self):
+        while True:
+            timeout = self._send_ready()
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _send_ready(self) -> Optional[float]:
+        """Start sending requests allowed by rate limits and return time
+        until the next one might be allowed.
+        """
+        now = self._clock()
+        timeout = None
+        deferred = []
+        while self._queue:
+            request = heapq.heappop(self._queue)
+            if request.future.done():
+                continue
+
+            chat_wait = self._chat_bucket(request.chat_id).wait_time(now)
+            if chat_wait:
+                deferred.append(request)
+                timeout = chat_wait if timeout is None else min(timeout, chat_wait)
+                continue
+
+            global_wait = self._global_bucket.wait_time(now)
+            if global_wait:
+                deferred.append(request)
+                timeout = global_wait if timeout is None else min(timeout, global_wait)
+                break
+
+            self._global_bucket.consume()
+            self._chat_bucket(request.chat_id).consume()
+            self._in_flight += 1
+            asyncio.ensure_future(self._send(request))
+
+        for request in deferred:
+            heapq.heappush(self._queue, request)
+
+        if len(self._chat_buckets) > self._MAX_IDLE_CHAT_BUCKETS:
+            self._forget_idle_chat_buckets(now)
+
+        return timeout
+
+    def _forget_idle_chat_buckets(self, now: float):
+        queued_chat_ids = {request.chat_id for request in self._queue}
+        self._chat_buckets = {
+            chat_id: bucket
+            for chat_id, bucket in self._chat_buckets.items()
+            if chat_id in queued_chat_ids or bucket.wait_time(now)
+        }
+
+    async def _send(self, request: _OutboundRequest):
+        if request.span is not None:
+            tracing.set_current_span(request.span)
+        try:
+            result = await request.send()
+        except RetryAfter as e:
+            if request.attempts < self._max_retries and not request.future.done():
+                request.attempts += 1
+                log.warning(
+                    "Telegram rate limit exceeded for chat_id=%d, "
+                    "pausing all requests for %ds",
+                    request.chat_id,
+                    e.timeout,
+                )
+                blocked_until = self._clock() + e.timeout
+                self._chat_bucket(request.chat_id).block(blocked_until)
+                self._global_bucket.block(blocked_until)
+                heapq.heappush(self._queue, request)
+            elif not request.future.done():
+                request.future.set_exception(e)
+        except Exception as e:
+            if not request.future.done():
+                request.future.set_exception(e)
+        else:
+            if not request.future.done():
+                request.future.set_result(result)
+        finally:
+            self._in_flight -= 1
+            self._wakeup.set()
+
+
+class RateLimitedTelegramAPI(AbstractTelegramAPI):
+    """Sends requests of the wrapped API through an OutboundScheduler.
+
+    Replies to users go first, then forwarded messages
+    and then notifications.
+    """
+
+    def __init__(self, telegram_api: AbstractTelegramAPI, scheduler: OutboundScheduler):
+        self._telegram_api = telegram_api
+        self._scheduler = scheduler
+
+    async def send_message(self, to_chat_id: int, text: str):
+        return await self._scheduler.submit(
+            to_chat_id,
+            Priority.NOTIFICATION,
+            lambda: self._telegram_api.send_message(to_chat_id=to_chat_id, text=text),
+        )
+
+    async def forward_message(
+        self, from_chat_id: int, to_chat_id: int, message_id: int
+    ):
+        return await self._scheduler.submit(
+            to_chat_id,
+            Priority.FORWARD,
+            lambda: self._telegram_api.forward_message(
+                from_chat_id=from_chat_id, to_chat_id=to_chat_id, message_id=message_id
+            ),
+        )
+
+    async def copy_message(
+        self, from_chat_id: int, to_chat_id: int, message_id: int
+    ):
+        return await self._scheduler.submit(
+            to_chat_id,
+            Priority.REPLY,
+            lambda: self._telegram_api.copy_message(
+                from_chat_id=from_chat_id, to_chat_id=to_chat_id, message_id=message_id
+            ),
+        )
@@ -1,36 +1,525 @@
+from __future__ import annotations
+
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import timedelta
+from logging import getLogger
+from typing import TYPE_CHECKING, AsyncIterator, Mapping, Optional
+from uuid import uuid4
+
 import aiogram
-import asyncpg
+from aiogram.bot.api import TelegramAPIServer
 from dependency_injector.providers import (
+    Callable,
     Configuration,
+    Dict,
     Factory,
+    Object,
     Provider,
     Resource,
+    Selector,
     Singleton,
 )
 from dependency_injector.containers import DeclarativeContainer
 
-from feedback_bot.adapters import telegram
-from feedback_bot.config import settings
-from feedback_bot.service_layer import unit_of_work
+from feedback_bot.adapters import invalidation, partitions, statements, telegram
+from feedback_bot.adapters import pool as pool_adapter
+from feedback_bot.adapters.connection import LazyConnection
+from feedback_bot.adapters.query_log import SlowQueryLog
+from feedback_bot.adapters.cache import Registry
+from feedback_bot.adapters.repositories import (
+    admin,
+    forwarded_message,
+    outbox as outbox_repository,
+    target_chat,
+    update_offset,
+)
+from feedback_bot.adapters.sqlite import SqliteDatabase, SqliteTransaction
+from feedback_bot import metrics, tracing
+from feedback_bot.service_layer import outbox, retention, unit_of_work
+from feedback_bot.updates import UpdateWorkerPool
+from feedback_bot.webhook import Readiness
+
+if TYPE_CHECKING:
+    import asyncpg
+
+log = getLogger(__name__)
+
+shutdown_abandoned = metrics.labeled_counter(
+    "shutdown_abandoned_total",
+    "Work abandoned on shutdown by kind, either updates, forwarded messages "
+    "or outbound requests",
+    labelnames=("kind",),
+)
+
+_PARTITION_MAINTENANCE_INTERVAL = 24 * 60 * 60
+# Connections are only still in use by updates abandoned on shutdown
+_POOL_CLOSE_TIMEOUT = 5
+
+
+def worker_pool_size(size: int, workers: int) -> int:
+    """Split a connection count between the worker processes,
+    leaving each worker at least one connection unless ``size`` is 0.
+    """
+    return max(min(size, 1), size // workers)
 
 
-async def init_connection_pool(dsn: str):
-    async with asyncpg.create_pool(dsn=dsn) as pool:
+def cache_invalidation_needed(enabled: bool, workers: int) -> bool:
+    """Worker processes have caches of their own, which have to be kept in sync."""
+    return enabled or workers > 1
+
+
+def forwarded_message_lookup_window(
+    reply_window_days: int, retention_days: int, dry_run: bool
+) -> timedelta:
+    """Replies only look for messages forwarded within the reply window,
+    or within the retention period if it's shorter, as older messages
+    are removed then.
+    """
+    if retention_days and not dry_run:
+        return timedelta(days=min(reply_window_days, retention_days))
+    return timedelta(days=reply_window_days)
+
+
+def create_slow_query_log(threshold: float, explain: bool) -> Optional[SlowQueryLog]:
+    if not threshold:
+        return None
+    return SlowQueryLog(threshold=threshold, explain=explain)
+
+
+async def init_connection_pool(
+    dsn: str,
+    min_size: int,
+    max_size: int,
+    max_inactive_connection_lifetime: float,
+    prepare_statements: bool,
+):
+    # Imported on use, so SQLite deployments don't load the driver
+    import asyncpg
+
+    pool = await asyncpg.create_pool(
+        dsn=dsn,
+        min_size=min(min_size, max_size),
+        max_size=max_size,
+        max_inactive_connection_lifetime=max_inactive_connection_lifetime,
+        init=statements.prepare_all if prepare_statements else None,
+    )
+    pool_adapter.bind_metrics(pool)
+    try:
         yield pool
+    finally:
+        pool_adapter.bind_metrics(None)
+        try:
+            await asyncio.wait_for(pool.close(), _POOL_CLOSE_TIMEOUT)
+        except asyncio.TimeoutError:
+            log.warning("Terminating database connections still in use")
+            pool.terminate()
+
+
+async def init_sqlite_database(path: str):
+    database = SqliteDatabase(path)
+    await database.open()
+    try:
+        yield database
+    finally:
+        await database.close()
+
+
+def postgres_update_offsets(pool: asyncpg.Pool) -> update_offset.UpdateOffsets:
+    @asynccontextmanager
+    async def update_offsets() -> AsyncIterator[
+        update_offset.AbstractUpdateOffsetRepository
+    ]:
+        async with pool.acquire() as conn:
+            yield update_offset.PostgresUpdateOffsetRepository(conn)
+
+    return update_offsets
+
+
+def sqlite_update_offsets(database: SqliteDatabase) -> update_offset.UpdateOffsets:
+    @asynccontextmanager
+    async def update_offsets() -> AsyncIterator[
+        update_offset.AbstractUpdateOffsetRepository
+    ]:
+        async with SqliteTransaction(database) as conn:
+            yield update_offset.SqliteUpdateOffsetRepository(conn)
+            await conn.commit()
+
+    return update_offsets
+
+
+def postgres_outbox_transactions(
+    pool: asyncpg.Pool, slow_query_log: Optional[SlowQueryLog]
+) -> outbox.OutboxTransactions:
+    @asynccontextmanager
+    async def outbox_transaction() -> AsyncIterator[outbox.OutboxTransaction]:
+        async with LazyConnection(pool, slow_query_log=slow_query_log) as conn:
+            yield outbox.OutboxTransaction(
+                outbox=outbox_repository.PostgresOutboxRepository(conn),
+                forwarded_messages=(
+                    forwarded_message.PostgresForwardedMessageRepository(conn)
+                ),
+            )
+
+    return outbox_transaction
+
+
+def sqlite_outbox_transactions(database: SqliteDatabase) -> outbox.OutboxTransactions:
+    @asynccontextmanager
+    async def outbox_transaction() -> AsyncIterator[outbox.OutboxTransaction]:
+        async with SqliteTransaction(database) as conn:
+            yield outbox.OutboxTransaction(
+                outbox=outbox_repository.SqliteOutboxRepository(conn),
+                forwarded_messages=(
+                    forwarded_message.SqliteForwardedMessageRepository(conn)
+                ),
+            )
+            await conn.commit()
+
+    return outbox_transaction
+
+
+async def init_outbox_relay(dispatcher: outbox.OutboxDispatcher):
+    task = asyncio.ensure_future(dispatcher.run())
+    try:
+        yield dispatcher
+    finally:
+        task.cancel()
+
+
+async def init_pool_health_check(pool: asyncpg.Pool, interval: float, timeout: float):
+    if not interval:
+        yield None
+        return
+
+    health_check = pool_adapter.PoolHealthCheck(
+        pool=pool, interval=interval, timeout=timeout
+    )
+    task = asyncio.ensure_future(health_check.run())
+    try:
+        yield health_check
+    finally:
+        task.cancel()
+
+
+async def init_forwarded_message_buffer(
+    pool: asyncpg.Pool,
+    enabled: bool,
+    batch_size: int,
+    max_size: int,
+    flush_interval: float,
+    slow_query_log: Optional[SlowQueryLog],
+):
+    if not enabled:
+        yield None
+        return
+
+    buffer = forwarded_message.ForwardedMessageWriteBuffer(
+        pool=pool,
+        batch_size=batch_size,
+        max_size=max_size,
+        flush_interval=flush_interval,
+        slow_query_log=slow_query_log,
+    )
+    buffer.start()
+    try:
+        yield buffer
+    finally:
+        log.info("Flushing %d buffered forwarded messages", len(buffer))
+        shutdown_abandoned.labels("forwarded_messages").inc(await buffer.close())
+
+
+async def init_partition_maintenance(
+    pool: asyncpg.Pool, months_ahead: int, slow_query_log: Optional[SlowQueryLog]
+):
+    async def maintain_partitions():
+        while True:
+            try:
+                # Each partition is created in a transaction of its own
+                async with LazyConnection(
+                    pool, slow_query_log=slow_query_log, autocommit=True
+                ) as conn:
+                    manager = partitions.ForwardedMessagePartitionManager(conn)
+                    created = await manager.create_partitions(months_ahead)
+                    default_rows = await manager.count_default_rows()
+                for partition in created:
+                    log.info("Created partition %s", partition.name)
+                if default_rows:
+                    log.warning(
+                        "%d forwarded messages are in the default partition",
+                        default_rows,
+                    )
+            except Exception:
+                log.exception("Failed to create forwarded_message partitions")
+
+            await asyncio.sleep(_PARTITION_MAINTENANCE_INTERVAL)
+
+    task = asyncio.ensure_future(maintain_partitions())
+    try:
+        yield task
+    finally:
+        task.cancel()
+
+
+async def init_forwarded_message_retention(
+    pool: asyncpg.Pool,
+    retention_days: int,
+    interval: float,
+    batch_size: int,
+    batch_pause: float,
+    dry_run: bool,
+    slow_query_log: Optional[SlowQueryLog],
+):
+    if not retention_days:
+        yield None
+        return
+
+    job = retention.ForwardedMessageRetention(
+        pool=pool,
+        retention=timedelta(days=retention_days),
+        interval=interval,
+        batch_size=batch_size,
+        batch_pause=batch_pause,
+        dry_run=dry_run,
+        slow_query_log=slow_query_log,
+    )
+    task = asyncio.ensure_future(job.run())
+    try:
+        yield job
+    finally:
+        task.cancel()
+
+
+async def init_cache_invalidation_bus(
+    dsn: str,
+    enabled: bool,
+    registries: Mapping[str, Registry],
+):
+    if not enabled:
+        yield None
+        return
+
+    # Each process, including forked workers, is a separate node
+    bus = invalidation.CacheInvalidationBus(
+        dsn=dsn, registries=registries, node_id=uuid4().hex
+    )
+    task = asyncio.ensure_future(bus.listen())
+    try:
+        yield bus
+    finally:
+        task.cancel()
+
+
+async def init_tracer(
+    sample_rate: float,
+    exporter: str,
+    file_path: str,
+    otlp_endpoint: str,
+    export_interval: float,
+):
+    if not sample_rate:
+        yield None
+        return
+
+    if exporter == "otlp":
+        span_exporter = tracing.OTLPSpanExporter(endpoint=otlp_endpoint)
+    else:
+        span_exporter = tracing.FileSpanExporter(path=file_path)
+
+    tracer = tracing.Tracer(sample_rate=sample_rate, exporter=span_exporter)
+    tracing.set_tracer(tracer)
+    task = asyncio.ensure_future(tracer.run(export_interval))
+    try:
+        yield tracer
+    finally:
+        task.cancel()
+        tracing.set_tracer(None)
+        await tracer.close()
+
+
+async def init_outbound_scheduler(
+    global_rate: float,
+    private_chat_rate: float,
+    group_chat_rate: float,
+):
+    scheduler = telegram.OutboundScheduler(
+        global_rate=global_rate,
+        private_chat_rate=private_chat_rate,
+        group_chat_rate=group_chat_rate,
+    )
+    try:
+        yield scheduler
+    finally:
+        abandoned = await scheduler.close()
+        if abandoned:
+            log.warning("Abandoned %d outbound Telegram requests", abandoned)
+        shutdown_abandoned.labels("outbound_requests").inc(abandoned)
 
 
 class Container(DeclarativeContainer):
-    config = Configuration(default=settings.as_dict())
+    # Filled with validated settings by main.inject_dependencies
+    config = Configuration()
 
-    bot = Singleton(aiogram.Bot, config.TELEGRAM_BOT_TOKEN)
+    bot = Singleton(
+        aiogram.Bot,
+        config.TELEGRAM_BOT_TOKEN,
+        server=Callable(TelegramAPIServer.from_base, config.TELEGRAM_API_SERVER),
+    )
+    tracer = Resource(
+        init_tracer,
+        sample_rate=config.TRACING_SAMPLE_RATE,
+        exporter=config.TRACING_EXPORTER,
+        file_path=config.TRACING_FILE_PATH,
+        otlp_endpoint=config.TRACING_OTLP_ENDPOINT,
+        export_interval=config.TRACING_EXPORT_INTERVAL,
+    )
+    outbound_scheduler = Resource(
+        init_outbound_scheduler,
+        global_rate=config.TELEGRAM_GLOBAL_RATE_LIMIT,
+        private_chat_rate=config.TELEGRAM_PRIVATE_CHAT_RATE_LIMIT,
+        group_chat_rate=config.TELEGRAM_GROUP_CHAT_RATE_LIMIT.as_(
+            lambda per_minute: per_minute / 60
+        ),
+    )
     telegram_api: Provider[telegram.AbstractTelegramAPI] = Factory(
-        telegram.TelegramAPI,
-        bot=bot,
+        telegram.RateLimitedTelegramAPI,
+        telegram_api=Factory(telegram.TelegramAPI, bot=bot),
+        scheduler=outbound_scheduler,
+    )
+    update_worker_pool = Singleton(
+        UpdateWorkerPool,
+        shards=config.TELEGRAM_WEBHOOK_SHARDS,
+        queue_size=config.TELEGRAM_WEBHOOK_QUEUE_SIZE,
     )
+    readiness = Singleton(Readiness)
 
-    pool = Resource(init_connection_pool, dsn=config.DATABASE_URL)
-    uow: Provider[unit_of_work.AbstractUnitOfWork] = Factory(
-        unit_of_work.PostgresUnitOfWork,
-        bot=bot,
-        pool=pool
+    pool = Resource(
+        init_connection_pool,
+        dsn=config.DATABASE_URL,
+        min_size=Callable(
+            worker_pool_size,
+            size=config.DATABASE_POOL_MIN_SIZE,
+            workers=config.WORKERS,
+        ),
+        max_size=Callable(
+            worker_pool_size,
+            size=config.DATABASE_POOL_MAX_SIZE,
+            workers=config.WORKERS,
+        ),
+        max_inactive_connection_lifetime=(
+            config.DATABASE_POOL_MAX_INACTIVE_CONNECTION_LIFETIME
+        ),
+        prepare_statements=config.DATABASE_PREPARE_STATEMENTS,
+    )
+    slow_query_log = Singleton(
+        create_slow_query_log,
+        threshold=config.DATABASE_SLOW_QUERY_THRESHOLD,
+        explain=config.DATABASE_SLOW_QUERY_EXPLAIN,
+    )
+    pool_health_check = Resource(
+        init_pool_health_check,
+        pool=pool,
+        interval=config.DATABASE_POOL_HEALTH_CHECK_INTERVAL,
+        timeout=config.DATABASE_POOL_HEALTH_CHECK_TIMEOUT,
+    )
+    target_chat_registry = Singleton(target_chat.TargetChatRegistry)
+    admin_directory = Singleton(admin.AdminDirectory)
+    forwarded_message_buffer = Resource(
+        init_forwarded_message_buffer,
+        pool=pool,
+        enabled=config.FORWARDED_MESSAGE_WRITE_BEHIND,
+        batch_size=config.FORWARDED_MESSAGE_BATCH_SIZE,
+        max_size=config.FORWARDED_MESSAGE_BUFFER_SIZE,
+        flush_interval=config.FORWARDED_MESSAGE_FLUSH_INTERVAL,
+        slow_query_log=slow_query_log,
+    )
+    partition_maintenance = Resource(
+        init_partition_maintenance,
+        pool=pool,
+        months_ahead=config.FORWARDED_MESSAGE_PARTITIONS_AHEAD,
+        slow_query_log=slow_query_log,
+    )
+    forwarded_message_retention = Resource(
+        init_forwarded_message_retention,
+        pool=pool,
+        retention_days=config.FORWARDED_MESSAGE_RETENTION_DAYS,
+        interval=config.FORWARDED_MESSAGE_RETENTION_INTERVAL,
+        batch_size=config.FORWARDED_MESSAGE_RETENTION_BATCH_SIZE,
+        batch_pause=config.FORWARDED_MESSAGE_RETENTION_BATCH_PAUSE,
+        dry_run=config.FORWARDED_MESSAGE_RETENTION_DRY_RUN,
+        slow_query_log=slow_query_log,
+    )
+    cache_invalidation_bus = Resource(
+        init_cache_invalidation_bus,
+        dsn=config.DATABASE_URL,
+        enabled=Callable(
+            cache_invalidation_needed,
+            enabled=config.CACHE_INVALIDATION_ENABLED,
+            workers=config.WORKERS,
+        ),
+        registries=Dict(
+            {
+                invalidation.TARGET_CHAT_REGISTRY: target_chat_registry,
+                invalidation.ADMIN_DIRECTORY: admin_directory,
+            }
+        ),
+    )
+    sqlite_database = Resource(init_sqlite_database, path=config.DATABASE_SQLITE_PATH)
+    update_offsets = Selector(
+        config.DATABASE_BACKEND,
+        postgres=Callable(postgres_update_offsets, pool=pool),
+        sqlite=Callable(sqlite_update_offsets, database=sqlite_database),
+    )
+    outbox_dispatcher = Singleton(
+        outbox.OutboxDispatcher,
+        telegram_api=telegram_api,
+        transactions=Selector(
+            config.DATABASE_BACKEND,
+            postgres=Callable(
+                postgres_outbox_transactions, pool=pool, slow_query_log=slow_query_log
+            ),
+            sqlite=Callable(sqlite_outbox_transactions, database=sqlite_database),
+        ),
+        lease=config.OUTBOX_LEASE,
+        retry_interval=config.OUTBOX_RETRY_INTERVAL,
+        max_attempts=config.OUTBOX_MAX_ATTEMPTS,
+        poll_interval=config.OUTBOX_POLL_INTERVAL,
+        forwarded_message_buffer=Selector(
+            config.DATABASE_BACKEND,
+            postgres=forwarded_message_buffer,
+            sqlite=Object(None),
+        ),
+    )
+    outbox_relay = Resource(init_outbox_relay, dispatcher=outbox_dispatcher)
+    uow: Provider[unit_of_work.AbstractUnitOfWork] = Selector(
+        config.DATABASE_BACKEND,
+        postgres=Factory(
+            unit_of_work.PostgresUnitOfWork,
+            outbox_dispatcher=outbox_dispatcher,
+            pool=pool,
+            target_chat_registry=target_chat_registry,
+            admin_directory=admin_directory,
+            forwarded_message_buffer=forwarded_message_buffer,
+            cache_invalidation_bus=cache_invalidation_bus,
+            acquire_timeout=config.DATABASE_POOL_ACQUIRE_TIMEOUT.as_(
+                lambda timeout: timeout or None
+            ),
+            slow_query_log=slow_query_log,
+            forwarded_message_lookup_window=Callable(
+                forwarded_message_lookup_window,
+                reply_window_days=config.FORWARDED_MESSAGE_REPLY_WINDOW_DAYS,
+                retention_days=config.FORWARDED_MESSAGE_RETENTION_DAYS,
+                dry_run=config.FORWARDED_MESSAGE_RETENTION_DRY_RUN,
+            ),
+        ),
+        sqlite=Factory(
+            unit_of_work.SqliteUnitOfWork,
+            outbox_dispatcher=outbox_dispatcher,
+            database=sqlite_database,
+            target_chat_registry=target_chat_registry,
+            admin_directory=admin_directory,
+            lock_timeout=config.DATABASE_POOL_ACQUIRE_TIMEOUT.as_(
+                lambda timeout: timeout or None
+            ),
+        ),
     )
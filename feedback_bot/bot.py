@@ -1,15 +1,52 @@
+import asyncio
+import functools
 import logging
+import signal
+from time import perf_counter
+from typing import Optional
 
 from aiogram import Bot, Dispatcher, executor, types
+from aiohttp import web
 from dependency_injector.wiring import inject, Provide
 
-from feedback_bot.bootstrap import Container
+from feedback_bot import metrics, tracing
+from feedback_bot.routing import AnyChatMemberUpdated, AnyMessage, UpdateRouter
+from feedback_bot.adapters.repositories.update_offset import UpdateOffsets
+from feedback_bot.bootstrap import Container, shutdown_abandoned
+from feedback_bot.polling import UpdatePoller
+from feedback_bot.updates import InstrumentedDispatcher, UpdateWorkerPool
+from feedback_bot.webhook import (
+    HEALTHZ_PATH,
+    METRICS_PATH,
+    READINESS_KEY,
+    READYZ_PATH,
+    UPDATE_WORKER_POOL_KEY,
+    ImmediateAckRequestHandler,
+    LeanRequestHandler,
+    Readiness,
+    handle_healthz,
+    handle_metrics,
+    handle_readyz,
+)
 from feedback_bot.service_layer import services
 
 log = logging.getLogger(__name__)
 
+# aiogram's executor only stops polling on KeyboardInterrupt
+_STOP_SIGNALS = (signal.SIGTERM, signal.SIGINT)
+# Caches are loaded without waiting any longer for the database to listen
+_CACHE_INVALIDATION_LISTEN_TIMEOUT = 10
 
-async def handle_auth_command(message: types.Message):
+handler_duration = metrics.labeled_histogram(
+    "handler_duration_seconds",
+    "Time spent in update handlers",
+    labelnames=("handler",),
+)
+
+
+@metrics.timed(handler_duration.labels("handle_auth_command"))
+@tracing.traced("handler.handle_auth_command")
+async def handle_auth_command(message: AnyMessage):
     log.debug(
         "Processing /auth command by user_id=%d message_id=%d",
         message.from_user.id,
@@ -33,7 +70,9 @@ async def handle_auth_command(message: types.Message):
     )
 
 
-async def handle_my_chat_member_update(my_chat_member: types.ChatMemberUpdated):
+@metrics.timed(handler_duration.labels("handle_my_chat_member_update"))
+@tracing.traced("handler.handle_my_chat_member_update")
+async def handle_my_chat_member_update(my_chat_member: AnyChatMemberUpdated):
     if my_chat_member.new_chat_member.status in ("kicked", "left"):
         log.debug(
             'Bot kicked from group %d "%s" by user_id=%d',
@@ -55,7 +94,9 @@ async def handle_my_chat_member_update(my_chat_member: types.ChatMemberUpdated):
         )
 
 
-async def handle_private_message(message: types.Message):
+@metrics.timed(handler_duration.labels("handle_private_message"))
+@tracing.traced("handler.handle_private_message")
+async def handle_private_message(message: AnyMessage):
     log.debug(
         "Processing private message message_id=%d chat_id=%d",
         message.message_id,
@@ -75,7 +116,9 @@ async def handle_private_message(message: types.Message):
     )
 
 
-async def handle_reply(message: types.Message):
+@metrics.timed(handler_duration.labels("handle_reply"))
+@tracing.traced("handler.handle_reply")
+async def handle_reply(message: AnyMessage):
     log.debug(
         "Processing reply message_id=%d chat_id=%d",
         message.message_id,
@@ -89,7 +132,14 @@ async def handle_reply(message: types.Message):
 
 
 def create_dispatcher(bot: Bot):
-    dp = Dispatcher(bot)
+    # Keep the routes in sync with the handlers registered below
+    router = UpdateRouter(
+        my_chat_member=handle_my_chat_member_update,
+        auth_command=handle_auth_command,
+        reply=handle_reply,
+        private_message=handle_private_message,
+    )
+    dp = InstrumentedDispatcher(bot, router=router)
 
     dp.register_my_chat_member_handler(handle_my_chat_member_update)
     dp.register_message_handler(
@@ -120,22 +170,246 @@ async def set_webhook(
         webhook_path = "/" + webhook_path
 
     webhook_url = f"{webhook_host}{webhook_path}"
+    # Setting the webhook again is rate limited and makes Telegram
+    # reconnect, which is needless on every restart
+    webhook_info = await dp.bot.get_webhook_info()
+    if webhook_info.url == webhook_url:
+        log.info("Webhook is already set to %s", webhook_url)
+        return
+
     await dp.bot.set_webhook(webhook_url)
 
 
+@inject
+async def warm_up(
+    dp: Dispatcher,
+    container: Container = Provide[Container.__self__],
+):
+    """Open the database connections and load the caches, so the first
+    updates don't wait for them.
+    """
+    # The pool opens its minimum number of connections concurrently
+    if container.config.DATABASE_BACKEND() == "postgres":
+        await container.pool.init()
+        bus = await container.cache_invalidation_bus.init()
+        if bus is not None:
+            # The listener invalidates the caches once it's connected,
+            # so they're loaded only after that
+            try:
+                await asyncio.wait_for(
+                    bus.wait_listening(), _CACHE_INVALIDATION_LISTEN_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                log.warning("Loading caches before cache invalidation listens")
+    else:
+        await container.sqlite_database.init()
+    await services.load_caches()
+
+
+@inject
+async def mark_ready(
+    dp: Dispatcher,
+    readiness: Readiness = Provide[Container.readiness],
+):
+    readiness.ready = True
+
+
+@inject
+async def start_maintenance(
+    dp: Dispatcher,
+    container: Container = Provide[Container.__self__],
+):
+    """Start background maintenance jobs, which run until shutdown."""
+    # Partitioning and retention are implemented for PostgreSQL only
+    if container.config.DATABASE_BACKEND() != "postgres":
+        return
+
+    await container.partition_maintenance.init()
+    await container.forwarded_message_retention.init()
+
+
+@inject
+async def start_tracing(
+    dp: Dispatcher,
+    container: Container = Provide[Container.__self__],
+):
+    """Start sampling updates of this process, if tracing is enabled."""
+    await container.tracer.init()
+
+
+@inject
+async def start_pool_health_check(
+    dp: Dispatcher,
+    container: Container = Provide[Container.__self__],
+):
+    """Start checking idle connections of the pool of this process."""
+    if container.config.DATABASE_BACKEND() != "postgres":
+        return
+
+    await container.pool_health_check.init()
+
+
+@inject
+async def start_outbox_relay(
+    dp: Dispatcher,
+    container: Container = Provide[Container.__self__],
+):
+    """Start sending Telegram requests to retry or left over by stopped
+    processes.
+    """
+    await container.outbox_relay.init()
+
+
+@inject
+async def shutdown_resources(
+    dp: Dispatcher,
+    container: Container = Provide[Container.__self__],
+):
+    # The relay hands forwarded messages to the buffer
+    if container.outbox_relay.initialized:
+        await container.outbox_relay.shutdown()
+    # Buffered writes have to be flushed while the pool is still open
+    if container.forwarded_message_buffer.initialized:
+        await container.forwarded_message_buffer.shutdown()
+
+    shutdown = container.shutdown_resources()
+    if shutdown is not None:
+        await shutdown
+
+
+@inject
+async def start_update_workers(
+    dp: Dispatcher,
+    update_worker_pool: UpdateWorkerPool = Provide[Container.update_worker_pool],
+):
+    update_worker_pool.start(dp)
+
+
+@inject
+async def drain(
+    dp: InstrumentedDispatcher,
+    readiness: Readiness = Provide[Container.readiness],
+    update_worker_pool: UpdateWorkerPool = Provide[Container.update_worker_pool],
+    immediate_ack: bool = Provide[Container.config.TELEGRAM_WEBHOOK_IMMEDIATE_ACK],
+    timeout: float = Provide[Container.config.SHUTDOWN_DRAIN_TIMEOUT],
+    poller: Optional[UpdatePoller] = None,
+):
+    """Stop taking updates and wait at most ``timeout`` seconds for those
+    being processed or queued, before the resources they use are closed.
+    """
+    # Webhook requests are rejected from now on, Telegram sends them again
+    readiness.ready = False
+    deadline = perf_counter() + timeout
+    pending = len(dp.in_flight) + len(update_worker_pool)
+
+    abandoned = 0
+    if poller is not None:
+        # Updates the poller is processing are in flight already
+        pending += len(poller)
+        abandoned += await poller.close(timeout)
+    if immediate_ack:
+        abandoned += await update_worker_pool.close(timeout)
+    abandoned += await dp.in_flight.wait(max(0.0, deadline - perf_counter()))
+    shutdown_abandoned.labels("updates").inc(abandoned)
+    if abandoned:
+        log.warning(
+            "Drained %d updates, abandoned %d", max(pending - abandoned, 0), abandoned
+        )
+    else:
+        log.info("Drained %d updates", pending)
+
+
+@inject
+async def poll_updates(
+    poller: UpdatePoller,
+    update_offsets: UpdateOffsets = Provide[Container.update_offsets],
+):
+    """Poll updates until SIGTERM or SIGINT, which leave the updates
+    being processed to ``drain``.
+    """
+    loop = asyncio.get_event_loop()
+    for signum in _STOP_SIGNALS:
+        loop.add_signal_handler(signum, poller.stop)
+    try:
+        await poller.run(update_offsets)
+    finally:
+        for signum in _STOP_SIGNALS:
+            loop.remove_signal_handler(signum)
+
+
 @inject
 def start_bot(
+    worker_index: Optional[int] = None,
     bot: Bot = Provide[Container.bot],
+    updates_mode: str = Provide[Container.config.TELEGRAM_UPDATES_MODE],
     webhook_path: str = Provide[Container.config.TELEGRAM_WEBHOOK_PATH],
+    immediate_ack: bool = Provide[Container.config.TELEGRAM_WEBHOOK_IMMEDIATE_ACK],
+    update_worker_pool: UpdateWorkerPool = Provide[Container.update_worker_pool],
+    readiness: Readiness = Provide[Container.readiness],
     host: str = Provide[Container.config.HOST],
     port: int = Provide[Container.config.PORT],
+    polling_timeout: int = Provide[Container.config.TELEGRAM_POLLING_TIMEOUT],
+    polling_concurrency: int = Provide[
+        Container.config.TELEGRAM_POLLING_CONCURRENCY
+    ],
 ):
+    """Run the bot until it's stopped.
+
+    ``worker_index`` is passed when running in one of several worker
+    processes. Workers share the port, only the first one runs
+    maintenance jobs and sets the webhook.
+
+    In webhook mode the port is bound once the process is warmed up
+    and the webhook is set, so no update waits for the warm-up. On
+    shutdown the port is closed first, then updates are drained and
+    only after that resources are closed. In polling mode SIGTERM
+    and SIGINT stop polling before updates are drained the same way.
+    """
     dp = create_dispatcher(bot)
-    executor.start_webhook(
-        dp,
-        on_startup=set_webhook,
-        webhook_path=webhook_path,
+    if updates_mode == "polling":
+        poller = UpdatePoller(
+            dp, timeout=polling_timeout, concurrency=polling_concurrency
+        )
+        executor.start(
+            dp,
+            poll_updates(poller),
+            on_startup=[
+                start_tracing,
+                warm_up,
+                start_pool_health_check,
+                start_outbox_relay,
+                start_maintenance,
+            ],
+            on_shutdown=[functools.partial(drain, poller=poller), shutdown_resources],
+        )
+        return
+
+    web_app = web.Application()
+    web_app[READINESS_KEY] = readiness
+    web_app.router.add_get(METRICS_PATH, handle_metrics)
+    web_app.router.add_get(HEALTHZ_PATH, handle_healthz)
+    web_app.router.add_get(READYZ_PATH, handle_readyz)
+    webhook_executor = executor.Executor(dp)
+    request_handler = LeanRequestHandler
+    if immediate_ack:
+        # Updates are acknowledged at once and processed by the workers
+        web_app[UPDATE_WORKER_POOL_KEY] = update_worker_pool
+        request_handler = ImmediateAckRequestHandler
+        webhook_executor.on_startup(start_update_workers)
+
+    webhook_executor.on_startup(
+        [start_tracing, warm_up, start_pool_health_check, start_outbox_relay]
+    )
+    if not worker_index:
+        webhook_executor.on_startup([start_maintenance, set_webhook])
+    webhook_executor.on_startup(mark_ready)
+    webhook_executor.on_shutdown([drain, shutdown_resources])
+    webhook_executor.set_webhook(
+        webhook_path, request_handler=request_handler, web_app=web_app
+    )
+    webhook_executor.run_app(
         host=host,
         port=port,
         access_log=logging.getLogger('access_log'),
+        reuse_port=worker_index is not None,
     )
\ No newline at end of file
@@ -1,3 +1,8 @@
+"""Settings of the bot, read from settings files and the environment.
+
+Settings are loaded lazily, ``validate_settings`` loads and validates them
+on startup, so importing modules of the bot doesn't read anything.
+"""
 from dynaconf import Dynaconf, LazySettings, Validator
 
 
@@ -22,30 +27,178 @@ def _normalize_webhook_path(settings: LazySettings, validator: Validator):
     settings.TELEGRAM_WEBHOOK_PATH = webhook_path
 
 
+_WEBHOOK_MODE = Validator("TELEGRAM_UPDATES_MODE", eq="webhook")
+_POSTGRES_BACKEND = Validator("DATABASE_BACKEND", eq="postgres")
+
 settings = Dynaconf(
+    # Looked up relative to the working directory, or ROOT_PATH_FOR_DYNACONF
     settings_files=["settings.toml", ".secrets.toml"],
     envvar_prefix=False,
     validators=[
         Validator("TELEGRAM_BOT_TOKEN", must_exist=True, is_type_of=str, len_min=1),
+        Validator("TELEGRAM_API_SERVER", must_exist=True, is_type_of=str, len_min=1),
+        Validator(
+            "TELEGRAM_UPDATES_MODE", must_exist=True, is_in=("webhook", "polling")
+        ),
         Validator(
             "TELEGRAM_WEBHOOK_PATH",
             must_exist=True,
             is_type_of=str,
             len_min=1,
-            default=_normalize_webhook_path
+            default=_normalize_webhook_path,
+            when=_WEBHOOK_MODE,
+        ),
+        Validator(
+            "TELEGRAM_WEBHOOK_HOST",
+            must_exist=True,
+            is_type_of=str,
+            len_min=1,
+            when=_WEBHOOK_MODE,
+        ),
+        Validator(
+            "TELEGRAM_WEBHOOK_IMMEDIATE_ACK", must_exist=True, is_type_of=bool
+        ),
+        Validator("TELEGRAM_WEBHOOK_SHARDS", must_exist=True, is_type_of=int, gt=0),
+        Validator(
+            "TELEGRAM_WEBHOOK_QUEUE_SIZE", must_exist=True, is_type_of=int, gt=0
+        ),
+        Validator(
+            "TELEGRAM_POLLING_TIMEOUT", must_exist=True, is_type_of=int, gte=0
+        ),
+        Validator(
+            "TELEGRAM_POLLING_CONCURRENCY", must_exist=True, is_type_of=int, gt=0
         ),
-        Validator("TELEGRAM_WEBHOOK_HOST", must_exist=True, is_type_of=str, len_min=1),
         Validator("HOST", must_exist=True, is_type_of=str, len_min=1),
         Validator("PORT", must_exist=True, is_type_of=int, gt=1024, lt=65535),
+        Validator("WORKERS", must_exist=True, is_type_of=int, gte=1),
+        Validator(
+            "SHUTDOWN_DRAIN_TIMEOUT", must_exist=True, is_type_of=(int, float), gte=0
+        ),
         Validator("ADMIN_TOKEN", must_exist=True, is_type_of=str, len_min=8),
+        Validator(
+            "TELEGRAM_GLOBAL_RATE_LIMIT", must_exist=True, is_type_of=(int, float), gt=0
+        ),
+        Validator(
+            "TELEGRAM_PRIVATE_CHAT_RATE_LIMIT",
+            must_exist=True,
+            is_type_of=(int, float),
+            gt=0,
+        ),
+        Validator(
+            "TELEGRAM_GROUP_CHAT_RATE_LIMIT",
+            must_exist=True,
+            is_type_of=(int, float),
+            gt=0,
+        ),
+        Validator("DATABASE_BACKEND", must_exist=True, is_in=("postgres", "sqlite")),
         Validator(
             "DATABASE_URL",
             must_exist=True,
             is_type_of=str,
             len_min=1,
             default=_normalize_database_url,
+            when=_POSTGRES_BACKEND,
+        ),
+        Validator("DATABASE_SQLITE_PATH", must_exist=True, is_type_of=str, len_min=1),
+        Validator("DATABASE_POOL_MIN_SIZE", must_exist=True, is_type_of=int, gte=0),
+        Validator("DATABASE_POOL_MAX_SIZE", must_exist=True, is_type_of=int, gte=1),
+        Validator(
+            "DATABASE_POOL_ACQUIRE_TIMEOUT",
+            must_exist=True,
+            is_type_of=(int, float),
+            gte=0,
+        ),
+        Validator(
+            "DATABASE_POOL_MAX_INACTIVE_CONNECTION_LIFETIME",
+            must_exist=True,
+            is_type_of=(int, float),
+            gte=0,
+        ),
+        Validator(
+            "DATABASE_POOL_HEALTH_CHECK_INTERVAL",
+            must_exist=True,
+            is_type_of=(int, float),
+            gte=0,
+        ),
+        Validator(
+            "DATABASE_POOL_HEALTH_CHECK_TIMEOUT",
+            must_exist=True,
+            is_type_of=(int, float),
+            gt=0,
+        ),
+        Validator("DATABASE_PREPARE_STATEMENTS", must_exist=True, is_type_of=bool),
+        Validator(
+            "DATABASE_SLOW_QUERY_THRESHOLD",
+            must_exist=True,
+            is_type_of=(int, float),
+            gte=0,
+        ),
+        Validator("DATABASE_SLOW_QUERY_EXPLAIN", must_exist=True, is_type_of=bool),
+        Validator(
+            "TRACING_SAMPLE_RATE",
+            must_exist=True,
+            is_type_of=(int, float),
+            gte=0,
+            lte=1,
+        ),
+        Validator("TRACING_EXPORTER", must_exist=True, is_in=("file", "otlp")),
+        Validator("TRACING_FILE_PATH", must_exist=True, is_type_of=str, len_min=1),
+        Validator(
+            "TRACING_OTLP_ENDPOINT", must_exist=True, is_type_of=str, len_min=1
+        ),
+        Validator(
+            "TRACING_EXPORT_INTERVAL", must_exist=True, is_type_of=(int, float), gt=0
+        ),
+        Validator("CACHE_INVALIDATION_ENABLED", must_exist=True, is_type_of=bool),
+        Validator("FORWARDED_MESSAGE_WRITE_BEHIND", must_exist=True, is_type_of=bool),
+        Validator("FORWARDED_MESSAGE_BATCH_SIZE", must_exist=True, is_type_of=int, gt=0),
+        Validator("FORWARDED_MESSAGE_BUFFER_SIZE", must_exist=True, is_type_of=int, gt=0),
+        Validator(
+            "FORWARDED_MESSAGE_FLUSH_INTERVAL",
+            must_exist=True,
+            is_type_of=(int, float),
+            gt=0,
+        ),
+        Validator(
+            "FORWARDED_MESSAGE_PARTITIONS_AHEAD", must_exist=True, is_type_of=int, gte=1
+        ),
+        Validator(
+            "FORWARDED_MESSAGE_REPLY_WINDOW_DAYS", must_exist=True, is_type_of=int, gt=0
+        ),
+        Validator(
+            "FORWARDED_MESSAGE_RETENTION_DAYS", must_exist=True, is_type_of=int, gte=0
+        ),
+        Validator(
+            "FORWARDED_MESSAGE_RETENTION_INTERVAL",
+            must_exist=True,
+            is_type_of=(int, float),
+            gt=0,
+        ),
+        Validator(
+            "FORWARDED_MESSAGE_RETENTION_BATCH_SIZE", must_exist=True, is_type_of=int, gt=0
+        ),
+        Validator(
+            "FORWARDED_MESSAGE_RETENTION_BATCH_PAUSE",
+            must_exist=True,
+            is_type_of=(int, float),
+            gte=0,
+        ),
+        Validator(
+            "FORWARDED_MESSAGE_RETENTION_DRY_RUN", must_exist=True, is_type_of=bool
+        ),
+        Validator("OUTBOX_LEASE", must_exist=True, is_type_of=(int, float), gt=0),
+        Validator(
+            "OUTBOX_RETRY_INTERVAL", must_exist=True, is_type_of=(int, float), gt=0
+        ),
+        Validator("OUTBOX_MAX_ATTEMPTS", must_exist=True, is_type_of=int, gt=0),
+        Validator(
+            "OUTBOX_POLL_INTERVAL", must_exist=True, is_type_of=(int, float), gt=0
         ),
     ],
 )
 
-settings.validators.validate()
+
+def validate_settings() -> LazySettings:
+    """Load settings and validate them, normalizing some of the values."""
+    settings.validators.validate()
+    return settings
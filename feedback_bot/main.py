@@ -1,13 +1,41 @@
+import asyncio
+import sys
+from logging import getLogger
+
 from feedback_bot import bot, bootstrap
+from feedback_bot.config import validate_settings
 from feedback_bot.service_layer import services
+from feedback_bot.supervisor import Supervisor
+
+log = getLogger(__name__)
 
 
 def inject_dependencies() -> bootstrap.Container:
     container = bootstrap.Container()
+    container.config.from_dict(validate_settings().as_dict())
     container.wire(modules=[bot, services])
     return container
 
 
+def _run_worker(worker_index: int):
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    bot.start_bot(worker_index)
+
+
 def main():
-    inject_dependencies()
-    bot.start_bot()
\ No newline at end of file
+    container = inject_dependencies()
+    workers = container.config.WORKERS()
+    if workers > 1 and container.config.TELEGRAM_UPDATES_MODE() == "polling":
+        log.warning("Polling mode doesn't support multiple workers, using one")
+        workers = 1
+    if workers > 1 and container.config.DATABASE_BACKEND() == "sqlite":
+        log.warning("SQLite backend doesn't support multiple workers, using one")
+        workers = 1
+
+    if workers == 1:
+        # Pool sizes and cache invalidation depend on the number of workers
+        container.config.WORKERS.override(1)
+        bot.start_bot()
+        return
+
+    sys.exit(Supervisor(workers, target=_run_worker).run())
@@ -0,0 +1,280 @@
+"""In-process metrics.
+
+Metrics are created once at import time and updated in place,
+so recording a value doesn't allocate. Labeled metrics create a child
+metric per combination of label values on first use, hot paths should
+look children up once and keep them, e.g. with ``timed``.
+
+The event loop runs one coroutine at a time, so metrics need no locks.
+"""
+import functools
+from bisect import bisect_left
+from time import perf_counter
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Generic,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+)
+
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+
+class Counter:
+    __slots__ = ("name", "documentation", "value")
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.value = 0
+
+    def inc(self, amount: Union[int, float] = 1):
+        self.value += amount
+
+
+class Gauge:
+    __slots__ = ("name", "documentation", "_value", "_function")
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._value = 0
+        self._function: Optional[Callable[[], Union[int, float]]] = None
+
+    @property
+    def value(self) -> Union[int, float]:
+        if self._function is not None:
+            return self._function()
+        return self._value
+
+    def set(self, value: Union[int, float]):
+        self._value = value
+
+    def set_function(self, function: Optional[Callable[[], Union[int, float]]]):
+        """Read the value from ``function`` whenever it is collected,
+        for values owned by another object.
+        """
+        self._function = function
+
+    def inc(self, amount: Union[int, float] = 1):
+        self._value += amount
+
+    def dec(self, amount: Union[int, float] = 1):
+        self._value -= amount
+
+
+class Histogram:
+    __slots__ = ("name", "documentation", "buckets", "bucket_counts", "sum", "count")
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        # The last counter is for observations above the largest bucket
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.bucket_counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+Metric = Union[Counter, Gauge, Histogram]
+M = TypeVar("M", Counter, Gauge, Histogram)
+
+
+class Family(Generic[M]):
+    """Metrics of the same name told apart by the values of ``labelnames``."""
+
+    __slots__ = (
+        "metric_class", "name", "documentation", "labelnames", "_kwargs", "_children"
+    )
+
+    def __init__(
+        self,
+        metric_class: Type[M],
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str],
+        **kwargs,
+    ):
+        self.metric_class = metric_class
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._kwargs = kwargs
+        self._children: Dict[Tuple[str, ...], M] = {}
+
+    def labels(self, *values: str) -> M:
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(
+                    f"Metric {self.name} has labels {self.labelnames}, "
+                    f"got values {values}"
+                )
+            child = self._children[values] = self.metric_class(
+                self.name, self.documentation, **self._kwargs
+            )
+
+        return child
+
+    def children(self) -> List[Tuple[Tuple[str, ...], M]]:
+        return list(self._children.items())
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Union[Metric, Family]] = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+
+        self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name: str) -> Union[Metric, Family]:
+        return self._metrics[name]
+
+    def collect(self) -> List[Union[Metric, Family]]:
+        return list(self._metrics.values())
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_TYPES = {Counter: "counter", Gauge: "gauge", Histogram: "histogram"}
+
+
+def _format_value(value: Union[int, float]) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(value)
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape_label_value(value)}"' for name, value in labels
+    )
+    return f"{{{pairs}}}"
+
+
+def _samples(
+    name: str, metric: Metric, labels: Tuple[Tuple[str, str], ...]
+) -> Iterator[str]:
+    if not isinstance(metric, Histogram):
+        yield f"{name}{_format_labels(labels)} {_format_value(metric.value)}"
+        return
+
+    cumulative = 0
+    bounds = metric.buckets + (float("inf"),)
+    for bound, count in zip(bounds, metric.bucket_counts):
+        cumulative += count
+        bucket_labels = labels + (("le", _format_value(float(bound))),)
+        yield f"{name}_bucket{_format_labels(bucket_labels)} {cumulative}"
+    yield f"{name}_sum{_format_labels(labels)} {_format_value(metric.sum)}"
+    yield f"{name}_count{_format_labels(labels)} {metric.count}"
+
+
+def render(registry: Registry = REGISTRY) -> str:
+    """Render metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in registry.collect():
+        if isinstance(metric, Family):
+            children = [
+                (tuple(zip(metric.labelnames, values)), child)
+                for values, child in metric.children()
+            ]
+            metric_type = _TYPES[metric.metric_class]
+        else:
+            children = [((), metric)]
+            metric_type = _TYPES[type(metric)]
+
+        documentation = (
+            metric.documentation.replace("\\", "\\\\").replace("\n", "\\n")
+        )
+        lines.append(f"# HELP {metric.name} {documentation}")
+        lines.append(f"# TYPE {metric.name} {metric_type}")
+        for labels, child in children:
+            lines.extend(_samples(metric.name, child, labels))
+
+    lines.append("")
+    return "\n".join(lines)
+
+
+def timed(histogram: Histogram):
+    """Observe the duration of every call of the decorated coroutine function,
+    including failed ones.
+    """
+
+    def decorator(func: Callable[..., Awaitable[Any]]):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started_at = perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(perf_counter() - started_at)
+
+        return wrapper
+
+    return decorator
+
+
+def counter(name: str, documentation: str) -> Counter:
+    return REGISTRY.register(Counter(name, documentation))
+
+
+def gauge(name: str, documentation: str) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation))
+
+
+def histogram(
+    name: str,
+    documentation: str,
+    buckets: Sequence[float] = DEFAULT_BUCKETS,
+) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, buckets))
+
+
+def labeled_counter(
+    name: str, documentation: str, labelnames: Sequence[str]
+) -> "Family[Counter]":
+    return REGISTRY.register(Family(Counter, name, documentation, labelnames))
+
+
+def labeled_histogram(
+    name: str,
+    documentation: str,
+    labelnames: Sequence[str],
+    buckets: Sequence[float] = DEFAULT_BUCKETS,
+) -> "Family[Histogram]":
+    return REGISTRY.register(
+        Family(Histogram, name, documentation, labelnames, buckets=buckets)
+    )
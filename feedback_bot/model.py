@@ -1,6 +1,6 @@
-from dataclasses import dataclass, field
+from dataclasses import FrozenInstanceError, dataclass, field, fields
 from datetime import datetime, timezone
-from typing import Optional, Type, TypeVar
+from typing import Any, List, Optional, Type, TypeVar
 
 T = TypeVar('T')
 
@@ -10,12 +10,54 @@ def _utc_now():
     return datetime.now(timezone.utc)
 
 
+def _getstate(self) -> List[Any]:
+    return [getattr(self, name) for name in self.__slots__]
+
+
+def _setstate(self, state: List[Any]):
+    # Frozen dataclasses forbid setattr
+    for name, value in zip(self.__slots__, state):
+        object.__setattr__(self, name, value)
+
+
+def _frozen_setattr(self, name: str, value: Any):
+    raise FrozenInstanceError(f"cannot assign to field {name!r}")
+
+
+def _frozen_delattr(self, name: str):
+    raise FrozenInstanceError(f"cannot delete field {name!r}")
+
+
+def _slotted(cls: Type[T]) -> Type[T]:
+    """Recreate a dataclass with ``__slots__`` for its fields,
+    like ``dataclass(slots=True)`` of Python 3.10, for frozen dataclasses.
+
+    Instances have no ``__dict__``, so caches and batches holding lots
+    of them take less memory.
+    """
+    names = tuple(f.name for f in fields(cls))
+    namespace = {
+        key: value
+        for key, value in cls.__dict__.items()
+        if key not in names and key not in ("__dict__", "__weakref__")
+    }
+    namespace["__slots__"] = names
+    namespace["__getstate__"] = _getstate
+    namespace["__setstate__"] = _setstate
+    # Generated ones refer to the original class
+    namespace["__setattr__"] = _frozen_setattr
+    namespace["__delattr__"] = _frozen_delattr
+    return type(cls)(cls.__name__, cls.__bases__, namespace)
+
+
+@_slotted
 @dataclass(frozen=True, eq=True)
 class TargetChat:
     chat_id: int
     created_at: datetime = field(default_factory=_utc_now)
 
 
+@_slotted
 @dataclass(frozen=True, eq=True)
 class Admin:
     user_id: int
@@ -36,6 +78,7 @@ class Admin:
         return cls(user_id=user_id, target_chat=target_chat)
 
 
+@_slotted
 @dataclass(frozen=True, eq=True)
 class ForwardedMessage:
     forwarded_message_id: int
@@ -0,0 +1,197 @@
+import asyncio
+from logging import getLogger
+from time import perf_counter
+from typing import Dict, Hashable, List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.bot import api
+from aiogram.utils.payload import generate_payload, prepare_arg
+
+from feedback_bot import metrics, routing
+from feedback_bot.adapters.repositories.update_offset import UpdateOffsets
+from feedback_bot.updates import AnyUpdate, ordering_key
+
+log = getLogger(__name__)
+
+# Maximum number of updates Telegram returns per getUpdates call
+MAX_UPDATES_LIMIT = 100
+ALLOWED_UPDATES = list(routing.ROUTED_UPDATE_TYPES)
+
+updates_received = metrics.counter(
+    "polling_updates_received_total",
+    "Updates received with getUpdates",
+)
+batch_duration = metrics.histogram(
+    "polling_batch_duration_seconds",
+    "Time spent processing a batch of updates received with getUpdates",
+)
+
+
+class UpdatePoller:
+    """Receives updates with getUpdates long polling and processes them
+    with the dispatcher handlers.
+
+    Updates are fetched in batches of up to ``limit``. Updates of different
+    chats are processed concurrently, at most ``concurrency`` at a time,
+    updates of the same chat are processed in order. The offset is saved
+    after each batch, so after a restart polling continues where it stopped.
+
+    ``stop`` makes ``run`` return without waiting for the batch being
+    processed, ``close`` waits for it on shutdown.
+
+    Updates are requested raw and decoded with ``routing.decode_update``.
+    """
+
+    _update_offsets: UpdateOffsets
+
+    def __init__(
+        self,
+        dp: Dispatcher,
+        limit: int = MAX_UPDATES_LIMIT,
+        timeout: int = 30,
+        concurrency: int = 10,
+        retry_interval: float = 5.0,
+    ):
+        self._dp = dp
+        self._limit = limit
+        self._timeout = timeout
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._retry_interval = retry_interval
+        self._stopping = asyncio.Event()
+        self._batch: Optional[asyncio.Task] = None
+        # Updates of the current batch waiting for their turn or being processed
+        self._waiting = 0
+        self._processing = 0
+
+    def __len__(self) -> int:
+        """Number of received updates waiting to be processed."""
+        return self._waiting
+
+    @property
+    def _bot(self) -> Bot:
+        return self._dp.bot
+
+    def stop(self):
+        self._stopping.set()
+
+    async def close(self, timeout: float) -> int:
+        """Stop polling and wait at most ``timeout`` seconds for the batch
+        being processed, return the number of updates left unprocessed.
+        """
+        self.stop()
+        if self._batch is None or self._batch.done():
+            return 0
+
+        await asyncio.wait({self._batch}, timeout=timeout)
+        if self._batch.done():
+            return 0
+
+        abandoned = self._waiting + self._processing
+        self._batch.cancel()
+        await asyncio.wait({self._batch})
+        return abandoned
+
+    async def run(self, update_offsets: UpdateOffsets):
+        """Poll updates until stopped."""
+        self._update_offsets = update_offsets
+        Bot.set_current(self._bot)
+        Dispatcher.set_current(self._dp)
+
+        # getUpdates doesn't work while a webhook is set
+        await self._bot.delete_webhook()
+
+        offset = await self._load_offset()
+        log.info("Polling updates starting from offset %s", offset)
+        while not self._stopping.is_set():
+            get_updates = asyncio.ensure_future(self._get_updates(offset))
+            if not await self._unless_stopped(get_updates):
+                get_updates.cancel()
+                break
+
+            raw_updates = get_updates.result()
+            if not raw_updates:
+                continue
+
+            updates_received.inc(len(raw_updates))
+            self._batch = asyncio.ensure_future(self._process_batch(raw_updates))
+            # Once stopped, the batch is left to finish on ``close``
+            await self._unless_stopped(self._batch)
+            offset = raw_updates[-1]["update_id"] + 1
+
+        log.info("Stopped polling updates")
+
+    async def _unless_stopped(self, task: asyncio.Future) -> bool:
+        """Wait for ``task`` unless stopped earlier, return whether it's done."""
+        stopping = asyncio.ensure_future(self._stopping.wait())
+        try:
+            await asyncio.wait({task, stopping}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            stopping.cancel()
+        return task.done()
+
+    async def _get_updates(self, offset: Optional[int]) -> List[dict]:
+        try:
+            return await self._bot.request(
+                api.Methods.GET_UPDATES,
+                generate_payload(
+                    offset=offset,
+                    limit=self._limit,
+                    timeout=self._timeout,
+                    allowed_updates=prepare_arg(ALLOWED_UPDATES),
+                ),
+            )
+        except Exception:
+            log.exception("Failed to get updates")
+            await asyncio.sleep(self._retry_interval)
+            return []
+
+    async def _process_batch(self, raw_updates: List[dict]):
+        started_at = perf_counter()
+        await self.process_updates([
+            update
+            for update in map(routing.decode_update, raw_updates)
+            if update is not None
+        ])
+        batch_duration.observe(perf_counter() - started_at)
+
+        offset = raw_updates[-1]["update_id"] + 1
+        try:
+            await self._save_offset(offset)
+        except Exception:
+            log.exception("Failed to save update offset %d", offset)
+
+    async def process_updates(self, updates: List[AnyUpdate]):
+        chat_updates: Dict[Hashable, List[AnyUpdate]] = {}
+        for update in updates:
+            chat_updates.setdefault(ordering_key(update), []).append(update)
+
+        self._waiting += len(updates)
+        await asyncio.gather(
+            *(self._process_chat_updates(updates) for updates in chat_updates.values())
+        )
+
+    async def _process_chat_updates(self, updates: List[AnyUpdate]):
+        waiting = len(updates)
+        try:
+            async with self._semaphore:
+                for update in updates:
+                    waiting -= 1
+                    self._waiting -= 1
+                    self._processing += 1
+                    try:
+                        await self._dp.process_update(update)
+                    except Exception:
+                        log.exception("Failed to process update %d", update.update_id)
+                    finally:
+                        self._processing -= 1
+        finally:
+            # Updates left behind when cancelled
+            self._waiting -= waiting
+
+    async def _load_offset(self) -> Optional[int]:
+        async with self._update_offsets() as update_offsets:
+            return await update_offsets.get(self._bot.id)
+
+    async def _save_offset(self, offset: int):
+        async with self._update_offsets() as update_offsets:
+            await update_offsets.save(self._bot.id, offset)
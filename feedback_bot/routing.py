@@ -0,0 +1,208 @@
+"""Lean decoding and routing of raw updates.
+
+Handlers only need a few fields of an update, so instead of building
+the whole aiogram object graph of a message with its entities, photos
+and users, ``decode_update`` reads these fields from the raw JSON into
+compact records. The records have the same attributes and methods
+as the aiogram types the handlers use, so handlers accept either.
+
+Update types no handler is registered for, like edited messages
+and channel posts, are dropped before anything is built. Updates
+the lean records can't represent are decoded into ``aiogram.types.Update``
+and processed by the dispatcher handlers as before.
+"""
+from logging import getLogger
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Optional, Union
+
+from aiogram import types
+
+from feedback_bot import metrics
+
+log = getLogger(__name__)
+
+RawUpdate = Dict[str, Any]
+
+# Update types with handlers, the rest are dropped
+ROUTED_UPDATE_TYPES = ("message", "my_chat_member")
+
+updates_dropped = metrics.labeled_counter(
+    "updates_dropped_total",
+    "Updates dropped without processing as no handler is registered for them",
+    labelnames=("type",),
+)
+updates_decoded = metrics.labeled_counter(
+    "updates_decoded_total",
+    "Decoded updates by decoding, either lean or full",
+    labelnames=("decoding",),
+)
+
+
+class Chat(NamedTuple):
+    id: int
+    type: str
+    title: Optional[str] = None
+
+
+class User(NamedTuple):
+    id: int
+
+
+class ReplyToMessage(NamedTuple):
+    message_id: int
+
+
+class Message(NamedTuple):
+    message_id: int
+    chat: Chat
+    from_user: Optional[User] = None
+    reply_to_message: Optional[ReplyToMessage] = None
+    text: Optional[str] = None
+    caption: Optional[str] = None
+
+    def is_command(self) -> bool:
+        text = self.text or self.caption
+        return bool(text) and text.startswith("/")
+
+    def get_command(self) -> Optional[str]:
+        if self.is_command():
+            return (self.text or self.caption).split(maxsplit=1)[0]
+        return None
+
+    def get_args(self) -> Optional[str]:
+        if self.is_command():
+            _, *args = (self.text or self.caption).split(maxsplit=1)
+            return args[0] if args else ""
+        return None
+
+
+class ChatMember(NamedTuple):
+    status: str
+
+
+class ChatMemberUpdated(NamedTuple):
+    chat: Chat
+    from_user: User
+    new_chat_member: ChatMember
+
+
+class Update(NamedTuple):
+    update_id: int
+    message: Optional[Message] = None
+    my_chat_member: Optional[ChatMemberUpdated] = None
+
+    @property
+    def type(self) -> str:
+        return "message" if self.message is not None else "my_chat_member"
+
+
+AnyMessage = Union[types.Message, Message]
+AnyChatMemberUpdated = Union[types.ChatMemberUpdated, ChatMemberUpdated]
+
+
+def _decode_chat(data: RawUpdate) -> Chat:
+    return Chat(data["id"], data["type"], data.get("title"))
+
+
+def _decode_message(data: RawUpdate) -> Message:
+    from_user = data.get("from")
+    reply_to_message = data.get("reply_to_message")
+    return Message(
+        data["message_id"],
+        _decode_chat(data["chat"]),
+        User(from_user["id"]) if from_user is not None else None,
+        (
+            ReplyToMessage(reply_to_message["message_id"])
+            if reply_to_message is not None
+            else None
+        ),
+        data.get("text"),
+        data.get("caption"),
+    )
+
+
+def _decode_chat_member_updated(data: RawUpdate) -> ChatMemberUpdated:
+    return ChatMemberUpdated(
+        _decode_chat(data["chat"]),
+        User(data["from"]["id"]),
+        ChatMember(data["new_chat_member"]["status"]),
+    )
+
+
+def _mentions_bot(message: Message) -> bool:
+    # Checking whom a command mentions takes the username of the bot,
+    # which only the dispatcher filters know
+    command = message.get_command()
+    return command is not None and "@" in command
+
+
+def decode_update(data: RawUpdate) -> Union[Update, types.Update, None]:
+    """Decode a raw update into lean records where possible.
+
+    Return None for update types no handler is registered for
+    and ``aiogram.types.Update`` for updates that need the dispatcher.
+    """
+    try:
+        if "message" in data:
+            update = Update(data["update_id"], message=_decode_message(data["message"]))
+            if not _mentions_bot(update.message):
+                updates_decoded.labels("lean").inc()
+                return update
+        elif "my_chat_member" in data:
+            update = Update(
+                data["update_id"],
+                my_chat_member=_decode_chat_member_updated(data["my_chat_member"]),
+            )
+            updates_decoded.labels("lean").inc()
+            return update
+        else:
+            update_type = next((key for key in data if key != "update_id"), "unknown")
+            updates_dropped.labels(update_type).inc()
+            return None
+    except (KeyError, TypeError):
+        log.debug("Falling back to full decoding of update %r", data.get("update_id"))
+
+    updates_decoded.labels("full").inc()
+    return types.Update(**data)
+
+
+MessageHandler = Callable[[AnyMessage], Awaitable[Any]]
+ChatMemberUpdatedHandler = Callable[[AnyChatMemberUpdated], Awaitable[Any]]
+
+
+class UpdateRouter:
+    """Calls handlers for lean updates.
+
+    Routes mirror the handlers registered in ``bot.create_dispatcher``
+    and their filters, checked in the same order, so an update reaches
+    the same handler whichever way it's decoded.
+    """
+
+    def __init__(
+        self,
+        my_chat_member: ChatMemberUpdatedHandler,
+        auth_command: MessageHandler,
+        reply: MessageHandler,
+        private_message: MessageHandler,
+    ):
+        self._my_chat_member = my_chat_member
+        self._auth_command = auth_command
+        self._reply = reply
+        self._private_message = private_message
+
+    async def route(self, update: Update):
+        if update.my_chat_member is not None:
+            return await self._my_chat_member(update.my_chat_member)
+
+        message = update.message
+        private = message.chat.type == types.ChatType.PRIVATE
+        # Commands are only recognized in texts, like the dispatcher's
+        # Command filter does by default
+        if private and message.text and message.text.startswith("/"):
+            command = message.text.split(maxsplit=1)[0][1:]
+            if command.lower() == "auth":
+                return await self._auth_command(message)
+        if message.reply_to_message is not None:
+            return await self._reply(message)
+        if private:
+            return await self._private_message(message)
+        return None
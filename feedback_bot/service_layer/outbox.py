@@ -0,0 +1,331 @@
+"""Telegram requests recorded by a unit of work.
+
+Services don't call the Telegram API while holding a transaction.
+They record the requests in the outbox of the unit of work instead,
+which saves them to the outbox table in the same transaction as the rest
+of its changes. Rolled back units of work send nothing.
+
+Once the unit of work has committed and released its connection,
+the OutboxDispatcher sends its requests and removes them from the table.
+Requests failing to be sent are retried with exponential backoff, and
+requests left in the table by a process that crashed or was killed are
+sent by ``OutboxDispatcher.run`` once their lease expires. A request is
+sent at least once: if the process dies right after sending it, it's
+sent again.
+"""
+import asyncio
+import dataclasses
+import json
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from logging import getLogger
+from typing import (
+    AsyncContextManager,
+    Callable,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+from feedback_bot import metrics, tracing
+from feedback_bot.adapters.repositories.forwarded_message import (
+    AbstractForwardedMessageRepository,
+    ForwardedMessageWriteBuffer,
+)
+from feedback_bot.adapters.repositories.outbox import AbstractOutboxRepository
+from feedback_bot.adapters.telegram import AbstractTelegramAPI
+from feedback_bot.model import ForwardedMessage
+
+log = getLogger(__name__)
+
+commands_failed = metrics.counter(
+    "outbox_commands_failed_total",
+    "Attempts to send outbox commands that failed, the commands are retried",
+)
+commands_dropped = metrics.counter(
+    "outbox_commands_dropped_total",
+    "Outbox commands dropped after failing to be sent max attempts times",
+)
+results_unsaved = metrics.counter(
+    "outbox_results_unsaved_total",
+    "Sent outbox commands whose results couldn't be saved, they're sent again",
+)
+
+
+@dataclass(frozen=True)
+class SendMessage:
+    to_chat_id: int
+    text: str
+
+
+@dataclass(frozen=True)
+class ForwardMessage:
+    """Forward a message, the forwarded message is saved once it's sent,
+    so replies to it can be copied back to ``from_chat_id``.
+    """
+
+    from_chat_id: int
+    to_chat_id: int
+    message_id: int
+
+
+@dataclass(frozen=True)
+class CopyMessage:
+    from_chat_id: int
+    to_chat_id: int
+    message_id: int
+
+
+Command = Union[SendMessage, ForwardMessage, CopyMessage]
+
+_COMMAND_TYPES = {
+    command_type.__name__: command_type
+    for command_type in (SendMessage, ForwardMessage, CopyMessage)
+}
+
+
+def dump_command(command: Command) -> str:
+    return json.dumps({"type": type(command).__name__, **dataclasses.asdict(command)})
+
+
+def load_command(payload: str) -> Command:
+    fields = json.loads(payload)
+    return _COMMAND_TYPES[fields.pop("type")](**fields)
+
+
+class Outbox:
+    def __init__(self):
+        self._commands: List[Command] = []
+
+    def __len__(self) -> int:
+        return len(self._commands)
+
+    def add(self, command: Command):
+        self._commands.append(command)
+
+    def collect(self) -> List[Command]:
+        """Remove and return the recorded commands."""
+        commands, self._commands = self._commands, []
+        return commands
+
+
+@dataclass(frozen=True)
+class OutboxEntry:
+    """Command saved to the outbox table under ``id``."""
+
+    id: int
+    command: Command
+    attempts: int = 0
+
+
+class OutboxTransaction(NamedTuple):
+    outbox: AbstractOutboxRepository
+    forwarded_messages: AbstractForwardedMessageRepository
+
+
+# Opens a transaction committed once the context exits without errors
+OutboxTransactions = Callable[[], AsyncContextManager[OutboxTransaction]]
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class OutboxDispatcher:
+    """Sends commands saved to the outbox table.
+
+    Saved commands are leased to the process saving them for ``lease``
+    seconds, so ``run`` doesn't send them meanwhile. Commands are sent
+    concurrently, a failed command doesn't prevent the others from being
+    sent and is retried after ``retry_interval`` seconds, doubled with
+    every attempt, until it fails ``max_attempts`` times.
+
+    With ``forwarded_message_buffer``, forwarded messages are saved
+    by the buffer, which removes their commands from the outbox table
+    in the same transaction.
+    """
+
+    def __init__(
+        self,
+        telegram_api: AbstractTelegramAPI,
+        transactions: OutboxTransactions,
+        lease: float = 60.0,
+        retry_interval: float = 5.0,
+        max_attempts: int = 10,
+        poll_interval: float = 10.0,
+        batch_size: int = 100,
+        forwarded_message_buffer: Optional[ForwardedMessageWriteBuffer] = None,
+    ):
+        self._telegram_api = telegram_api
+        self._transactions = transactions
+        self._lease = timedelta(seconds=lease)
+        self._retry_interval = retry_interval
+        self._max_attempts = max_attempts
+        self._poll_interval = poll_interval
+        self._batch_size = batch_size
+        self._forwarded_message_buffer = forwarded_message_buffer
+
+    async def save(
+        self, repository: AbstractOutboxRepository, commands: Sequence[Command]
+    ) -> List[OutboxEntry]:
+        """Save ``commands`` in the transaction of ``repository``,
+        to be dispatched once it commits.
+        """
+        leased_until = _now() + self._lease
+        return [
+            OutboxEntry(
+                id=await repository.add(dump_command(command), leased_until),
+                command=command,
+            )
+            for command in commands
+        ]
+
+    @tracing.traced("outbox.dispatch")
+    async def dispatch(self, entries: Sequence[OutboxEntry]):
+        """Send committed commands, doesn't raise."""
+        if not entries:
+            return
+
+        results = await asyncio.gather(
+            *(self._handle(entry.command) for entry in entries),
+            return_exceptions=True,
+        )
+        sent: List[Tuple[OutboxEntry, Optional[int]]] = []
+        failed: List[OutboxEntry] = []
+        for entry, result in zip(entries, results):
+            if isinstance(result, Exception):
+                log.error("Failed to send %r", entry.command, exc_info=result)
+                commands_failed.inc()
+                failed.append(entry)
+            else:
+                sent.append((entry, result))
+
+        try:
+            await self._save_results(sent, failed)
+        except Exception:
+            # The commands are still in the table, so they're sent
+            # again once their lease expires
+            log.exception("Failed to save results of %d commands", len(entries))
+            results_unsaved.inc(len(sent))
+
+    async def _handle(self, command: Command) -> Optional[int]:
+        if isinstance(command, SendMessage):
+            await self._telegram_api.send_message(
+                to_chat_id=command.to_chat_id, text=command.text
+            )
+        elif isinstance(command, ForwardMessage):
+            return await self._telegram_api.forward_message(
+                from_chat_id=command.from_chat_id,
+                to_chat_id=command.to_chat_id,
+                message_id=command.message_id,
+            )
+        elif isinstance(command, CopyMessage):
+            await self._telegram_api.copy_message(
+                from_chat_id=command.from_chat_id,
+                to_chat_id=command.to_chat_id,
+                message_id=command.message_id,
+            )
+        else:
+            raise TypeError(f"Unknown outbox command {command!r}")
+        return None
+
+    async def _save_results(
+        self,
+        sent: List[Tuple[OutboxEntry, Optional[int]]],
+        failed: List[OutboxEntry],
+    ):
+        removed = []
+        forwarded_messages = []
+        forwarded_message_entry_ids = []
+        for entry, forwarded_message_id in sent:
+            if isinstance(entry.command, ForwardMessage):
+                forwarded_messages.append(
+                    ForwardedMessage(
+                        forwarded_message_id=forwarded_message_id,
+                        target_chat_id=entry.command.to_chat_id,
+                        origin_chat_id=entry.command.from_chat_id,
+                    )
+                )
+                forwarded_message_entry_ids.append(entry.id)
+            else:
+                removed.append(entry.id)
+
+        if forwarded_messages and self._forwarded_message_buffer is not None:
+            await self._forwarded_message_buffer.put(
+                forwarded_messages, outbox_ids=forwarded_message_entry_ids
+            )
+            forwarded_messages = []
+        else:
+            removed.extend(forwarded_message_entry_ids)
+
+        if not removed and not failed:
+            return
+
+        now = _now()
+        async with self._transactions() as transaction:
+            if forwarded_messages:
+                await transaction.forwarded_messages.add_many(forwarded_messages)
+            for entry in failed:
+                if entry.attempts + 1 >= self._max_attempts:
+                    log.error(
+                        "Dropping %r after %d failed attempts",
+                        entry.command,
+                        self._max_attempts,
+                    )
+                    commands_dropped.inc()
+                    removed.append(entry.id)
+                    continue
+
+                delay = self._retry_interval * 2 ** entry.attempts
+                await transaction.outbox.retry_later(
+                    entry.id, now + timedelta(seconds=delay)
+                )
+            await transaction.outbox.remove(removed)
+
+    async def relay(self) -> int:
+        """Send commands available in the outbox table, that is failed
+        commands due to be retried and commands whose lease has expired.
+        Return the number of claimed commands.
+        """
+        now = _now()
+        async with self._transactions() as transaction:
+            records = await transaction.outbox.claim(
+                now=now, leased_until=now + self._lease, limit=self._batch_size
+            )
+
+        entries = []
+        undecodable = []
+        for record in records:
+            try:
+                command = load_command(record.payload)
+            except (ValueError, KeyError, TypeError):
+                log.exception("Dropping undecodable outbox record %d", record.id)
+                undecodable.append(record.id)
+                continue
+            entries.append(OutboxEntry(record.id, command, record.attempts))
+
+        if undecodable:
+            commands_dropped.inc(len(undecodable))
+            async with self._transactions() as transaction:
+                await transaction.outbox.remove(undecodable)
+        if entries:
+            log.info("Relaying %d outbox commands", len(entries))
+            await self.dispatch(entries)
+        return len(records)
+
+    async def run(self):
+        """Relay available commands every ``poll_interval`` seconds,
+        starting with those left over by previous processes.
+        """
+        while True:
+            try:
+                # A full batch means more commands may be waiting
+                while await self.relay() == self._batch_size:
+                    pass
+            except Exception:
+                log.exception("Failed to relay outbox commands")
+
+            await asyncio.sleep(self._poll_interval)
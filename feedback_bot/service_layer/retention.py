@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+from logging import getLogger
+from time import perf_counter
+from typing import TYPE_CHECKING, Optional
+
+from feedback_bot import metrics
+from feedback_bot.adapters.connection import LazyConnection
+from feedback_bot.adapters.partitions import ForwardedMessagePartitionManager
+from feedback_bot.adapters.query_log import SlowQueryLog
+from feedback_bot.adapters.repositories.forwarded_message import (
+    PostgresForwardedMessageRepository,
+)
+
+if TYPE_CHECKING:
+    import asyncpg
+
+log = getLogger(__name__)
+
+rows_deleted = metrics.counter(
+    "forwarded_message_retention_rows_deleted_total",
+    "Forwarded messages deleted by the retention job in batches",
+)
+partitions_dropped = metrics.counter(
+    "forwarded_message_retention_partitions_dropped_total",
+    "Expired forwarded_message partitions dropped by the retention job",
+)
+batch_duration = metrics.histogram(
+    "forwarded_message_retention_batch_duration_seconds",
+    "Duration of a single retention job delete batch",
+)
+
+
+class ForwardedMessageRetention:
+    """Periodically removes forwarded messages older than ``retention``.
+
+    Partitions containing only expired messages are dropped as a whole.
+    The remaining expired messages are deleted oldest first in batches
+    of ``batch_size``, each in its own short transaction and followed by
+    a ``batch_pause``, so that pool connections are held only briefly.
+    In dry-run mode nothing is removed, only logged.
+    """
+
+    def __init__(
+        self,
+        pool: asyncpg.Pool,
+        retention: timedelta,
+        interval: float,
+        batch_size: int,
+        batch_pause: float,
+        dry_run: bool = False,
+        slow_query_log: Optional[SlowQueryLog] = None,
+    ):
+        self._pool = pool
+        self._retention = retention
+        self._interval = interval
+        self._batch_size = batch_size
+        self._batch_pause = batch_pause
+        self._dry_run = dry_run
+        self._slow_query_log = slow_query_log
+
+    async def run(self):
+        while True:
+            try:
+                await self.prune()
+            except Exception:
+                log.exception("Failed to prune forwarded messages")
+
+            await asyncio.sleep(self._interval)
+
+    async def prune(self, now: Optional[datetime] = None) -> int:
+        """Remove expired forwarded messages and return the number
+        of messages deleted in batches.
+        """
+        cutoff = (now or datetime.now(timezone.utc)) - self._retention
+        if self._dry_run:
+            await self._log_dry_run(cutoff)
+            return 0
+
+        # Each partition is dropped in a transaction of its own
+        async with self._connect(autocommit=True) as conn:
+            manager = ForwardedMessagePartitionManager(conn)
+            dropped = await manager.drop_partitions(before=cutoff)
+        for partition in dropped:
+            log.info("Dropped expired partition %s", partition.name)
+        partitions_dropped.inc(len(dropped))
+
+        total_deleted = 0
+        while True:
+            started_at = perf_counter()
+            async with self._connect() as conn:
+                repository = PostgresForwardedMessageRepository(conn)
+                deleted = await repository.remove_created_before(
+                    before=cutoff, limit=self._batch_size
+                )
+            batch_duration.observe(perf_counter() - started_at)
+
+            rows_deleted.inc(deleted)
+            total_deleted += deleted
+            if deleted < self._batch_size:
+                break
+
+            await asyncio.sleep(self._batch_pause)
+
+        log.info(
+            "Deleted %d forwarded messages created before %s",
+            total_deleted,
+            cutoff.isoformat(),
+        )
+        return total_deleted
+
+    def _connect(self, autocommit: bool = False) -> LazyConnection:
+        return LazyConnection(
+            self._pool, slow_query_log=self._slow_query_log, autocommit=autocommit
+        )
+
+    async def _log_dry_run(self, cutoff: datetime):
+        async with self._connect() as conn:
+            partitions = await ForwardedMessagePartitionManager(conn).get_partitions()
+            expired_count = await PostgresForwardedMessageRepository(
+                conn
+            ).count_created_before(cutoff)
+
+        expired_partitions = [
+            partition.name for partition in partitions if partition.end <= cutoff
+        ]
+        log.info(
+            "Dry run: would remove %d forwarded messages created before %s, "
+            "dropping partitions %s",
+            expired_count,
+            cutoff.isoformat(),
+            expired_partitions,
+        )
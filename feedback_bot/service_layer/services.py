@@ -1,20 +1,28 @@
-import asyncio
 from logging import getLogger
 from typing import List, Optional
 
 from dependency_injector.wiring import inject, Provide
 
+from feedback_bot import metrics, tracing
 from feedback_bot.bootstrap import Container
-from feedback_bot.config import settings
-from feedback_bot.model import Admin, ForwardedMessage, TargetChat
+from feedback_bot.model import Admin, TargetChat
 
+from .outbox import CopyMessage, ForwardMessage, SendMessage
 from .unit_of_work import AbstractUnitOfWork
 
 
 log = getLogger(__name__)
 
+service_duration = metrics.labeled_histogram(
+    "service_duration_seconds",
+    "Time spent in services, including sending Telegram requests",
+    labelnames=("service",),
+)
+
 
 @inject
+@metrics.timed(service_duration.labels("authenticate_admin"))
+@tracing.traced("service.authenticate_admin")
 async def authenticate_admin(
     user_id: int,
     chat_id: int,
@@ -38,14 +46,18 @@ async def authenticate_admin(
             return
 
         await uow.admins.add(admin)
-        await uow.telegram_api.send_message(
-            to_chat_id=admin.target_chat.chat_id,
-            text="Auth token successfully verified",
+        uow.outbox.add(
+            SendMessage(
+                to_chat_id=admin.target_chat.chat_id,
+                text="Auth token successfully verified",
+            )
         )
         await uow.commit()
 
 
 @inject
+@metrics.timed(service_duration.labels("add_group"))
+@tracing.traced("service.add_group")
 async def add_group(
     by_user_id: int,
     group_chat_id: int,
@@ -61,18 +73,19 @@ async def add_group(
         await uow.target_chats.add(group_chat)
 
         admins = await uow.admins.get_all()
-        notify_admin_coros = [
-            uow.telegram_api.send_message(
-                to_chat_id=admin.target_chat.chat_id,
-                text=f"Group chat {group_chat_id} added"
+        for admin in admins:
+            uow.outbox.add(
+                SendMessage(
+                    to_chat_id=admin.target_chat.chat_id,
+                    text=f"Group chat {group_chat_id} added",
+                )
             )
-            for admin in admins
-        ]
-        await asyncio.gather(*notify_admin_coros)
         await uow.commit()
 
 
 @inject
+@metrics.timed(service_duration.labels("remove_group"))
+@tracing.traced("service.remove_group")
 async def remove_group(
     group_chat_id: int,
     uow: AbstractUnitOfWork = Provide[Container.uow]
@@ -83,14 +96,13 @@ async def remove_group(
             return
 
         admins = await uow.admins.get_all()
-        notify_admin_coros = [
-            uow.telegram_api.send_message(
-                to_chat_id=admin.target_chat.chat_id,
-                text=f"Group chat {group_chat_id} removed"
+        for admin in admins:
+            uow.outbox.add(
+                SendMessage(
+                    to_chat_id=admin.target_chat.chat_id,
+                    text=f"Group chat {group_chat_id} removed",
+                )
             )
-            for admin in admins
-        ]
-        await asyncio.gather(*notify_admin_coros)
         await uow.commit()
 
 
@@ -99,28 +111,26 @@ async def _forward_message_to_target_chat(
     message_id: int,
     uow: AbstractUnitOfWork,
 ):
-    """Forwards message to latest target chat if one exists
-    and saves the forwarded message.
+    """Forwards message to latest target chat if one exists.
+    The forwarded message is saved once it's sent.
     """
     target_chat = await uow.target_chats.get_latest()
     if not target_chat:
         return
-    
-    forwarded_message_id = await uow.telegram_api.forward_message(
-        from_chat_id=from_chat_id,
-        to_chat_id=target_chat.chat_id,
-        message_id=message_id,
-    )
-    forwarded_message = ForwardedMessage(
-        forwarded_message_id=forwarded_message_id,
-        target_chat_id=target_chat.chat_id,
-        origin_chat_id=from_chat_id,
+
+    uow.outbox.add(
+        ForwardMessage(
+            from_chat_id=from_chat_id,
+            to_chat_id=target_chat.chat_id,
+            message_id=message_id,
+        )
     )
-    await uow.forwarded_messages.add(forwarded_message)
     await uow.commit()
 
 
 @inject
+@metrics.timed(service_duration.labels("process_private_message"))
+@tracing.traced("service.process_private_message")
 async def process_private_message(
     chat_id: int,
     message_id: int,
@@ -135,6 +145,8 @@ async def process_private_message(
 
 
 @inject
+@metrics.timed(service_duration.labels("process_reply"))
+@tracing.traced("service.process_reply")
 async def process_reply(
     chat_id: int,
     message_id: int,
@@ -147,11 +159,14 @@ async def process_reply(
             forwarded_message_id=reply_to_message_id,
         )
         if forwarded_message:
-            await uow.telegram_api.copy_message(
-                from_chat_id=chat_id,
-                to_chat_id=forwarded_message.origin_chat_id,
-                message_id=message_id,
+            uow.outbox.add(
+                CopyMessage(
+                    from_chat_id=chat_id,
+                    to_chat_id=forwarded_message.origin_chat_id,
+                    message_id=message_id,
+                )
             )
+            await uow.commit()
             return
         
         is_target_chat = await uow.target_chats.get(chat_id)
@@ -164,3 +179,12 @@ async def process_reply(
                 message_id=message_id,
                 uow=uow
             )
+
+
+@inject
+async def load_caches(uow: AbstractUnitOfWork = Provide[Container.uow]):
+    """Load the target chats and admins, so the first updates find them cached."""
+    async with uow:
+        target_chats = await uow.target_chats.get_all()
+        admins = await uow.admins.get_all()
+    log.info("Loaded %d target chats and %d admins", len(target_chats), len(admins))
@@ -1,25 +1,34 @@
+from __future__ import annotations
+
 from abc import ABC, abstractmethod
 from contextlib import AbstractAsyncContextManager
 from dataclasses import dataclass
-from typing import Dict, Tuple
-
-import aiogram
-import asyncpg
+from datetime import timedelta
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Union
 
-from feedback_bot.adapters import telegram
+from feedback_bot import tracing
+from feedback_bot.adapters import invalidation
+from feedback_bot.adapters.connection import LazyConnection
+from feedback_bot.adapters.query_log import SlowQueryLog
+from feedback_bot.adapters.sqlite import SqliteDatabase, SqliteTransaction
 from feedback_bot.adapters.repositories import (
     admin as admin_repository,
     target_chat as target_chat_repository,
     forwarded_message as forwarded_message_repository,
+    outbox as outbox_repository,
 )
 from feedback_bot.model import Admin, TargetChat, ForwardedMessage
+from feedback_bot.service_layer.outbox import Outbox, OutboxDispatcher, OutboxEntry
+
+if TYPE_CHECKING:
+    import asyncpg
 
 
 class AbstractUnitOfWork(AbstractAsyncContextManager):
     admins: admin_repository.AbstractAdminRepository
     target_chats: target_chat_repository.AbstractTargetChatRepository
     forwarded_messages: forwarded_message_repository.AbstractForwardedMessageRepository
-    telegram_api: telegram.AbstractTelegramAPI
+    outbox: Outbox
 
     async def __aenter__(self):
         return self
@@ -42,45 +51,249 @@ class AbstractUnitOfWork(AbstractAsyncContextManager):
         raise NotImplementedError
 
 
+def _changed_registries(
+    uow: Union[PostgresUnitOfWork, SqliteUnitOfWork]
+) -> List[str]:
+    """Names of the registries whose tables the unit of work has changed."""
+    changed_registries = []
+    if uow._target_chat_registry is not None and uow.target_chats.changed:
+        changed_registries.append(invalidation.TARGET_CHAT_REGISTRY)
+    if uow._admin_directory is not None and uow.admins.changed:
+        changed_registries.append(invalidation.ADMIN_DIRECTORY)
+    return changed_registries
+
+
 class PostgresUnitOfWork(AbstractUnitOfWork):
     _pool: asyncpg.Pool
-    _conn: asyncpg.Connection
-    _transaction: asyncpg.transaction.Transaction
+    _acquire_timeout: Optional[float]
+    _slow_query_log: Optional[SlowQueryLog]
+    _forwarded_message_lookup_window: Optional[timedelta]
+    _conn: LazyConnection
+    _outbox_dispatcher: OutboxDispatcher
+    _outbox_entries: List[OutboxEntry]
+
+    _target_chat_registry: Optional[target_chat_repository.TargetChatRegistry]
+    _admin_directory: Optional[admin_repository.AdminDirectory]
+    _forwarded_message_buffer: Optional[
+        forwarded_message_repository.ForwardedMessageWriteBuffer
+    ]
+    _cache_invalidation_bus: Optional[invalidation.CacheInvalidationBus]
 
     _committed: bool
     _rolled_back: bool
 
-    def __init__(self, bot: aiogram.Bot, pool: asyncpg.Pool):
-        self.telegram_api = telegram.TelegramAPI(bot)
+    def __init__(
+        self,
+        outbox_dispatcher: OutboxDispatcher,
+        pool: asyncpg.Pool,
+        target_chat_registry: Optional[target_chat_repository.TargetChatRegistry] = None,
+        admin_directory: Optional[admin_repository.AdminDirectory] = None,
+        forwarded_message_buffer: Optional[
+            forwarded_message_repository.ForwardedMessageWriteBuffer
+        ] = None,
+        cache_invalidation_bus: Optional[invalidation.CacheInvalidationBus] = None,
+        acquire_timeout: Optional[float] = None,
+        slow_query_log: Optional[SlowQueryLog] = None,
+        forwarded_message_lookup_window: Optional[timedelta] = None,
+    ):
+        self._outbox_dispatcher = outbox_dispatcher
         self._pool = pool
+        self._target_chat_registry = target_chat_registry
+        self._admin_directory = admin_directory
+        self._forwarded_message_buffer = forwarded_message_buffer
+        self._cache_invalidation_bus = cache_invalidation_bus
+        self._acquire_timeout = acquire_timeout
+        self._slow_query_log = slow_query_log
+        self._forwarded_message_lookup_window = forwarded_message_lookup_window
 
         self._committed = False
         self._rolled_back = False
 
+    @tracing.traced("uow.enter")
     async def __aenter__(self):
-        self._conn = await self._pool.acquire()
-        self._transaction = self._conn.transaction()
-        await self._transaction.start()
+        # The pool connection is acquired on the first query,
+        # so updates that don't touch the database never wait for one.
+        self._conn = LazyConnection(
+            self._pool,
+            acquire_timeout=self._acquire_timeout,
+            slow_query_log=self._slow_query_log,
+        )
+        self.outbox = Outbox()
+        self._outbox_entries = []
 
-        self.admins = admin_repository.PostgresAdminRepository(self._conn)
         self.target_chats = (
             target_chat_repository.PostgresTargetChatRepository(self._conn)
         )
+        if self._target_chat_registry is not None:
+            self.target_chats = target_chat_repository.CachedTargetChatRepository(
+                repository=self.target_chats,
+                registry=self._target_chat_registry,
+                has_changes=self._has_cache_changes,
+            )
+        self.admins = admin_repository.PostgresAdminRepository(
+            self._conn, target_chats=self.target_chats
+        )
+        if self._admin_directory is not None:
+            self.admins = admin_repository.CachedAdminRepository(
+                repository=self.admins,
+                directory=self._admin_directory,
+                has_changes=self._has_cache_changes,
+            )
         self.forwarded_messages = (
-            forwarded_message_repository.PostgresForwardedMessageRepository(self._conn)
+            forwarded_message_repository.PostgresForwardedMessageRepository(
+                self._conn, lookup_window=self._forwarded_message_lookup_window
+            )
         )
+        if self._forwarded_message_buffer is not None:
+            self.forwarded_messages = (
+                forwarded_message_repository.BufferedForwardedMessageRepository(
+                    repository=self.forwarded_messages,
+                    buffer=self._forwarded_message_buffer,
+                )
+            )
 
     async def __aexit__(self, *args):
-        await super().__aexit__(*args)
-        await self._pool.release(self._conn)
+        try:
+            await super().__aexit__(*args)
+        finally:
+            await self._conn.release()
+
+        # Telegram requests are sent only once the changes are committed
+        # and the connection is back in the pool.
+        if self._committed:
+            await self._outbox_dispatcher.dispatch(self._outbox_entries)
 
+    @tracing.traced("uow.commit")
     async def _commit(self):
-        await self._transaction.commit()
+        # Saved in the transaction, so they're sent if and only if it commits
+        self._outbox_entries = await self._outbox_dispatcher.save(
+            outbox_repository.PostgresOutboxRepository(self._conn),
+            self.outbox.collect(),
+        )
+        if self._cache_invalidation_bus is not None:
+            changed_registries = _changed_registries(self)
+            if changed_registries:
+                await self._cache_invalidation_bus.notify(
+                    self._conn, changed_registries
+                )
+
+        await self._conn.commit()
         self._committed = True
 
+        if self._target_chat_registry is not None:
+            await self.target_chats.publish()
+        if self._admin_directory is not None:
+            await self.admins.publish()
+        if self._forwarded_message_buffer is not None:
+            await self.forwarded_messages.publish()
+
+    def _has_cache_changes(self) -> bool:
+        return bool(_changed_registries(self))
+
     async def _rollback(self):
         if self._committed or self._rolled_back:
             return
     
-        await self._transaction.rollback()
+        with tracing.span("uow.rollback"):
+            await self._conn.rollback()
         self._rolled_back = True
+
+
+class SqliteUnitOfWork(AbstractUnitOfWork):
+    """Unit of work of the embedded SQLite database.
+
+    Units of work take turns on the database, the first query waits
+    for the previous unit of work to finish for up to ``lock_timeout``
+    seconds, if given.
+    """
+
+    _database: SqliteDatabase
+    _lock_timeout: Optional[float]
+    _conn: SqliteTransaction
+    _outbox_dispatcher: OutboxDispatcher
+    _outbox_entries: List[OutboxEntry]
+
+    _target_chat_registry: Optional[target_chat_repository.TargetChatRegistry]
+    _admin_directory: Optional[admin_repository.AdminDirectory]
+
+    _committed: bool
+
+    def __init__(
+        self,
+        outbox_dispatcher: OutboxDispatcher,
+        database: SqliteDatabase,
+        target_chat_registry: Optional[target_chat_repository.TargetChatRegistry] = None,
+        admin_directory: Optional[admin_repository.AdminDirectory] = None,
+        lock_timeout: Optional[float] = None,
+    ):
+        self._outbox_dispatcher = outbox_dispatcher
+        self._database = database
+        self._target_chat_registry = target_chat_registry
+        self._admin_directory = admin_directory
+        self._lock_timeout = lock_timeout
+
+        self._committed = False
+
+    @tracing.traced("uow.enter")
+    async def __aenter__(self):
+        self._conn = SqliteTransaction(self._database, lock_timeout=self._lock_timeout)
+        self.outbox = Outbox()
+        self._outbox_entries = []
+
+        self.target_chats = target_chat_repository.SqliteTargetChatRepository(
+            self._conn
+        )
+        if self._target_chat_registry is not None:
+            self.target_chats = target_chat_repository.CachedTargetChatRepository(
+                repository=self.target_chats,
+                registry=self._target_chat_registry,
+                has_changes=self._has_cache_changes,
+            )
+        self.admins = admin_repository.SqliteAdminRepository(
+            self._conn, target_chats=self.target_chats
+        )
+        if self._admin_directory is not None:
+            self.admins = admin_repository.CachedAdminRepository(
+                repository=self.admins,
+                directory=self._admin_directory,
+                has_changes=self._has_cache_changes,
+            )
+        self.forwarded_messages = (
+            forwarded_message_repository.SqliteForwardedMessageRepository(self._conn)
+        )
+
+    async def __aexit__(self, *args):
+        try:
+            await super().__aexit__(*args)
+        finally:
+            await self._conn.release()
+
+        # Telegram requests are sent only once the changes are committed
+        # and the database is free for other units of work.
+        if self._committed:
+            await self._outbox_dispatcher.dispatch(self._outbox_entries)
+
+    @tracing.traced("uow.commit")
+    async def _commit(self):
+        # Saved in the transaction, so they're sent if and only if it commits
+        self._outbox_entries = await self._outbox_dispatcher.save(
+            outbox_repository.SqliteOutboxRepository(self._conn),
+            self.outbox.collect(),
+        )
+        await self._conn.commit()
+        self._committed = True
+
+        if self._target_chat_registry is not None:
+            await self.target_chats.publish()
+        if self._admin_directory is not None:
+            await self.admins.publish()
+
+    def _has_cache_changes(self) -> bool:
+        return bool(_changed_registries(self))
+
+    async def _rollback(self):
+        if self._committed:
+            return
+
+        with tracing.span("uow.rollback"):
+            await self._conn.rollback()
@@ -0,0 +1,100 @@
+import os
+import signal
+from logging import getLogger
+from typing import Callable, Dict
+
+log = getLogger(__name__)
+
+
+class Supervisor:
+    """Runs ``target`` in ``workers`` forked worker processes.
+
+    ``target`` receives the index of the worker. Once SIGTERM or SIGINT
+    is received, or any worker exits, the remaining workers are sent
+    SIGTERM and given ``shutdown_timeout`` seconds to finish, after which
+    they are killed.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        target: Callable[[int], None],
+        shutdown_timeout: int = 25,
+    ):
+        self._workers = workers
+        self._target = target
+        self._shutdown_timeout = shutdown_timeout
+        self._children: Dict[int, int] = {}
+        self._stopping = False
+
+    def run(self) -> int:
+        """Run the workers until all of them exit and return the exit code."""
+        signal.signal(signal.SIGTERM, self._handle_stop_signal)
+        signal.signal(signal.SIGINT, self._handle_stop_signal)
+        signal.signal(signal.SIGALRM, self._handle_shutdown_timeout)
+
+        for index in range(self._workers):
+            self._spawn(index)
+
+        exit_code = 0
+        while self._children:
+            pid, status = os.wait()
+            index = self._children.pop(pid, None)
+            if index is None:
+                continue
+
+            code = os.waitstatus_to_exitcode(status)
+            if not self._stopping:
+                log.error("Worker %d (pid %d) exited with code %d", index, pid, code)
+                exit_code = 1
+                self.stop()
+            else:
+                log.info("Worker %d (pid %d) exited with code %d", index, pid, code)
+
+        signal.alarm(0)
+        return exit_code
+
+    def stop(self):
+        if self._stopping:
+            return
+
+        self._stopping = True
+        log.info("Stopping %d workers", len(self._children))
+        for pid in self._children:
+            self._kill(pid, signal.SIGTERM)
+        signal.alarm(self._shutdown_timeout)
+
+    def _spawn(self, index: int):
+        pid = os.fork()
+        if pid:
+            log.info("Started worker %d (pid %d)", index, pid)
+            self._children[pid] = index
+            return
+
+        # Worker process
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGALRM, signal.SIG_DFL)
+        exit_code = 0
+        try:
+            self._target(index)
+        except BaseException:
+            log.exception("Worker %d failed", index)
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+
+    def _handle_stop_signal(self, signum, frame):
+        self.stop()
+
+    def _handle_shutdown_timeout(self, signum, frame):
+        for pid in self._children:
+            log.warning("Killing worker %d (pid %d)", self._children[pid], pid)
+            self._kill(pid, signal.SIGKILL)
+
+    @staticmethod
+    def _kill(pid: int, signum: int):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
@@ -0,0 +1,330 @@
+"""Lightweight tracing of update processing.
+
+A trace starts when the dispatcher receives an update and is sampled
+at its head: with probability ``sample_rate`` the update gets a root span,
+otherwise nothing is recorded for it. Spans started while processing
+a sampled update become children of the current span, which is kept
+in a context variable, so it follows the update through awaits and tasks.
+
+When the current update isn't sampled, ``span`` returns a shared no-op
+span and ``traced`` calls the wrapped function right away, so tracing
+costs a context variable lookup per instrumented call.
+
+Finished traces are handed to an exporter in batches by ``Tracer.flush``.
+"""
+import asyncio
+import functools
+import json
+import random
+import time
+from abc import ABC, abstractmethod
+from contextvars import ContextVar
+from logging import getLogger
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
+
+import aiohttp
+
+from feedback_bot import metrics
+
+log = getLogger(__name__)
+
+AttributeValue = Union[str, int, float, bool]
+
+spans_dropped = metrics.counter(
+    "tracing_spans_dropped_total",
+    "Finished spans dropped because the export queue was full",
+)
+
+
+class Span:
+    __slots__ = (
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "name",
+        "attributes",
+        "start_ns",
+        "end_ns",
+        "failed",
+        "_trace",
+        "_token",
+    )
+
+    def __init__(self, trace: "_Trace", name: str, parent_id: Optional[int]):
+        self.trace_id = trace.trace_id
+        self.span_id = random.getrandbits(64)
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes: Dict[str, AttributeValue] = {}
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.failed = False
+        self._trace = trace
+        self._token = None
+
+    def set(self, key: str, value: AttributeValue):
+        self.attributes[key] = value
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.end_ns = time.time_ns()
+        self.failed = exc_type is not None
+        _current_span.reset(self._token)
+        self._trace.finish(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": f"{self.trace_id:032x}",
+            "span_id": f"{self.span_id:016x}",
+            "parent_id": (
+                f"{self.parent_id:016x}" if self.parent_id is not None else None
+            ),
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "failed": self.failed,
+            "attributes": self.attributes,
+        }
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, key: str, value: AttributeValue):
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+class _Trace:
+    """Spans of one update, handed to the tracer once the root span ends."""
+
+    __slots__ = ("trace_id", "tracer", "spans")
+
+    def __init__(self, tracer: "Tracer"):
+        self.trace_id = random.getrandbits(128)
+        self.tracer = tracer
+        self.spans: List[Span] = []
+
+    def start(self, name: str, parent_id: Optional[int]) -> Span:
+        return Span(self, name, parent_id)
+
+    def finish(self, span: Span):
+        self.spans.append(span)
+        if span.parent_id is None:
+            self.tracer.finish(self.spans)
+
+
+class AbstractSpanExporter(ABC):
+    @abstractmethod
+    async def export(self, spans: List[Span]):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class FileSpanExporter(AbstractSpanExporter):
+    """Appends spans to a file, one JSON object per line."""
+
+    def __init__(self, path: str):
+        self._path = path
+
+    async def export(self, spans: List[Span]):
+        lines = "".join(json.dumps(span.to_dict()) + "\n" for span in spans)
+        await asyncio.get_event_loop().run_in_executor(None, self._write, lines)
+
+    def _write(self, lines: str):
+        with open(self._path, "a", encoding="utf-8") as file:
+            file.write(lines)
+
+
+def _otlp_value(value: AttributeValue) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class OTLPSpanExporter(AbstractSpanExporter):
+    """Sends spans to an OpenTelemetry collector with OTLP/HTTP in JSON."""
+
+    _STATUS_OK = 1
+    _STATUS_ERROR = 2
+
+    def __init__(
+        self, endpoint: str, service_name: str = "feedback-bot", timeout: float = 10.0
+    ):
+        self._url = endpoint.rstrip("/") + "/v1/traces"
+        self._service_name = service_name
+        self._timeout = aiohttp.ClientTimeout(total=timeout)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _encode_span(self, span: Span) -> Dict[str, Any]:
+        encoded = {
+            "traceId": f"{span.trace_id:032x}",
+            "spanId": f"{span.span_id:016x}",
+            "name": span.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns),
+            "attributes": [
+                {"key": key, "value": _otlp_value(value)}
+                for key, value in span.attributes.items()
+            ],
+            "status": {
+                "code": self._STATUS_ERROR if span.failed else self._STATUS_OK
+            },
+        }
+        if span.parent_id is not None:
+            encoded["parentSpanId"] = f"{span.parent_id:016x}"
+        return encoded
+
+    async def export(self, spans: List[Span]):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=self._timeout)
+
+        payload = {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [
+                            {
+                                "key": "service.name",
+                                "value": {"stringValue": self._service_name},
+                            }
+                        ]
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": __name__},
+                            "spans": [self._encode_span(span) for span in spans],
+                        }
+                    ],
+                }
+            ]
+        }
+        async with self._session.post(self._url, json=payload) as response:
+            response.raise_for_status()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class Tracer:
+    """Samples updates and buffers finished traces until ``flush``.
+
+    At most ``max_queue_size`` finished spans wait for export,
+    spans of traces finished after that are dropped.
+    """
+
+    def __init__(
+        self,
+        sample_rate: float,
+        exporter: AbstractSpanExporter,
+        max_queue_size: int = 10000,
+    ):
+        self._sample_rate = sample_rate
+        self._exporter = exporter
+        self._max_queue_size = max_queue_size
+        self._finished: List[Span] = []
+
+    def start_trace(self, name: str) -> Union[Span, _NoopSpan]:
+        if random.random() >= self._sample_rate:
+            return NOOP_SPAN
+        return _Trace(self).start(name, parent_id=None)
+
+    def finish(self, spans: List[Span]):
+        if len(self._finished) + len(spans) > self._max_queue_size:
+            spans_dropped.inc(len(spans))
+            return
+        self._finished.extend(spans)
+
+    async def flush(self):
+        spans, self._finished = self._finished, []
+        if not spans:
+            return
+
+        try:
+            await self._exporter.export(spans)
+        except Exception:
+            log.exception("Failed to export %d spans", len(spans))
+
+    async def run(self, interval: float):
+        """Flush finished traces every ``interval`` seconds until cancelled."""
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+    async def close(self):
+        await self.flush()
+        await self._exporter.close()
+
+
+_tracer: Optional[Tracer] = None
+
+
+def set_tracer(tracer: Optional[Tracer]):
+    global _tracer
+    _tracer = tracer
+
+
+def trace(name: str) -> Union[Span, _NoopSpan]:
+    """Start the root span of a new trace, if it's sampled."""
+    if _tracer is None:
+        return NOOP_SPAN
+    return _tracer.start_trace(name)
+
+
+def span(name: str) -> Union[Span, _NoopSpan]:
+    """Start a child of the current span, if there is one."""
+    parent = _current_span.get()
+    if parent is None:
+        return NOOP_SPAN
+    return parent._trace.start(name, parent.span_id)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def set_current_span(span: Optional[Span]):
+    """Make ``span`` the parent of spans started in the current context,
+    for work done by other tasks on behalf of a traced update.
+    """
+    _current_span.set(span)
+
+
+def traced(name: str):
+    """Run every call of the decorated coroutine function in a span."""
+
+    def decorator(func: Callable[..., Awaitable[Any]]):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            parent = _current_span.get()
+            if parent is None:
+                return await func(*args, **kwargs)
+
+            with parent._trace.start(name, parent.span_id):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
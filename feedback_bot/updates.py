@@ -0,0 +1,232 @@
+import asyncio
+from contextlib import contextmanager
+from logging import getLogger
+from time import perf_counter
+from typing import Hashable, List, Optional, Tuple, Union
+
+from aiogram import Bot, Dispatcher, types
+
+from feedback_bot import metrics, routing, tracing
+
+log = getLogger(__name__)
+
+queue_depth = metrics.gauge(
+    "update_queue_depth",
+    "Updates waiting to be processed",
+)
+queue_wait = metrics.histogram(
+    "update_queue_wait_seconds",
+    "Time an update waits in the queue before processing",
+)
+queue_full = metrics.counter(
+    "update_queue_full_total",
+    "Updates delayed because the queue of their shard was full",
+)
+shard_depth_max = metrics.gauge(
+    "update_shard_depth_max",
+    "Number of updates waiting in the most loaded shard",
+)
+updates_processed = metrics.labeled_counter(
+    "updates_processed_total",
+    "Processed updates by type and outcome, either processed or failed",
+    labelnames=("type", "outcome"),
+)
+update_duration = metrics.histogram(
+    "update_processing_duration_seconds",
+    "Time spent processing an update, from dispatching to the last handler",
+)
+shard_imbalance = metrics.gauge(
+    "update_shard_imbalance",
+    "Updates assigned to the busiest shard relative to the mean, "
+    "1 when updates are spread evenly",
+)
+
+
+AnyUpdate = Union[types.Update, routing.Update]
+
+
+class InFlightUpdates:
+    """Counts updates being processed, so that shutdown can wait for them."""
+
+    def __init__(self):
+        self._count = 0
+        self._idle: Optional[asyncio.Future] = None
+
+    def __len__(self) -> int:
+        return self._count
+
+    @contextmanager
+    def track(self):
+        self._count += 1
+        try:
+            yield
+        finally:
+            self._count -= 1
+            if not self._count and self._idle is not None and not self._idle.done():
+                self._idle.set_result(None)
+
+    async def wait(self, timeout: Optional[float] = None) -> int:
+        """Wait for the updates being processed, at most ``timeout`` seconds,
+        and return the number of those still unfinished.
+        """
+        if self._count:
+            self._idle = asyncio.get_event_loop().create_future()
+            try:
+                await asyncio.wait_for(asyncio.shield(self._idle), timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self._idle = None
+        return self._count
+
+
+def update_type(update: AnyUpdate) -> str:
+    """Name of the update field holding the event, e.g. "message"."""
+    if isinstance(update, routing.Update):
+        return update.type
+    for name in update.values:
+        if name != "update_id":
+            return name
+    return "unknown"
+
+
+class InstrumentedDispatcher(Dispatcher):
+    """Counts processed updates, measures how long processing takes
+    and starts a trace for sampled updates.
+
+    Every way of receiving updates ends in ``process_update``, lean
+    updates decoded by ``routing.decode_update`` are passed to ``router``.
+    Updates being processed are counted by ``in_flight``.
+    """
+
+    def __init__(
+        self, bot: Bot, router: Optional[routing.UpdateRouter] = None, **kwargs
+    ):
+        super().__init__(bot, **kwargs)
+        self.router = router
+        self.in_flight = InFlightUpdates()
+
+    async def process_update(self, update: AnyUpdate):
+        started_at = perf_counter()
+        outcome = "failed"
+        with self.in_flight.track(), tracing.trace("update") as span:
+            span.set("update_id", update.update_id)
+            span.set("update_type", update_type(update))
+            try:
+                if isinstance(update, routing.Update):
+                    result = await self.router.route(update)
+                else:
+                    result = await super().process_update(update)
+                outcome = "processed"
+                return result
+            finally:
+                update_duration.observe(perf_counter() - started_at)
+                updates_processed.labels(update_type(update), outcome).inc()
+
+
+def ordering_key(update: AnyUpdate) -> Hashable:
+    """Updates of the same chat have to be processed in order,
+    other updates can be processed concurrently.
+    """
+    event = update.message or update.my_chat_member
+    if event is not None:
+        return event.chat.id
+    return ("update", update.update_id)
+
+
+class UpdateWorkerPool:
+    """Processes updates with the dispatcher handlers in ``shards``
+    background workers.
+
+    Updates are assigned to shards by chat, each shard has its own queue
+    and worker, so updates of a chat are processed in order, while
+    updates of chats in different shards are processed concurrently.
+
+    At most ``queue_size`` updates wait for processing, split evenly
+    between the shards. Once the queue of a shard is full, ``put`` waits
+    for a free slot, which delays the webhook response and makes Telegram
+    slow down sending updates.
+    """
+
+    _dp: Dispatcher
+    _queues: "List[asyncio.Queue[Tuple[AnyUpdate, float]]]"
+
+    def __init__(self, shards: int, queue_size: int):
+        self._shards = shards
+        self._shard_queue_size = max(1, queue_size // shards)
+        self._queues = []
+        self._queued = 0
+        self._processing = 0
+        self._assigned = [0] * shards
+        self._tasks: List[asyncio.Task] = []
+
+    def __len__(self) -> int:
+        return self._queued
+
+    def start(self, dp: Dispatcher):
+        # Workers inherit the context, handlers rely on the current instances
+        Bot.set_current(dp.bot)
+        Dispatcher.set_current(dp)
+
+        self._dp = dp
+        self._queues = [
+            asyncio.Queue(maxsize=self._shard_queue_size)
+            for _ in range(self._shards)
+        ]
+        self._tasks = [asyncio.create_task(self._work(queue)) for queue in self._queues]
+
+    def shard(self, update: AnyUpdate) -> int:
+        return hash(ordering_key(update)) % self._shards
+
+    async def put(self, update: AnyUpdate):
+        shard = self.shard(update)
+        queue = self._queues[shard]
+        if queue.full():
+            queue_full.inc()
+
+        await queue.put((update, perf_counter()))
+        self._queued += 1
+        self._assigned[shard] += 1
+        self._update_depth_metrics()
+        shard_imbalance.set(
+            max(self._assigned) * self._shards / sum(self._assigned)
+        )
+
+    async def close(self, timeout: Optional[float] = None) -> int:
+        """Process the queued updates and stop the workers.
+
+        Returns the number of updates left unprocessed after ``timeout``
+        seconds, either queued or cancelled while being processed.
+        """
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(queue.join() for queue in self._queues)), timeout
+            )
+        except asyncio.TimeoutError:
+            log.warning("%d queued updates have not been processed", self._queued)
+
+        abandoned = self._queued + self._processing
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        return abandoned
+
+    async def _work(self, queue: "asyncio.Queue[Tuple[AnyUpdate, float]]"):
+        while True:
+            update, enqueued_at = await queue.get()
+            self._queued -= 1
+            self._update_depth_metrics()
+            queue_wait.observe(perf_counter() - enqueued_at)
+            self._processing += 1
+            try:
+                await self._dp.process_update(update)
+            except Exception:
+                log.exception("Failed to process update %d", update.update_id)
+            finally:
+                self._processing -= 1
+                queue.task_done()
+
+    def _update_depth_metrics(self):
+        queue_depth.set(self._queued)
+        shard_depth_max.set(max(queue.qsize() for queue in self._queues))
@@ -0,0 +1,79 @@
+from typing import Optional
+
+from aiogram.dispatcher.webhook import WebhookRequestHandler
+from aiohttp import web
+
+from feedback_bot import metrics, routing
+from feedback_bot.updates import AnyUpdate
+
+updates_rejected = metrics.counter(
+    "updates_rejected_total",
+    "Webhook updates rejected while the process isn't ready, sent again by Telegram",
+)
+
+UPDATE_WORKER_POOL_KEY = "UPDATE_WORKER_POOL"
+READINESS_KEY = "READINESS"
+
+METRICS_PATH = "/metrics"
+HEALTHZ_PATH = "/healthz"
+READYZ_PATH = "/readyz"
+
+
+class Readiness:
+    """Whether the process is warmed up and takes updates."""
+
+    def __init__(self):
+        self.ready = False
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    """Metrics of the process in the Prometheus text exposition format."""
+    return web.Response(
+        body=metrics.render().encode(),
+        headers={"Content-Type": metrics.CONTENT_TYPE},
+    )
+
+
+async def handle_healthz(request: web.Request) -> web.Response:
+    """The process is up and serving requests."""
+    return web.Response(text="ok")
+
+
+async def handle_readyz(request: web.Request) -> web.Response:
+    """The process is warmed up, 503 until then."""
+    if request.app[READINESS_KEY].ready:
+        return web.Response(text="ready")
+    return web.Response(status=503, text="not ready")
+
+
+class LeanRequestHandler(WebhookRequestHandler):
+    """Decodes updates with ``routing.decode_update``,
+    updates without handlers are acknowledged right away.
+
+    Updates are rejected while the process isn't ready, e.g. draining
+    on shutdown, so that Telegram sends them again.
+    """
+
+    async def post(self):
+        if not self.request.app[READINESS_KEY].ready:
+            updates_rejected.inc()
+            raise web.HTTPServiceUnavailable()
+        return await super().post()
+
+    async def parse_update(self, bot) -> Optional[AnyUpdate]:
+        return routing.decode_update(await self.request.json())
+
+    async def process_update(self, update: Optional[AnyUpdate]):
+        if update is None:
+            return None
+        return await super().process_update(update)
+
+
+class ImmediateAckRequestHandler(LeanRequestHandler):
+    """Acknowledges webhook requests without waiting for the update
+    to be processed, processing is left to the UpdateWorkerPool.
+    """
+
+    async def process_update(self, update: Optional[AnyUpdate]):
+        if update is not None:
+            await self.request.app[UPDATE_WORKER_POOL_KEY].put(update)
@@ -0,0 +1,232 @@
+"""Behaviour expected from every implementation of the repository ABCs.
+
+Test classes of a backend inherit the contracts and provide fixtures
+with its repositories: ``target_chat_repository``, ``admin_repository``,
+``forwarded_message_repository``, ``update_offset_repository``
+and ``outbox_repository``.
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from feedback_bot.model import Admin, ForwardedMessage, TargetChat
+
+
+def _target_chat(chat_id: int, year: int) -> TargetChat:
+    return TargetChat(
+        chat_id=chat_id, created_at=datetime(year, 1, 1, 12, 30, 15, 123456, timezone.utc)
+    )
+
+
+class TargetChatRepositoryContract:
+    @pytest.mark.asyncio
+    async def test_get(self, target_chat_repository):
+        target_chat = _target_chat(13, 2021)
+        await target_chat_repository.add(target_chat)
+
+        assert await target_chat_repository.get(13) == target_chat
+
+    @pytest.mark.asyncio
+    async def test_get_not_found(self, target_chat_repository):
+        assert await target_chat_repository.get(13) is None
+
+    @pytest.mark.asyncio
+    async def test_get_latest(self, target_chat_repository):
+        latest = _target_chat(13, 2021)
+        await target_chat_repository.add(_target_chat(37, 2020))
+        await target_chat_repository.add(latest)
+        await target_chat_repository.add(_target_chat(-42, 2019))
+
+        assert await target_chat_repository.get_latest() == latest
+
+    @pytest.mark.asyncio
+    async def test_get_latest_not_found(self, target_chat_repository):
+        assert await target_chat_repository.get_latest() is None
+
+    @pytest.mark.asyncio
+    async def test_get_all(self, target_chat_repository):
+        target_chats = [_target_chat(13, 2021), _target_chat(-37, 2020)]
+        for target_chat in target_chats:
+            await target_chat_repository.add(target_chat)
+
+        result = await target_chat_repository.get_all()
+
+        assert sorted(result, key=lambda chat: chat.chat_id) == sorted(
+            target_chats, key=lambda chat: chat.chat_id
+        )
+
+    @pytest.mark.asyncio
+    async def test_remove(self, target_chat_repository):
+        target_chat = _target_chat(13, 2021)
+        await target_chat_repository.add(target_chat)
+        await target_chat_repository.add(_target_chat(37, 2020))
+
+        assert await target_chat_repository.remove(13) == target_chat
+        assert await target_chat_repository.get(13) is None
+        assert [chat.chat_id for chat in await target_chat_repository.get_all()] == [37]
+
+    @pytest.mark.asyncio
+    async def test_remove_not_found(self, target_chat_repository):
+        assert await target_chat_repository.remove(13) is None
+
+
+class AdminRepositoryContract:
+    @pytest.mark.asyncio
+    async def test_add_with_target_chat(self, admin_repository, target_chat_repository):
+        admin = Admin(user_id=42, target_chat=_target_chat(13, 2021))
+
+        await admin_repository.add(admin)
+
+        assert await admin_repository.get(42) == admin
+        assert await target_chat_repository.get(13) == admin.target_chat
+
+    @pytest.mark.asyncio
+    async def test_get_not_found(self, admin_repository):
+        assert await admin_repository.get(42) is None
+
+    @pytest.mark.asyncio
+    async def test_get_all(self, admin_repository):
+        admins = [
+            Admin(user_id=42, target_chat=_target_chat(13, 2021)),
+            Admin(user_id=43, target_chat=_target_chat(37, 2020)),
+        ]
+        for admin in admins:
+            await admin_repository.add(admin)
+
+        result = await admin_repository.get_all()
+
+        assert sorted(result, key=lambda admin: admin.user_id) == admins
+
+
+class ForwardedMessageRepositoryContract:
+    @pytest.mark.asyncio
+    async def test_get(self, forwarded_message_repository):
+        forwarded_message = ForwardedMessage(
+            forwarded_message_id=1,
+            target_chat_id=13,
+            origin_chat_id=42,
+            created_at=datetime(2021, 1, 1, 12, 30, 15, 123456, timezone.utc),
+        )
+        await forwarded_message_repository.add(forwarded_message)
+
+        result = await forwarded_message_repository.get(
+            forwarded_message_id=1, target_chat_id=13
+        )
+
+        assert result == forwarded_message
+        assert result.origin_chat_id == 42
+        assert result.created_at == forwarded_message.created_at
+
+    @pytest.mark.asyncio
+    async def test_get_not_found(self, forwarded_message_repository):
+        await forwarded_message_repository.add(
+            ForwardedMessage(forwarded_message_id=1, target_chat_id=13, origin_chat_id=42)
+        )
+
+        result = await forwarded_message_repository.get(
+            forwarded_message_id=1, target_chat_id=37
+        )
+
+        assert result is None
+
+    @pytest.mark.asyncio
+    async def test_add_many(self, forwarded_message_repository):
+        forwarded_messages = [
+            ForwardedMessage(
+                forwarded_message_id=message_id, target_chat_id=13, origin_chat_id=42
+            )
+            for message_id in range(1, 4)
+        ]
+
+        await forwarded_message_repository.add_many(forwarded_messages)
+
+        for forwarded_message in forwarded_messages:
+            result = await forwarded_message_repository.get(
+                forwarded_message_id=forwarded_message.forwarded_message_id,
+                target_chat_id=13,
+            )
+            assert result.origin_chat_id == 42
+
+
+class UpdateOffsetRepositoryContract:
+    @pytest.mark.asyncio
+    async def test_get_not_found(self, update_offset_repository):
+        assert await update_offset_repository.get(bot_id=42) is None
+
+    @pytest.mark.asyncio
+    async def test_save_overwrites(self, update_offset_repository):
+        await update_offset_repository.save(bot_id=42, update_offset=100)
+        await update_offset_repository.save(bot_id=42, update_offset=200)
+
+        assert await update_offset_repository.get(bot_id=42) == 200
+
+
+_NOW = datetime(2021, 1, 1, 12, 30, 15, 123456, timezone.utc)
+
+
+class OutboxRepositoryContract:
+    @pytest.mark.asyncio
+    async def test_claim_available(self, outbox_repository):
+        first_id = await outbox_repository.add('{"n": 1}', _NOW)
+        second_id = await outbox_repository.add('{"n": 2}', _NOW - timedelta(hours=1))
+        await outbox_repository.add('{"n": 3}', _NOW + timedelta(seconds=1))
+
+        records = await outbox_repository.claim(
+            now=_NOW, leased_until=_NOW + timedelta(minutes=1), limit=10
+        )
+
+        assert [(record.id, record.attempts) for record in records] == [
+            (first_id, 0),
+            (second_id, 0),
+        ]
+        assert [record.payload.replace(" ", "") for record in records] == [
+            '{"n":1}',
+            '{"n":2}',
+        ]
+
+    @pytest.mark.asyncio
+    async def test_claimed_records_leased(self, outbox_repository):
+        record_id = await outbox_repository.add("{}", _NOW)
+        leased_until = _NOW + timedelta(minutes=1)
+        await outbox_repository.claim(now=_NOW, leased_until=leased_until, limit=10)
+
+        assert await outbox_repository.claim(
+            now=_NOW, leased_until=leased_until, limit=10
+        ) == []
+        records = await outbox_repository.claim(
+            now=leased_until, leased_until=leased_until, limit=10
+        )
+        assert [record.id for record in records] == [record_id]
+
+    @pytest.mark.asyncio
+    async def test_claim_limit(self, outbox_repository):
+        record_ids = [await outbox_repository.add("{}", _NOW) for _ in range(3)]
+
+        records = await outbox_repository.claim(now=_NOW, leased_until=_NOW, limit=2)
+
+        assert [record.id for record in records] == record_ids[:2]
+
+    @pytest.mark.asyncio
+    async def test_remove(self, outbox_repository):
+        removed_id = await outbox_repository.add("{}", _NOW)
+        kept_id = await outbox_repository.add("{}", _NOW)
+
+        await outbox_repository.remove([removed_id])
+
+        records = await outbox_repository.claim(now=_NOW, leased_until=_NOW, limit=10)
+        assert [record.id for record in records] == [kept_id]
+
+    @pytest.mark.asyncio
+    async def test_retry_later(self, outbox_repository):
+        record_id = await outbox_repository.add("{}", _NOW)
+        retry_at = _NOW + timedelta(seconds=5)
+
+        await outbox_repository.retry_later(record_id, retry_at)
+
+        assert await outbox_repository.claim(
+            now=_NOW, leased_until=_NOW, limit=10
+        ) == []
+        records = await outbox_repository.claim(
+            now=retry_at, leased_until=retry_at, limit=10
+        )
+        assert [(record.id, record.attempts) for record in records] == [(record_id, 1)]
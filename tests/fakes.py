@@ -0,0 +1,12 @@
+# The fakes live in benchmarks, which use them too
+from benchmarks.fakes import (  # noqa: F401
+    FakeCopiedMessage,
+    FakeForwardedMessage,
+    FakeSentMessage,
+    FakeTelegramAPI,
+    InMemoryAdminRepository,
+    InMemoryForwardedMessageRepository,
+    InMemoryOutboxRepository,
+    InMemoryTargetChatRepository,
+    InMemoryUnitOfWork,
+)
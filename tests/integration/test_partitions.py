@@ -0,0 +1,85 @@
+from datetime import datetime, timezone
+
+import asyncpg
+import pytest
+
+from feedback_bot.adapters.partitions import (
+    ForwardedMessagePartitionManager,
+    Partition,
+)
+
+
+class TestForwardedMessagePartitionManager:
+    @pytest.mark.asyncio
+    async def test_create_partitions(self, db_connection: asyncpg.Connection):
+        manager = ForwardedMessagePartitionManager(db_connection)
+        now = datetime(2031, 5, 17, tzinfo=timezone.utc)
+
+        created = await manager.create_partitions(months_ahead=2, now=now)
+
+        assert [partition.name for partition in created] == [
+            "forwarded_message_p203105",
+            "forwarded_message_p203106",
+            "forwarded_message_p203107",
+        ]
+        partitions = await manager.get_partitions()
+        assert set(created) <= set(partitions)
+
+        assert await manager.create_partitions(months_ahead=2, now=now) == []
+
+    @pytest.mark.asyncio
+    async def test_create_partition_takes_over_default_rows(
+        self, db_connection: asyncpg.Connection
+    ):
+        manager = ForwardedMessagePartitionManager(db_connection)
+        created_at = datetime(2032, 3, 10, tzinfo=timezone.utc)
+        # No partition of this month exists yet
+        await db_connection.execute(
+            """
+            INSERT INTO forwarded_message
+                (forwarded_message_id, target_chat_id, origin_chat_id, created_at)
+            VALUES ($1, $2, $3, $4)
+            """,
+            13, 37, 42, created_at,
+        )
+        assert await manager.count_default_rows() >= 1
+
+        created = await manager.create_partitions(months_ahead=0, now=created_at)
+
+        assert [partition.name for partition in created] == [
+            "forwarded_message_p203203"
+        ]
+        assert await db_connection.fetchval(
+            "SELECT count(*) FROM forwarded_message_p203203"
+        ) == 1
+        assert await db_connection.fetchval(
+            "SELECT count(*) FROM forwarded_message_default WHERE created_at = $1",
+            created_at,
+        ) == 0
+
+    @pytest.mark.asyncio
+    async def test_drop_partitions(self, db_connection: asyncpg.Connection):
+        manager = ForwardedMessagePartitionManager(db_connection)
+        await manager.create_partitions(
+            months_ahead=1, now=datetime(2031, 5, 17, tzinfo=timezone.utc)
+        )
+        await db_connection.execute(
+            """
+            INSERT INTO forwarded_message
+                (forwarded_message_id, target_chat_id, origin_chat_id, created_at)
+            VALUES ($1, $2, $3, $4)
+            """,
+            13, 37, 42, datetime(2031, 5, 20, tzinfo=timezone.utc),
+        )
+
+        dropped = await manager.drop_partitions(
+            before=datetime(2031, 6, 15, tzinfo=timezone.utc)
+        )
+
+        assert Partition.from_name("forwarded_message_p203105") in dropped
+        assert Partition.from_name("forwarded_message_p203106") not in dropped
+        count = await db_connection.fetchval(
+            "SELECT count(*) FROM forwarded_message WHERE created_at >= $1",
+            datetime(2031, 5, 1, tzinfo=timezone.utc),
+        )
+        assert count == 0
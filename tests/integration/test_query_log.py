@@ -0,0 +1,29 @@
+import logging
+from datetime import datetime, timezone
+
+import asyncpg
+import pytest
+
+from feedback_bot.adapters.query_log import SlowQueryLog
+from feedback_bot.adapters.repositories import target_chat
+
+
+@pytest.mark.asyncio
+async def test_explained_statement_changes_rolled_back(
+    db_connection: asyncpg.Connection, caplog
+):
+    slow_query_log = SlowQueryLog(threshold=0, explain=True)
+    query = target_chat._ADD
+    args = (13, datetime(2021, 1, 1, tzinfo=timezone.utc))
+    await db_connection.execute(query, *args)
+
+    with caplog.at_level(logging.WARNING):
+        await slow_query_log.record(db_connection, "target_chat.add", query, args, 1.0)
+        await slow_query_log.record(
+            db_connection, "target_chat.get_all", target_chat._GET_ALL, (), 1.0
+        )
+
+    # Inserting the same chat again fails, the plan of the query is logged
+    assert "Failed to explain slow statement target_chat.add" in caplog.text
+    assert "Plan of slow statement target_chat.get_all" in caplog.text
+    assert await db_connection.fetchval("SELECT count(*) FROM target_chat") == 1
@@ -1,14 +1,26 @@
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 
 import asyncpg
 import pytest
 
+from feedback_bot.adapters import statements
 from feedback_bot.adapters.repositories.admin import PostgresAdminRepository
 from feedback_bot.adapters.repositories.forwarded_message import (
     PostgresForwardedMessageRepository
 )
+from feedback_bot.adapters.repositories.outbox import PostgresOutboxRepository
 from feedback_bot.adapters.repositories.target_chat import PostgresTargetChatRepository
+from feedback_bot.adapters.repositories.update_offset import (
+    PostgresUpdateOffsetRepository
+)
 from feedback_bot.model import Admin, ForwardedMessage, TargetChat
+from tests.contracts import (
+    AdminRepositoryContract,
+    ForwardedMessageRepositoryContract,
+    OutboxRepositoryContract,
+    TargetChatRepositoryContract,
+    UpdateOffsetRepositoryContract,
+)
 
 
 class TestPostgresAdminRepository:
@@ -183,6 +195,32 @@ class TestPostgresTargetChatRepository:
 
         assert latest_target_chat is None
 
+    @pytest.mark.asyncio
+    async def test_target_chat_repository_get_all(
+        self, db_connection: asyncpg.Connection
+    ):
+        target_chat_1 = TargetChat(
+            chat_id=13, created_at=datetime(2021, 1, 1, tzinfo=timezone.utc)
+        )
+        target_chat_2 = TargetChat(
+            chat_id=37, created_at=datetime(2020, 2, 2, tzinfo=timezone.utc)
+        )
+        await db_connection.executemany(
+            """
+            INSERT INTO target_chat (chat_id, created_at)
+            VALUES ($1, $2)
+            """,
+            [
+                (target_chat_1.chat_id, target_chat_1.created_at),
+                (target_chat_2.chat_id, target_chat_2.created_at),
+            ]
+        )
+
+        target_chat_repository = PostgresTargetChatRepository(db_connection)
+        target_chats = await target_chat_repository.get_all()
+
+        assert set(target_chats) == {target_chat_1, target_chat_2}
+
     @pytest.mark.asyncio
     async def test_target_chat_repository_remove(
         self, db_connection: asyncpg.Connection
@@ -340,3 +378,161 @@ class TestPostgresForwardedMessageRepository:
             forwarded_message_row["created_at"]
             == forwarded_message.created_at
         )
+
+    @pytest.mark.asyncio
+    async def test_forwarded_message_repository_add_many(
+        self, db_connection: asyncpg.Connection
+    ):
+        forwarded_messages = [
+            ForwardedMessage(
+                forwarded_message_id=forwarded_message_id,
+                target_chat_id=37,
+                origin_chat_id=42,
+                created_at=datetime(year=2021, month=1, day=1, tzinfo=timezone.utc),
+            )
+            for forwarded_message_id in (13, 14, 15)
+        ]
+
+        forwarded_message_repository = PostgresForwardedMessageRepository(
+            db_connection
+        )
+        await forwarded_message_repository.add_many(forwarded_messages)
+
+        for forwarded_message in forwarded_messages:
+            saved = await forwarded_message_repository.get(
+                forwarded_message_id=forwarded_message.forwarded_message_id,
+                target_chat_id=forwarded_message.target_chat_id,
+            )
+            assert saved == forwarded_message
+            assert saved.origin_chat_id == forwarded_message.origin_chat_id
+
+    @pytest.mark.asyncio
+    async def test_forwarded_message_repository_duplicate_key(
+        self, db_connection: asyncpg.Connection
+    ):
+        """The primary key includes created_at, so the same message can be
+        added twice with different times. The latest one is returned.
+        """
+        earlier, later = [
+            ForwardedMessage(
+                forwarded_message_id=13,
+                target_chat_id=37,
+                origin_chat_id=origin_chat_id,
+                created_at=datetime(2021, 1, day, tzinfo=timezone.utc),
+            )
+            for origin_chat_id, day in ((42, 1), (43, 2))
+        ]
+        forwarded_message_repository = PostgresForwardedMessageRepository(
+            db_connection
+        )
+        await forwarded_message_repository.add(earlier)
+        await forwarded_message_repository.add(later)
+
+        saved = await forwarded_message_repository.get(
+            forwarded_message_id=13, target_chat_id=37
+        )
+        assert saved.origin_chat_id == later.origin_chat_id
+        assert not await forwarded_message_repository.add_if_absent(later)
+
+    @pytest.mark.asyncio
+    async def test_forwarded_message_repository_lookup_window(
+        self, db_connection: asyncpg.Connection
+    ):
+        now = datetime.now(timezone.utc)
+        forwarded_message_repository = PostgresForwardedMessageRepository(
+            db_connection, lookup_window=timedelta(days=30)
+        )
+        await forwarded_message_repository.add_many(
+            [
+                ForwardedMessage(
+                    forwarded_message_id=forwarded_message_id,
+                    target_chat_id=37,
+                    origin_chat_id=42,
+                    created_at=now - timedelta(days=age),
+                )
+                for forwarded_message_id, age in ((13, 1), (14, 60))
+            ]
+        )
+
+        assert await forwarded_message_repository.get(
+            forwarded_message_id=13, target_chat_id=37
+        )
+        assert (
+            await forwarded_message_repository.get(
+                forwarded_message_id=14, target_chat_id=37
+            )
+            is None
+        )
+
+
+class TestPostgresUpdateOffsetRepository:
+    @pytest.mark.asyncio
+    async def test_update_offset_repository_get_not_found(
+        self, db_connection: asyncpg.Connection
+    ):
+        update_offset_repository = PostgresUpdateOffsetRepository(db_connection)
+        assert await update_offset_repository.get(bot_id=13) is None
+
+    @pytest.mark.asyncio
+    async def test_update_offset_repository_save(
+        self, db_connection: asyncpg.Connection
+    ):
+        update_offset_repository = PostgresUpdateOffsetRepository(db_connection)
+        await update_offset_repository.save(bot_id=13, update_offset=100)
+        await update_offset_repository.save(bot_id=37, update_offset=5)
+        await update_offset_repository.save(bot_id=13, update_offset=142)
+
+        assert await update_offset_repository.get(bot_id=13) == 142
+        assert await update_offset_repository.get(bot_id=37) == 5
+
+
+@pytest.mark.asyncio
+async def test_all_statements_prepare(db_connection: asyncpg.Connection):
+    assert await statements.prepare_all(db_connection) == []
+
+
+@pytest.fixture
+def target_chat_repository(db_connection: asyncpg.Connection):
+    return PostgresTargetChatRepository(db_connection)
+
+
+@pytest.fixture
+def admin_repository(db_connection: asyncpg.Connection):
+    return PostgresAdminRepository(db_connection)
+
+
+@pytest.fixture
+def forwarded_message_repository(db_connection: asyncpg.Connection):
+    return PostgresForwardedMessageRepository(db_connection)
+
+
+@pytest.fixture
+def update_offset_repository(db_connection: asyncpg.Connection):
+    return PostgresUpdateOffsetRepository(db_connection)
+
+
+@pytest.fixture
+def outbox_repository(db_connection: asyncpg.Connection):
+    return PostgresOutboxRepository(db_connection)
+
+
+class TestPostgresTargetChatRepositoryContract(TargetChatRepositoryContract):
+    pass
+
+
+class TestPostgresAdminRepositoryContract(AdminRepositoryContract):
+    pass
+
+
+class TestPostgresForwardedMessageRepositoryContract(
+    ForwardedMessageRepositoryContract
+):
+    pass
+
+
+class TestPostgresUpdateOffsetRepositoryContract(UpdateOffsetRepositoryContract):
+    pass
+
+
+class TestPostgresOutboxRepositoryContract(OutboxRepositoryContract):
+    pass
@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta, timezone
+
+import asyncpg
+import pytest
+
+from feedback_bot.service_layer.retention import ForwardedMessageRetention
+
+
+@pytest.fixture
+async def pool(container, create_test_db):
+    async with asyncpg.create_pool(
+        dsn=container.config.DATABASE_URL(), min_size=1, max_size=2
+    ) as pool:
+        yield pool
+        async with pool.acquire() as conn:
+            await conn.execute("DELETE FROM forwarded_message")
+
+
+class TestForwardedMessageRetention:
+    @pytest.mark.asyncio
+    async def test_prune_removes_expired_messages(self, pool: asyncpg.Pool):
+        now = datetime.now(timezone.utc)
+        async with pool.acquire() as conn:
+            await conn.executemany(
+                """
+                INSERT INTO forwarded_message
+                    (forwarded_message_id, target_chat_id, origin_chat_id, created_at)
+                VALUES ($1, $2, $3, $4)
+                """,
+                [
+                    (message_id, 13, 37, now - timedelta(days=10, minutes=message_id))
+                    for message_id in range(5)
+                ] + [(100, 13, 37, now)],
+            )
+
+        retention = ForwardedMessageRetention(
+            pool=pool,
+            retention=timedelta(days=1),
+            interval=60,
+            batch_size=2,
+            batch_pause=0,
+        )
+        deleted = await retention.prune(now=now)
+
+        assert deleted == 5
+        async with pool.acquire() as conn:
+            remaining = await conn.fetch(
+                "SELECT forwarded_message_id FROM forwarded_message"
+            )
+        assert [row["forwarded_message_id"] for row in remaining] == [100]
+
+    @pytest.mark.asyncio
+    async def test_prune_dry_run_keeps_messages(self, pool: asyncpg.Pool):
+        now = datetime.now(timezone.utc)
+        async with pool.acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO forwarded_message
+                    (forwarded_message_id, target_chat_id, origin_chat_id, created_at)
+                VALUES ($1, $2, $3, $4)
+                """,
+                1, 13, 37, now - timedelta(days=10),
+            )
+
+        retention = ForwardedMessageRetention(
+            pool=pool,
+            retention=timedelta(days=1),
+            interval=60,
+            batch_size=2,
+            batch_pause=0,
+            dry_run=True,
+        )
+        await retention.prune(now=now)
+
+        async with pool.acquire() as conn:
+            count = await conn.fetchval("SELECT count(*) FROM forwarded_message")
+        assert count == 1
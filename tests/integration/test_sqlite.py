@@ -0,0 +1,312 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+from feedback_bot.adapters.repositories.admin import (
+    AdminDirectory,
+    SqliteAdminRepository,
+)
+from feedback_bot.adapters.repositories.forwarded_message import (
+    SqliteForwardedMessageRepository
+)
+from feedback_bot.adapters.repositories.outbox import SqliteOutboxRepository
+from feedback_bot.adapters.repositories.target_chat import (
+    SqliteTargetChatRepository,
+    TargetChatRegistry,
+)
+from feedback_bot.adapters.repositories.update_offset import (
+    SqliteUpdateOffsetRepository
+)
+from feedback_bot.adapters.sqlite import (
+    SqliteDatabase,
+    SqliteTransaction,
+    from_timestamp,
+    migrate,
+    to_timestamp,
+)
+from feedback_bot.bootstrap import sqlite_outbox_transactions
+from feedback_bot.model import Admin, TargetChat
+from feedback_bot.service_layer import services
+from feedback_bot.service_layer.outbox import (
+    ForwardMessage,
+    OutboxDispatcher,
+    SendMessage,
+)
+from feedback_bot.service_layer.unit_of_work import SqliteUnitOfWork
+from tests.contracts import (
+    AdminRepositoryContract,
+    ForwardedMessageRepositoryContract,
+    OutboxRepositoryContract,
+    TargetChatRepositoryContract,
+    UpdateOffsetRepositoryContract,
+)
+from tests.fakes import FakeSentMessage, FakeTelegramAPI
+
+
+@pytest.fixture
+async def sqlite_database(tmp_path):
+    database = SqliteDatabase(str(tmp_path / "feedback_bot.sqlite3"))
+    await database.open()
+    try:
+        yield database
+    finally:
+        await database.close()
+
+
+@pytest.fixture
+async def sqlite_transaction(sqlite_database):
+    async with SqliteTransaction(sqlite_database) as transaction:
+        yield transaction
+
+
+@pytest.fixture
+def target_chat_repository(sqlite_transaction):
+    return SqliteTargetChatRepository(sqlite_transaction)
+
+
+@pytest.fixture
+def admin_repository(sqlite_transaction):
+    return SqliteAdminRepository(sqlite_transaction)
+
+
+@pytest.fixture
+def forwarded_message_repository(sqlite_transaction):
+    return SqliteForwardedMessageRepository(sqlite_transaction)
+
+
+@pytest.fixture
+def update_offset_repository(sqlite_transaction):
+    return SqliteUpdateOffsetRepository(sqlite_transaction)
+
+
+@pytest.fixture
+def outbox_repository(sqlite_transaction):
+    return SqliteOutboxRepository(sqlite_transaction)
+
+
+class TestSqliteTargetChatRepositoryContract(TargetChatRepositoryContract):
+    pass
+
+
+class TestSqliteAdminRepositoryContract(AdminRepositoryContract):
+    pass
+
+
+class TestSqliteForwardedMessageRepositoryContract(
+    ForwardedMessageRepositoryContract
+):
+    pass
+
+
+class TestSqliteUpdateOffsetRepositoryContract(UpdateOffsetRepositoryContract):
+    pass
+
+
+class TestSqliteOutboxRepositoryContract(OutboxRepositoryContract):
+    pass
+
+
+def test_timestamp_round_trip():
+    dt = datetime(2021, 1, 1, 12, 30, 15, 123456, timezone.utc)
+
+    assert from_timestamp(to_timestamp(dt)) == dt
+    assert to_timestamp(dt.replace(tzinfo=None)) == to_timestamp(dt)
+
+
+@pytest.mark.asyncio
+async def test_database_uses_wal(sqlite_database: SqliteDatabase):
+    def pragmas(conn):
+        journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        foreign_keys = conn.execute("PRAGMA foreign_keys").fetchone()[0]
+        return journal_mode, foreign_keys
+
+    assert await sqlite_database.run(pragmas) == ("wal", 1)
+
+
+@pytest.mark.asyncio
+async def test_migrate_is_idempotent(sqlite_database: SqliteDatabase):
+    assert await sqlite_database.run(migrate) == await sqlite_database.run(migrate)
+
+
+def _uow(database: SqliteDatabase, telegram_api: FakeTelegramAPI, **kwargs):
+    return SqliteUnitOfWork(
+        outbox_dispatcher=OutboxDispatcher(
+            telegram_api, transactions=sqlite_outbox_transactions(database)
+        ),
+        database=database,
+        **kwargs,
+    )
+
+
+@pytest.mark.asyncio
+async def test_uow_commit(sqlite_database: SqliteDatabase):
+    telegram_api = FakeTelegramAPI()
+    target_chat = TargetChat(chat_id=13)
+
+    uow = _uow(sqlite_database, telegram_api)
+    async with uow:
+        await uow.target_chats.add(target_chat)
+        uow.outbox.add(SendMessage(to_chat_id=13, text="Hello"))
+        await uow.commit()
+
+    uow = _uow(sqlite_database, telegram_api)
+    async with uow:
+        assert await uow.target_chats.get(13) == target_chat
+
+    assert telegram_api.sent_messages == [FakeSentMessage(to_chat_id=13, text="Hello")]
+
+
+@pytest.mark.asyncio
+async def test_uow_forwarded_message_saved_once_sent(sqlite_database: SqliteDatabase):
+    telegram_api = FakeTelegramAPI()
+
+    uow = _uow(sqlite_database, telegram_api)
+    async with uow:
+        uow.outbox.add(ForwardMessage(from_chat_id=42, to_chat_id=13, message_id=1))
+        await uow.commit()
+
+    uow = _uow(sqlite_database, telegram_api)
+    async with uow:
+        forwarded_message = await uow.forwarded_messages.get(
+            forwarded_message_id=telegram_api.FAKE_FORWARDED_MESSAGE_ID,
+            target_chat_id=13,
+        )
+        assert forwarded_message.origin_chat_id == 42
+        assert await SqliteOutboxRepository(uow._conn).claim(
+            now=datetime.max.replace(tzinfo=timezone.utc),
+            leased_until=datetime.max.replace(tzinfo=timezone.utc),
+            limit=10,
+        ) == []
+
+
+@pytest.mark.asyncio
+async def test_uow_rolls_back_without_commit(sqlite_database: SqliteDatabase):
+    telegram_api = FakeTelegramAPI()
+
+    uow = _uow(sqlite_database, telegram_api)
+    async with uow:
+        await uow.target_chats.add(TargetChat(chat_id=13))
+        uow.outbox.add(SendMessage(to_chat_id=13, text="Hello"))
+
+    uow = _uow(sqlite_database, telegram_api)
+    async with uow:
+        assert await uow.target_chats.get(13) is None
+
+    assert telegram_api.sent_messages == []
+
+
+@pytest.mark.asyncio
+async def test_uows_take_turns(sqlite_database: SqliteDatabase):
+    telegram_api = FakeTelegramAPI()
+    first_started = asyncio.Event()
+    finish_first = asyncio.Event()
+
+    async def first():
+        uow = _uow(sqlite_database, telegram_api)
+        async with uow:
+            await uow.target_chats.add(TargetChat(chat_id=13))
+            first_started.set()
+            await finish_first.wait()
+            await uow.commit()
+
+    task = asyncio.ensure_future(first())
+    await first_started.wait()
+
+    uow = _uow(sqlite_database, telegram_api, lock_timeout=0.01)
+    async with uow:
+        with pytest.raises(asyncio.TimeoutError):
+            await uow.target_chats.get(13)
+
+    finish_first.set()
+    await task
+
+    uow = _uow(sqlite_database, telegram_api, lock_timeout=1)
+    async with uow:
+        assert await uow.target_chats.get(13) is not None
+
+
+@pytest.mark.asyncio
+async def test_lock_not_leaked_by_cancelled_transaction(
+    sqlite_database: SqliteDatabase,
+):
+    await sqlite_database.lock.acquire()
+    transaction = SqliteTransaction(sqlite_database, lock_timeout=1)
+    task = asyncio.ensure_future(transaction.fetchval("SELECT 1"))
+    await asyncio.sleep(0)
+
+    # Cancelled as the lock is handed over to the transaction
+    sqlite_database.lock.release()
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    await transaction.release()
+    await asyncio.sleep(0)
+
+    assert not sqlite_database.lock.locked()
+
+
+@pytest.mark.asyncio
+async def test_load_caches(sqlite_database: SqliteDatabase):
+    telegram_api = FakeTelegramAPI()
+    target_chat = TargetChat(chat_id=13)
+    uow = _uow(sqlite_database, telegram_api)
+    async with uow:
+        await uow.target_chats.add(target_chat)
+        await uow.commit()
+
+    target_chat_registry = TargetChatRegistry()
+    admin_directory = AdminDirectory()
+    await services.load_caches(
+        uow=_uow(
+            sqlite_database,
+            telegram_api,
+            target_chat_registry=target_chat_registry,
+            admin_directory=admin_directory,
+        )
+    )
+
+    assert target_chat_registry.loaded
+    assert target_chat_registry.get(13) == target_chat
+    assert admin_directory.loaded
+
+
+@pytest.mark.asyncio
+async def test_caches_not_loaded_with_uncommitted_changes(
+    sqlite_database: SqliteDatabase,
+):
+    telegram_api = FakeTelegramAPI()
+    admin = Admin(user_id=1, target_chat=TargetChat(chat_id=13))
+    group_chat = TargetChat(chat_id=-42)
+    uow = _uow(sqlite_database, telegram_api)
+    async with uow:
+        await uow.admins.add(admin)
+        await uow.target_chats.add(group_chat)
+        await uow.commit()
+
+    target_chat_registry = TargetChatRegistry()
+    admin_directory = AdminDirectory()
+    uow = _uow(
+        sqlite_database,
+        telegram_api,
+        target_chat_registry=target_chat_registry,
+        admin_directory=admin_directory,
+    )
+    async with uow:
+        assert await uow.target_chats.remove(group_chat.chat_id)
+        assert await uow.admins.get_all() == [admin]
+        assert await uow.target_chats.get_latest() == admin.target_chat
+        # Rolled back
+    assert not target_chat_registry.loaded
+    assert not admin_directory.loaded
+
+    uow = _uow(
+        sqlite_database,
+        telegram_api,
+        target_chat_registry=target_chat_registry,
+        admin_directory=admin_directory,
+    )
+    async with uow:
+        assert await uow.target_chats.get(group_chat.chat_id) == group_chat
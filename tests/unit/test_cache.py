@@ -0,0 +1,246 @@
+import asyncio
+from datetime import datetime, timezone
+from typing import Dict, List
+
+import pytest
+
+from feedback_bot.adapters.cache import SingleFlight
+from feedback_bot.adapters.repositories.admin import (
+    AbstractAdminRepository,
+    AdminDirectory,
+    CachedAdminRepository,
+)
+from feedback_bot.adapters.repositories.target_chat import (
+    AbstractTargetChatRepository,
+    CachedTargetChatRepository,
+    TargetChatRegistry,
+)
+from feedback_bot.model import Admin, TargetChat
+
+
+class CountingTargetChatRepository(AbstractTargetChatRepository):
+    def __init__(self, target_chats: Dict[int, TargetChat]):
+        self._target_chats = target_chats
+        self.get_all_calls = 0
+
+    async def get(self, chat_id: int):
+        raise AssertionError("Reads should be served from the registry")
+
+    async def get_latest(self):
+        raise AssertionError("Reads should be served from the registry")
+
+    async def get_all(self) -> List[TargetChat]:
+        self.get_all_calls += 1
+        await asyncio.sleep(0)
+        return list(self._target_chats.values())
+
+    async def remove(self, chat_id: int):
+        return self._target_chats.pop(chat_id, None)
+
+    async def add(self, target_chat: TargetChat):
+        self._target_chats[target_chat.chat_id] = target_chat
+
+
+class CountingAdminRepository(AbstractAdminRepository):
+    def __init__(self, admins: Dict[int, Admin]):
+        self._admins = admins
+        self.get_all_calls = 0
+
+    async def get(self, user_id: int):
+        raise AssertionError("Reads should be served from the directory")
+
+    async def get_all(self) -> List[Admin]:
+        self.get_all_calls += 1
+        await asyncio.sleep(0)
+        return list(self._admins.values())
+
+    async def add(self, admin: Admin):
+        self._admins[admin.user_id] = admin
+
+
+class TestSingleFlight:
+    @pytest.mark.asyncio
+    async def test_concurrent_calls_share_load(self):
+        single_flight = SingleFlight()
+        calls = 0
+
+        async def load():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0)
+            return calls
+
+        results = await asyncio.gather(
+            *(single_flight.do("key", load) for _ in range(10))
+        )
+
+        assert calls == 1
+        assert results == [1] * 10
+
+    @pytest.mark.asyncio
+    async def test_failed_load_is_retried(self):
+        single_flight = SingleFlight()
+
+        async def fail():
+            raise RuntimeError
+
+        async def succeed():
+            return 42
+
+        with pytest.raises(RuntimeError):
+            await single_flight.do("key", fail)
+
+        assert await single_flight.do("key", succeed) == 42
+
+
+class TestCachedTargetChatRepository:
+    @pytest.mark.asyncio
+    async def test_cold_start_loads_once(self):
+        target_chat = TargetChat(chat_id=42)
+        repository = CountingTargetChatRepository({42: target_chat})
+        registry = TargetChatRegistry()
+
+        cached_repositories = [
+            CachedTargetChatRepository(repository=repository, registry=registry)
+            for _ in range(10)
+        ]
+        results = await asyncio.gather(
+            *(cached.get_latest() for cached in cached_repositories)
+        )
+
+        assert repository.get_all_calls == 1
+        assert results == [target_chat] * 10
+
+    @pytest.mark.asyncio
+    async def test_get_latest(self):
+        latest = TargetChat(chat_id=13, created_at=datetime(2021, 2, 2, tzinfo=timezone.utc))
+        older = TargetChat(chat_id=37, created_at=datetime(2021, 1, 1, tzinfo=timezone.utc))
+        repository = CountingTargetChatRepository({13: latest, 37: older})
+        cached = CachedTargetChatRepository(
+            repository=repository, registry=TargetChatRegistry()
+        )
+
+        assert await cached.get_latest() == latest
+        assert await cached.get(37) == older
+        assert await cached.get(42) is None
+        assert repository.get_all_calls == 1
+
+    @pytest.mark.asyncio
+    async def test_changes_published_after_commit(self):
+        existing = TargetChat(chat_id=13, created_at=datetime(2021, 1, 1, tzinfo=timezone.utc))
+        added = TargetChat(chat_id=37, created_at=datetime(2021, 2, 2, tzinfo=timezone.utc))
+        repository = CountingTargetChatRepository({13: existing})
+        registry = TargetChatRegistry()
+
+        writer = CachedTargetChatRepository(repository=repository, registry=registry)
+        reader = CachedTargetChatRepository(repository=repository, registry=registry)
+        await reader.get_latest()
+
+        await writer.add(added)
+        assert await writer.get_latest() == added
+        assert await reader.get_latest() == existing
+
+        await writer.publish()
+        assert await reader.get_latest() == added
+
+        writer = CachedTargetChatRepository(repository=repository, registry=registry)
+        await writer.remove(added.chat_id)
+        assert await writer.get(added.chat_id) is None
+        assert await reader.get(added.chat_id) == added
+
+        await writer.publish()
+        assert await reader.get(added.chat_id) is None
+        assert await reader.get_latest() == existing
+        assert repository.get_all_calls == 1
+
+    @pytest.mark.asyncio
+    async def test_discarded_changes_not_published(self):
+        repository = CountingTargetChatRepository({})
+        registry = TargetChatRegistry()
+
+        reader = CachedTargetChatRepository(repository=repository, registry=registry)
+        await reader.get_latest()
+
+        writer = CachedTargetChatRepository(repository=repository, registry=registry)
+        await writer.add(TargetChat(chat_id=42))
+
+        assert await reader.get(42) is None
+        assert await reader.get_latest() is None
+
+
+    @pytest.mark.asyncio
+    async def test_not_loaded_with_uncommitted_changes(self):
+        existing = TargetChat(chat_id=13)
+        repository = CountingTargetChatRepository(
+            {13: existing, 37: TargetChat(chat_id=37)}
+        )
+        registry = TargetChatRegistry()
+
+        writer = CachedTargetChatRepository(repository=repository, registry=registry)
+        await writer.remove(37)
+
+        # The snapshot would include the uncommitted removal
+        assert await writer.get_all() == [existing]
+        assert not registry.loaded
+
+
+class TestCachedAdminRepository:
+    @pytest.mark.asyncio
+    async def test_reads_served_from_directory(self):
+        admin = Admin(user_id=42, target_chat=TargetChat(chat_id=13))
+        repository = CountingAdminRepository({42: admin})
+        directory = AdminDirectory()
+
+        results = await asyncio.gather(
+            *(
+                CachedAdminRepository(repository=repository, directory=directory).get(42)
+                for _ in range(5)
+            )
+        )
+        cached = CachedAdminRepository(repository=repository, directory=directory)
+        assert await cached.get(13) is None
+        assert await cached.get_all() == [admin]
+
+        assert results == [admin] * 5
+        assert repository.get_all_calls == 1
+        assert directory.misses == 5
+        assert directory.hits == 2
+
+    @pytest.mark.asyncio
+    async def test_added_admin_published_after_commit(self):
+        repository = CountingAdminRepository({})
+        directory = AdminDirectory()
+
+        reader = CachedAdminRepository(repository=repository, directory=directory)
+        assert await reader.get_all() == []
+
+        admin = Admin(user_id=42, target_chat=TargetChat(chat_id=13))
+        writer = CachedAdminRepository(repository=repository, directory=directory)
+        await writer.add(admin)
+
+        assert await writer.get(42) == admin
+        assert await reader.get(42) is None
+
+        await writer.publish()
+        assert await reader.get(42) == admin
+        assert repository.get_all_calls == 1
+
+    @pytest.mark.asyncio
+    async def test_not_loaded_with_uncommitted_changes(self):
+        repository = CountingAdminRepository({})
+        directory = AdminDirectory()
+        pending_changes = True
+
+        admin = Admin(user_id=42, target_chat=TargetChat(chat_id=13))
+        writer = CachedAdminRepository(
+            repository=repository,
+            directory=directory,
+            has_changes=lambda: pending_changes,
+        )
+        assert await writer.get_all() == []
+        assert not directory.loaded
+
+        await writer.add(admin)
+        pending_changes = False
+        assert await writer.get_all() == [admin]
+        assert not directory.loaded
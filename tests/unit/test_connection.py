@@ -0,0 +1,136 @@
+import asyncio
+from typing import List
+
+import pytest
+
+from feedback_bot.adapters.connection import LazyConnection
+from feedback_bot.service_layer.outbox import OutboxDispatcher
+from feedback_bot.service_layer.unit_of_work import PostgresUnitOfWork
+
+
+class FakeTransaction:
+    def __init__(self, events: List[str]):
+        self._events = events
+
+    async def start(self):
+        self._events.append("begin")
+
+    async def commit(self):
+        self._events.append("commit")
+
+    async def rollback(self):
+        self._events.append("rollback")
+
+    async def __aenter__(self):
+        await self.start()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await (self.commit() if exc_type is None else self.rollback())
+
+
+class FakeConnection:
+    def __init__(self, events: List[str]):
+        self._events = events
+
+    def transaction(self):
+        return FakeTransaction(self._events)
+
+    async def fetchval(self, query, *args):
+        self._events.append(query)
+        return 1
+
+
+class FakePool:
+    def __init__(self):
+        self.events: List[str] = []
+
+    async def acquire(self, timeout=None):
+        await asyncio.sleep(0)
+        self.events.append("acquire")
+        return FakeConnection(self.events)
+
+    async def release(self, conn):
+        self.events.append("release")
+
+
+@pytest.mark.asyncio
+async def test_connection_acquired_on_first_query():
+    pool = FakePool()
+    conn = LazyConnection(pool)
+    assert pool.events == []
+
+    assert await conn.fetchval("SELECT 1") == 1
+    assert await conn.fetchval("SELECT 2") == 1
+    await conn.commit()
+    await conn.release()
+
+    assert pool.events == [
+        "acquire", "begin", "SELECT 1", "SELECT 2", "commit", "release"
+    ]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_queries_acquire_single_connection():
+    pool = FakePool()
+    conn = LazyConnection(pool)
+
+    await asyncio.gather(conn.fetchval("SELECT 1"), conn.fetchval("SELECT 2"))
+    await conn.release()
+
+    assert pool.events.count("acquire") == 1
+    assert pool.events.count("release") == 1
+
+
+@pytest.mark.asyncio
+async def test_unit_of_work_without_queries_does_not_acquire_connection():
+    pool = FakePool()
+
+    uow = PostgresUnitOfWork(outbox_dispatcher=OutboxDispatcher(None, transactions=None), pool=pool)
+    async with uow:
+        await uow.commit()
+    async with PostgresUnitOfWork(outbox_dispatcher=OutboxDispatcher(None, transactions=None), pool=pool):
+        pass
+
+    assert pool.events == []
+
+
+@pytest.mark.asyncio
+async def test_unit_of_work_releases_connection_after_rollback():
+    pool = FakePool()
+
+    uow = PostgresUnitOfWork(outbox_dispatcher=OutboxDispatcher(None, transactions=None), pool=pool)
+    async with uow:
+        await uow._conn.fetchval("SELECT 1")
+
+    assert pool.events == ["acquire", "begin", "SELECT 1", "rollback", "release"]
+
+
+@pytest.mark.asyncio
+async def test_connection_context_rolls_back_on_error():
+    pool = FakePool()
+
+    with pytest.raises(RuntimeError):
+        async with LazyConnection(pool) as conn:
+            await conn.fetchval("SELECT 1")
+            raise RuntimeError()
+    async with LazyConnection(pool) as conn:
+        await conn.fetchval("SELECT 2")
+
+    assert pool.events == [
+        "acquire", "begin", "SELECT 1", "rollback", "release",
+        "acquire", "begin", "SELECT 2", "commit", "release",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_autocommit_connection_runs_explicit_transactions():
+    pool = FakePool()
+
+    async with LazyConnection(pool, autocommit=True) as conn:
+        await conn.fetchval("SELECT 1")
+        async with conn.transaction():
+            await conn.fetchval("SELECT 2")
+
+    assert pool.events == [
+        "acquire", "SELECT 1", "begin", "SELECT 2", "commit", "release"
+    ]
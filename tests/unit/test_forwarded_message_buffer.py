@@ -0,0 +1,225 @@
+import asyncio
+from typing import List, Set
+
+import asyncpg
+import pytest
+
+from feedback_bot.adapters.repositories.forwarded_message import (
+    AbstractForwardedMessageRepository,
+    BufferedForwardedMessageRepository,
+    ForwardedMessageWriteBuffer,
+)
+from feedback_bot.model import ForwardedMessage
+
+
+class FakeTransaction:
+    async def start(self):
+        pass
+
+    async def commit(self):
+        pass
+
+    async def rollback(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self):
+        self.copied_records: List[list] = []
+        self.inserted: List[tuple] = []
+        self.removed_outbox_ids: List[int] = []
+        # IDs of forwarded messages the database rejects
+        self.rejected_ids: Set[int] = set()
+
+    async def copy_records_to_table(self, table_name, *, records, columns):
+        records = list(records)
+        if any(record[0] in self.rejected_ids for record in records):
+            raise asyncpg.CheckViolationError("no partition of relation found for row")
+        self.copied_records.append(records)
+
+    def transaction(self):
+        return FakeTransaction()
+
+    async def execute(self, query, *args):
+        if query.lstrip().startswith("DELETE"):
+            self.removed_outbox_ids.extend(args[0])
+            return f"DELETE {len(args[0])}"
+        if args[0] in self.rejected_ids:
+            raise asyncpg.CheckViolationError("no partition of relation found for row")
+        if any(row[:2] == args[:2] for row in self.inserted):
+            return "INSERT 0 0"
+        self.inserted.append(args)
+        return "INSERT 0 1"
+
+
+class FakePool:
+    def __init__(self):
+        self.conn = FakeConnection()
+        self.available = True
+
+    async def acquire(self, timeout=None):
+        if not self.available:
+            raise ConnectionRefusedError("Database is unavailable")
+        return self.conn
+
+    async def release(self, conn):
+        pass
+
+
+class NoForwardedMessagesRepository(AbstractForwardedMessageRepository):
+    async def get(self, forwarded_message_id: int, target_chat_id: int):
+        return None
+
+    async def add(self, forwarded_message: ForwardedMessage):
+        raise AssertionError("Writes should go to the buffer")
+
+
+def _forwarded_message(forwarded_message_id: int) -> ForwardedMessage:
+    return ForwardedMessage(
+        forwarded_message_id=forwarded_message_id,
+        target_chat_id=13,
+        origin_chat_id=37,
+    )
+
+
+class TestForwardedMessageWriteBuffer:
+    @pytest.mark.asyncio
+    async def test_flushed_when_batch_size_reached(self):
+        pool = FakePool()
+        buffer = ForwardedMessageWriteBuffer(
+            pool=pool, batch_size=3, max_size=10, flush_interval=60,
+        )
+
+        await buffer.put([_forwarded_message(1), _forwarded_message(2)])
+        await asyncio.sleep(0)
+        assert not pool.conn.copied_records
+
+        await buffer.put([_forwarded_message(3)])
+        await asyncio.sleep(0)
+        assert len(pool.conn.copied_records) == 1
+        assert len(pool.conn.copied_records[0]) == 3
+        assert len(buffer) == 0
+
+    @pytest.mark.asyncio
+    async def test_flushed_on_close(self):
+        pool = FakePool()
+        buffer = ForwardedMessageWriteBuffer(
+            pool=pool, batch_size=100, max_size=100, flush_interval=60,
+        )
+        buffer.start()
+
+        forwarded_message = _forwarded_message(1)
+        await buffer.put([forwarded_message])
+        await buffer.close()
+
+        assert pool.conn.copied_records == [
+            [(1, 13, 37, forwarded_message.created_at)],
+        ]
+        assert len(buffer) == 0
+
+    @pytest.mark.asyncio
+    async def test_unwritten_messages_dropped_on_close(self):
+        pool = FakePool()
+        pool.available = False
+        buffer = ForwardedMessageWriteBuffer(
+            pool=pool, batch_size=100, max_size=100, flush_interval=60,
+        )
+        buffer.start()
+
+        await buffer.put(
+            [_forwarded_message(1), _forwarded_message(2)], outbox_ids=[101, 102]
+        )
+        # Doesn't raise, so the rest of the resources are shut down
+        assert await buffer.close() == 2
+
+        assert len(buffer) == 0
+        # The commands are left to be sent again
+        assert not pool.conn.removed_outbox_ids
+
+    @pytest.mark.asyncio
+    async def test_put_waits_for_flush_when_full(self):
+        pool = FakePool()
+        buffer = ForwardedMessageWriteBuffer(
+            pool=pool, batch_size=100, max_size=2, flush_interval=60,
+        )
+
+        await buffer.put([_forwarded_message(i) for i in range(5)])
+
+        assert sum(len(records) for records in pool.conn.copied_records) == 4
+        assert len(buffer) == 1
+
+    @pytest.mark.asyncio
+    async def test_rejected_row_doesnt_fail_batch(self):
+        pool = FakePool()
+        pool.conn.rejected_ids = {2}
+        buffer = ForwardedMessageWriteBuffer(
+            pool=pool, batch_size=100, max_size=100, flush_interval=60,
+        )
+
+        await buffer.put([_forwarded_message(i) for i in range(1, 4)])
+        await buffer.flush()
+
+        assert not pool.conn.copied_records
+        assert [row[0] for row in pool.conn.inserted] == [1, 3]
+        assert len(buffer) == 0
+
+    @pytest.mark.asyncio
+    async def test_outbox_commands_removed_with_written_messages(self):
+        pool = FakePool()
+        pool.conn.rejected_ids = {2}
+        buffer = ForwardedMessageWriteBuffer(
+            pool=pool, batch_size=100, max_size=100, flush_interval=60,
+        )
+
+        await buffer.put([_forwarded_message(1)], outbox_ids=[101])
+        await buffer.flush()
+        await buffer.put(
+            [_forwarded_message(2), _forwarded_message(3)], outbox_ids=[102, 103]
+        )
+        await buffer.flush()
+
+        # The command of the rejected message isn't left to be sent again
+        assert pool.conn.removed_outbox_ids == [101, 102, 103]
+
+    @pytest.mark.asyncio
+    async def test_dropped_after_max_attempts(self):
+        pool = FakePool()
+        pool.available = False
+        buffer = ForwardedMessageWriteBuffer(
+            pool=pool, batch_size=100, max_size=1, flush_interval=0.001,
+            max_attempts=3,
+        )
+
+        # Doesn't raise, the messages are committed already
+        await buffer.put([_forwarded_message(1), _forwarded_message(2)])
+
+        # The first message has been dropped to make space for the second
+        assert len(buffer) == 1
+        for _ in range(3):
+            with pytest.raises(ConnectionRefusedError):
+                await buffer.flush()
+        assert len(buffer) == 0
+
+
+class TestBufferedForwardedMessageRepository:
+    @pytest.mark.asyncio
+    async def test_buffered_message_found(self):
+        buffer = ForwardedMessageWriteBuffer(
+            pool=FakePool(), batch_size=100, max_size=100, flush_interval=60,
+        )
+        forwarded_message = _forwarded_message(42)
+
+        writer = BufferedForwardedMessageRepository(
+            repository=NoForwardedMessagesRepository(), buffer=buffer
+        )
+        await writer.add(forwarded_message)
+        await writer.publish()
+
+        reader = BufferedForwardedMessageRepository(
+            repository=NoForwardedMessagesRepository(), buffer=buffer
+        )
+        found = await reader.get(
+            forwarded_message_id=forwarded_message.forwarded_message_id,
+            target_chat_id=forwarded_message.target_chat_id,
+        )
+        assert found == forwarded_message
@@ -0,0 +1,193 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from typing import List
+
+import pytest
+from dependency_injector import providers
+
+from feedback_bot import bot
+from feedback_bot.adapters.invalidation import CHANNEL, CacheInvalidationBus
+from feedback_bot.adapters.repositories.admin import (
+    AdminDirectory,
+    CachedAdminRepository,
+)
+from feedback_bot.adapters.repositories.target_chat import (
+    CachedTargetChatRepository,
+    TargetChatRegistry,
+)
+from feedback_bot.model import Admin, TargetChat
+from tests.fakes import InMemoryUnitOfWork
+
+
+class FakeListenerConnection:
+    def __init__(self):
+        self.listeners = {}
+        self.termination_listeners = []
+        self.closed = False
+
+    def add_termination_listener(self, callback):
+        self.termination_listeners.append(callback)
+
+    async def add_listener(self, channel, callback):
+        self.listeners[channel] = callback
+
+    async def execute(self, query, *args):
+        return "SELECT 1"
+
+    def is_closed(self):
+        return self.closed
+
+    def terminate(self):
+        self.closed = True
+
+    def notify(self, payload: dict):
+        self.listeners[CHANNEL](self, 1, CHANNEL, json.dumps(payload))
+
+    def lose_connection(self):
+        self.closed = True
+        for callback in self.termination_listeners:
+            callback(self)
+
+
+class FakeConnect:
+    def __init__(self):
+        self.connections: List[FakeListenerConnection] = []
+        self.connected = asyncio.Event()
+
+    async def __call__(self, dsn):
+        conn = FakeListenerConnection()
+        self.connections.append(conn)
+        self.connected.set()
+        return conn
+
+    async def wait_connected(self) -> FakeListenerConnection:
+        await self.connected.wait()
+        self.connected.clear()
+        # Let the listener subscribe
+        await asyncio.sleep(0)
+        return self.connections[-1]
+
+
+async def _loaded_registries():
+    target_chat = TargetChat(chat_id=13)
+    target_chats = TargetChatRegistry()
+    admins = AdminDirectory()
+
+    async def load_target_chats():
+        return [target_chat]
+
+    async def load_admins():
+        return [Admin(user_id=37, target_chat=target_chat)]
+
+    await target_chats.load(load_target_chats)
+    await admins.load(load_admins)
+    return target_chats, admins
+
+
+@asynccontextmanager
+async def listening_bus():
+    target_chats, admins = await _loaded_registries()
+    connect = FakeConnect()
+    bus = CacheInvalidationBus(
+        dsn="postgresql://localhost/db",
+        registries={"target_chat": target_chats, "admin": admins},
+        node_id="spam",
+        reconnect_interval=0,
+        connect=connect,
+    )
+    task = asyncio.ensure_future(bus.listen())
+    try:
+        yield bus, connect, target_chats, admins
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+@pytest.mark.asyncio
+async def test_registries_invalidated_on_connect():
+    async with listening_bus() as (bus, connect, target_chats, admins):
+        await connect.wait_connected()
+
+    assert not target_chats.loaded
+    assert not admins.loaded
+
+
+@pytest.mark.asyncio
+async def test_notification_of_other_node_invalidates_registries():
+    async with listening_bus() as (bus, connect, target_chats, admins):
+        conn = await connect.wait_connected()
+        target_chats, admins = await _loaded_registries()
+        bus._registries.update(target_chat=target_chats, admin=admins)
+
+        conn.notify({"node": "spam", "registries": ["target_chat", "admin"]})
+        assert target_chats.loaded
+        assert admins.loaded
+
+        conn.notify({"node": "eggs", "registries": ["target_chat"]})
+        assert not target_chats.loaded
+        assert admins.loaded
+
+
+@pytest.mark.asyncio
+async def test_listener_reconnects_and_resyncs():
+    async with listening_bus() as (bus, connect, target_chats, admins):
+        conn = await connect.wait_connected()
+        target_chats, admins = await _loaded_registries()
+        bus._registries.update(target_chat=target_chats, admin=admins)
+
+        conn.lose_connection()
+        await asyncio.wait_for(connect.wait_connected(), timeout=1)
+
+    assert len(connect.connections) == 2
+    assert not target_chats.loaded
+    assert not admins.loaded
+
+
+@pytest.mark.asyncio
+async def test_caches_stay_loaded_after_warm_up(container):
+    target_chat = TargetChat(chat_id=13)
+    target_chats = TargetChatRegistry()
+    admins = AdminDirectory()
+    uow = InMemoryUnitOfWork(
+        admins={37: Admin(user_id=37, target_chat=target_chat)},
+        target_chats={13: target_chat},
+        forwarded_messages={},
+    )
+    uow.target_chats = CachedTargetChatRepository(
+        repository=uow.target_chats, registry=target_chats
+    )
+    uow.admins = CachedAdminRepository(repository=uow.admins, directory=admins)
+    connect = FakeConnect()
+
+    async def init_pool():
+        yield None
+
+    async def init_bus():
+        bus = CacheInvalidationBus(
+            dsn="postgresql://localhost/db",
+            registries={"target_chat": target_chats, "admin": admins},
+            node_id="spam",
+            connect=connect,
+        )
+        task = asyncio.ensure_future(bus.listen())
+        try:
+            yield bus
+        finally:
+            task.cancel()
+
+    with container.config.DATABASE_BACKEND.override("postgres"), \
+            container.pool.override(providers.Resource(init_pool)), \
+            container.cache_invalidation_bus.override(providers.Resource(init_bus)), \
+            container.uow.override(uow):
+        try:
+            await bot.warm_up(None)
+            # Let the listener run
+            await asyncio.sleep(0.01)
+
+            assert len(connect.connections) == 1
+            assert target_chats.loaded
+            assert admins.loaded
+        finally:
+            await container.cache_invalidation_bus.shutdown()
+            await container.pool.shutdown()
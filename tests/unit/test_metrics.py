@@ -0,0 +1,128 @@
+import pytest
+
+from feedback_bot.metrics import (
+    Counter,
+    Family,
+    Gauge,
+    Histogram,
+    Registry,
+    render,
+    timed,
+)
+
+
+class TestCounter:
+    def test_counter_inc(self):
+        counter = Counter("spam_total", "Spam")
+
+        counter.inc()
+        counter.inc(41)
+
+        assert counter.value == 42
+
+
+class TestGauge:
+    def test_gauge_inc_dec_set(self):
+        gauge = Gauge("spam_in_progress", "Spam")
+
+        gauge.inc(3)
+        gauge.dec()
+        assert gauge.value == 2
+
+        gauge.set(42)
+        assert gauge.value == 42
+
+    def test_gauge_function(self):
+        gauge = Gauge("spam_in_progress", "Spam")
+        spam = [1, 2, 3]
+        gauge.set_function(lambda: len(spam))
+
+        assert gauge.value == 3
+        spam.append(4)
+        assert gauge.value == 4
+
+        gauge.set_function(None)
+        assert gauge.value == 0
+
+
+class TestHistogram:
+    def test_histogram_observe(self):
+        histogram = Histogram("eggs_seconds", "Eggs", buckets=(0.1, 1.0))
+
+        histogram.observe(0.05)
+        histogram.observe(0.1)
+        histogram.observe(0.5)
+        histogram.observe(5)
+
+        assert histogram.bucket_counts == [2, 1, 1]
+        assert histogram.count == 4
+        assert histogram.sum == pytest.approx(5.65)
+
+
+class TestFamily:
+    def test_family_children_reused(self):
+        family = Family(Counter, "spam_total", "Spam", labelnames=("kind",))
+
+        family.labels("eggs").inc()
+        family.labels("eggs").inc()
+        family.labels("ham").inc()
+
+        assert family.labels("eggs").value == 2
+        assert family.labels("ham").value == 1
+
+    def test_family_wrong_number_of_labels(self):
+        family = Family(Counter, "spam_total", "Spam", labelnames=("kind",))
+
+        with pytest.raises(ValueError):
+            family.labels("eggs", "ham")
+
+
+@pytest.mark.asyncio
+async def test_timed_observes_failed_calls():
+    histogram = Histogram("eggs_seconds", "Eggs")
+
+    @timed(histogram)
+    async def spam(fail: bool):
+        if fail:
+            raise RuntimeError()
+        return 42
+
+    assert await spam(fail=False) == 42
+    with pytest.raises(RuntimeError):
+        await spam(fail=True)
+
+    assert histogram.count == 2
+
+
+def test_render():
+    registry = Registry()
+    registry.register(Counter("spam_total", "Spam")).inc(3)
+    family = registry.register(
+        Family(Histogram, "eggs_seconds", "Eggs", ("kind",), buckets=(0.1, 1.0))
+    )
+    family.labels('fried "sunny"').observe(0.5)
+
+    assert render(registry) == "\n".join(
+        [
+            "# HELP spam_total Spam",
+            "# TYPE spam_total counter",
+            "spam_total 3",
+            "# HELP eggs_seconds Eggs",
+            "# TYPE eggs_seconds histogram",
+            'eggs_seconds_bucket{kind="fried \\"sunny\\"",le="0.1"} 0',
+            'eggs_seconds_bucket{kind="fried \\"sunny\\"",le="1.0"} 1',
+            'eggs_seconds_bucket{kind="fried \\"sunny\\"",le="+Inf"} 1',
+            'eggs_seconds_sum{kind="fried \\"sunny\\""} 0.5',
+            'eggs_seconds_count{kind="fried \\"sunny\\""} 1',
+            "",
+        ]
+    )
+
+
+class TestRegistry:
+    def test_registry_duplicate_name(self):
+        registry = Registry()
+        registry.register(Counter("spam_total", "Spam"))
+
+        with pytest.raises(ValueError):
+            registry.register(Counter("spam_total", "Spam"))
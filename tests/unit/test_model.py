@@ -1,3 +1,6 @@
+import copy
+import pickle
+from dataclasses import FrozenInstanceError
 from datetime import datetime, timezone
 
 import pytest
@@ -111,3 +114,39 @@ class TestForwardedMessage:
         )
 
         assert msg_1 == msg_2
+
+
+class TestSlots:
+    @pytest.mark.parametrize(
+        "instance",
+        [
+            TargetChat(chat_id=42),
+            Admin(user_id=13, target_chat=TargetChat(chat_id=42)),
+            ForwardedMessage(forwarded_message_id=1, target_chat_id=2, origin_chat_id=3),
+        ],
+    )
+    def test_slotted_and_frozen(self, instance):
+        assert not hasattr(instance, "__dict__")
+        with pytest.raises(FrozenInstanceError):
+            instance.created_at = None
+
+        assert copy.copy(instance) == instance
+        assert pickle.loads(pickle.dumps(instance)) == instance
+
+    def test_forwarded_message_hash_ignores_origin_chat(self):
+        msg_1 = ForwardedMessage(
+            forwarded_message_id=42, target_chat_id=13, origin_chat_id=37
+        )
+        msg_2 = ForwardedMessage(
+            forwarded_message_id=42, target_chat_id=13, origin_chat_id=38
+        )
+
+        assert msg_1 == msg_2
+        assert hash(msg_1) == hash(msg_2)
+
+    def test_positional_arguments(self):
+        created_at = datetime(2021, 1, 1, tzinfo=timezone.utc)
+
+        assert TargetChat(42, created_at) == TargetChat(
+            chat_id=42, created_at=created_at
+        )
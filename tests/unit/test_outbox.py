@@ -0,0 +1,276 @@
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+import pytest
+
+from feedback_bot.adapters.telegram import AbstractTelegramAPI
+from feedback_bot.model import ForwardedMessage
+from feedback_bot.service_layer.outbox import (
+    CopyMessage,
+    ForwardMessage,
+    OutboxDispatcher,
+    OutboxTransaction,
+    SendMessage,
+    dump_command,
+    load_command,
+)
+from feedback_bot.service_layer.unit_of_work import PostgresUnitOfWork
+from tests.fakes import InMemoryForwardedMessageRepository, InMemoryOutboxRepository
+
+
+class RecordingTelegramAPI(AbstractTelegramAPI):
+    def __init__(self, events: List[str], fail_for_chat_id: int = None):
+        self.events = events
+        self._fail_for_chat_id = fail_for_chat_id
+
+    async def send_message(self, to_chat_id: int, text: str):
+        if to_chat_id == self._fail_for_chat_id:
+            raise RuntimeError("Telegram is down")
+        self.events.append(f"send {to_chat_id}")
+
+    async def forward_message(
+        self, from_chat_id: int, to_chat_id: int, message_id: int
+    ):
+        self.events.append(f"forward {message_id}")
+        return 100 + message_id
+
+    async def copy_message(
+        self, from_chat_id: int, to_chat_id: int, message_id: int
+    ):
+        self.events.append(f"copy {message_id}")
+
+
+class FakeTransaction:
+    def __init__(self, events: List[str]):
+        self._events = events
+
+    async def start(self):
+        pass
+
+    async def commit(self):
+        self._events.append("commit")
+
+    async def rollback(self):
+        self._events.append("rollback")
+
+
+class FakeConnection:
+    def __init__(self, events: List[str]):
+        self._events = events
+
+    def transaction(self):
+        return FakeTransaction(self._events)
+
+    async def execute(self, query, *args):
+        return "OK"
+
+    async def fetchval(self, query, *args):
+        self._events.append("add to outbox")
+        return 1
+
+
+class FakePool:
+    def __init__(self, events: List[str]):
+        self._events = events
+
+    async def acquire(self, timeout=None):
+        return FakeConnection(self._events)
+
+    async def release(self, conn):
+        self._events.append("release")
+
+
+class FailingForwardedMessageRepository(InMemoryForwardedMessageRepository):
+    def __init__(self):
+        super().__init__(forwarded_messages={})
+        self.failures = 1
+
+    async def add(self, forwarded_message: ForwardedMessage):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionRefusedError("Database is unavailable")
+        await super().add(forwarded_message)
+
+
+class FakeOutboxStore:
+    """Outbox and forwarded messages kept in memory."""
+
+    def __init__(self, forwarded_messages: InMemoryForwardedMessageRepository = None):
+        self.outbox = InMemoryOutboxRepository()
+        if forwarded_messages is None:
+            forwarded_messages = InMemoryForwardedMessageRepository({})
+        self.forwarded_messages = forwarded_messages
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield OutboxTransaction(
+            outbox=self.outbox, forwarded_messages=self.forwarded_messages
+        )
+
+
+def _dispatcher(
+    telegram_api: AbstractTelegramAPI, store: FakeOutboxStore, **kwargs
+) -> OutboxDispatcher:
+    return OutboxDispatcher(telegram_api, transactions=store.transaction, **kwargs)
+
+
+async def _save_and_dispatch(dispatcher: OutboxDispatcher, store, commands):
+    entries = await dispatcher.save(store.outbox, commands)
+    await dispatcher.dispatch(entries)
+    return entries
+
+
+def test_commands_round_trip():
+    commands = [
+        SendMessage(to_chat_id=1, text="spam"),
+        ForwardMessage(from_chat_id=1, to_chat_id=2, message_id=3),
+        CopyMessage(from_chat_id=3, to_chat_id=4, message_id=5),
+    ]
+
+    assert [load_command(dump_command(command)) for command in commands] == commands
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_sends_remaining_commands_after_failure():
+    events = []
+    store = FakeOutboxStore()
+    dispatcher = _dispatcher(
+        RecordingTelegramAPI(events, fail_for_chat_id=1), store, retry_interval=5
+    )
+
+    before = datetime.now(timezone.utc)
+    failed, *_ = await _save_and_dispatch(dispatcher, store, [
+        SendMessage(to_chat_id=1, text="spam"),
+        SendMessage(to_chat_id=2, text="eggs"),
+        CopyMessage(from_chat_id=3, to_chat_id=4, message_id=5),
+    ])
+
+    assert events == ["send 2", "copy 5"]
+    # Sent commands are removed, the failed one is retried later
+    assert list(store.outbox.records) == [failed.id]
+    assert store.outbox.records[failed.id].attempts == 1
+    assert store.outbox.available_at[failed.id] >= before + timedelta(seconds=5)
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_saves_forwarded_message():
+    events = []
+    store = FakeOutboxStore()
+    dispatcher = _dispatcher(RecordingTelegramAPI(events), store)
+
+    await _save_and_dispatch(dispatcher, store, [
+        ForwardMessage(from_chat_id=1, to_chat_id=2, message_id=3),
+    ])
+
+    assert events == ["forward 3"]
+    forwarded_message = await store.forwarded_messages.get(
+        forwarded_message_id=103, target_chat_id=2
+    )
+    assert forwarded_message.origin_chat_id == 1
+    assert not store.outbox.records
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_drops_command_after_max_attempts():
+    events = []
+    store = FakeOutboxStore()
+    dispatcher = _dispatcher(
+        RecordingTelegramAPI(events, fail_for_chat_id=1),
+        store,
+        retry_interval=0,
+        max_attempts=2,
+    )
+
+    await _save_and_dispatch(dispatcher, store, [SendMessage(to_chat_id=1, text="spam")])
+    assert len(store.outbox.records) == 1
+
+    await dispatcher.relay()
+    assert not store.outbox.records
+
+
+@pytest.mark.asyncio
+async def test_relay_sends_commands_left_over_by_stopped_process():
+    events = []
+    store = FakeOutboxStore()
+    stopped = _dispatcher(RecordingTelegramAPI(events), store, lease=0)
+    await stopped.save(store.outbox, [
+        SendMessage(to_chat_id=1, text="spam"),
+        ForwardMessage(from_chat_id=2, to_chat_id=3, message_id=4),
+    ])
+
+    assert await _dispatcher(RecordingTelegramAPI(events), store).relay() == 2
+
+    assert events == ["send 1", "forward 4"]
+    assert not store.outbox.records
+    assert await store.forwarded_messages.get(
+        forwarded_message_id=104, target_chat_id=3
+    )
+
+
+@pytest.mark.asyncio
+async def test_relay_skips_leased_commands():
+    events = []
+    store = FakeOutboxStore()
+    dispatcher = _dispatcher(RecordingTelegramAPI(events), store, lease=60)
+    await dispatcher.save(store.outbox, [SendMessage(to_chat_id=1, text="spam")])
+
+    assert await dispatcher.relay() == 0
+    assert events == []
+
+
+@pytest.mark.asyncio
+async def test_forward_sent_again_when_saving_forwarded_message_fails():
+    events = []
+    store = FakeOutboxStore(FailingForwardedMessageRepository())
+    dispatcher = _dispatcher(RecordingTelegramAPI(events), store, lease=0)
+
+    await _save_and_dispatch(dispatcher, store, [
+        ForwardMessage(from_chat_id=1, to_chat_id=2, message_id=3),
+    ])
+    # Neither the forwarded message nor the removal of the command is saved
+    assert len(store.outbox.records) == 1
+    assert not await store.forwarded_messages.get_all()
+
+    await dispatcher.relay()
+
+    assert events == ["forward 3", "forward 3"]
+    assert not store.outbox.records
+    assert await store.forwarded_messages.get(
+        forwarded_message_id=103, target_chat_id=2
+    )
+
+
+@pytest.mark.asyncio
+async def test_commands_sent_after_commit_and_connection_release():
+    events = []
+    uow = PostgresUnitOfWork(
+        outbox_dispatcher=_dispatcher(RecordingTelegramAPI(events), FakeOutboxStore()),
+        pool=FakePool(events),
+    )
+
+    async with uow:
+        await uow._conn.execute("SELECT 1")
+        uow.outbox.add(SendMessage(to_chat_id=1, text="spam"))
+        assert events == []
+
+        await uow.commit()
+        # Saved in the transaction of the unit of work
+        assert events == ["add to outbox", "commit"]
+
+    assert events == ["add to outbox", "commit", "release", "send 1"]
+
+
+@pytest.mark.asyncio
+async def test_commands_of_rolled_back_unit_of_work_discarded():
+    events = []
+    uow = PostgresUnitOfWork(
+        outbox_dispatcher=_dispatcher(RecordingTelegramAPI(events), FakeOutboxStore()),
+        pool=FakePool(events),
+    )
+
+    async with uow:
+        await uow._conn.execute("SELECT 1")
+        uow.outbox.add(SendMessage(to_chat_id=1, text="spam"))
+
+    assert events == ["rollback", "release"]
@@ -0,0 +1,25 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from feedback_bot.adapters.partitions import Partition
+
+
+class TestPartition:
+    def test_partition_for_month(self):
+        partition = Partition.for_month(datetime(2021, 12, 1, tzinfo=timezone.utc))
+
+        assert partition.name == "forwarded_message_p202112"
+        assert partition.start == datetime(2021, 12, 1, tzinfo=timezone.utc)
+        assert partition.end == datetime(2022, 1, 1, tzinfo=timezone.utc)
+
+    def test_partition_from_name(self):
+        partition = Partition.from_name("forwarded_message_p202102")
+
+        assert partition == Partition.for_month(datetime(2021, 2, 1, tzinfo=timezone.utc))
+
+    @pytest.mark.parametrize(
+        "name", ["forwarded_message_default", "forwarded_message_p2021", "admin"]
+    )
+    def test_partition_from_unknown_name(self, name: str):
+        assert Partition.from_name(name) is None
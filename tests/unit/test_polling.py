@@ -0,0 +1,202 @@
+import asyncio
+import os
+import signal
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+import pytest
+from aiogram import Bot, types
+
+from feedback_bot import bot as bot_module
+from feedback_bot.adapters.repositories.forwarded_message import (
+    ForwardedMessageWriteBuffer,
+)
+from feedback_bot.model import ForwardedMessage
+from feedback_bot.polling import UpdatePoller
+from feedback_bot.updates import InstrumentedDispatcher, UpdateWorkerPool
+from feedback_bot.webhook import Readiness
+
+
+class FakeDispatcher:
+    def __init__(self):
+        self.processed: List[int] = []
+        self.in_progress = 0
+        self.max_in_progress = 0
+
+    async def process_update(self, update: types.Update):
+        self.in_progress += 1
+        self.max_in_progress = max(self.max_in_progress, self.in_progress)
+        try:
+            await asyncio.sleep(0.001 * (10 - update.update_id % 10))
+            if update.update_id == 3:
+                raise RuntimeError("Handler failed")
+            self.processed.append(update.update_id)
+        finally:
+            self.in_progress -= 1
+
+
+def _message_update(update_id: int, chat_id: int) -> types.Update:
+    return types.Update(
+        update_id=update_id,
+        message={
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": chat_id, "type": "private"},
+        },
+    )
+
+
+@pytest.mark.asyncio
+async def test_updates_of_same_chat_processed_in_order():
+    dp = FakeDispatcher()
+    poller = UpdatePoller(dp, concurrency=10)
+
+    await poller.process_updates(
+        [_message_update(update_id, chat_id=update_id % 2) for update_id in range(10)]
+    )
+
+    # Failed update doesn't stop the rest from being processed
+    assert sorted(dp.processed) == [0, 1, 2, 4, 5, 6, 7, 8, 9]
+    odd = [update_id for update_id in dp.processed if update_id % 2]
+    even = [update_id for update_id in dp.processed if not update_id % 2]
+    assert odd == sorted(odd)
+    assert even == sorted(even)
+    assert dp.max_in_progress == 2
+
+
+@pytest.mark.asyncio
+async def test_concurrency_bounded():
+    dp = FakeDispatcher()
+    poller = UpdatePoller(dp, concurrency=3)
+
+    await poller.process_updates(
+        [_message_update(update_id, chat_id=update_id) for update_id in range(10)]
+    )
+
+    assert len(dp.processed) == 9
+    assert dp.max_in_progress == 3
+
+
+class FakePollingBot(Bot):
+    def __init__(self, raw_updates: List[dict]):
+        super().__init__(token="123:abc")
+        self._batches = [raw_updates]
+
+    async def delete_webhook(self, *args, **kwargs):
+        return True
+
+    async def request(self, method, data=None, *args, **kwargs):
+        if self._batches:
+            return self._batches.pop(0)
+        # Long polling until cancelled
+        await asyncio.Event().wait()
+
+
+class FakeUpdateOffsets:
+    def __init__(self):
+        self.saved: List[int] = []
+
+    async def get(self, bot_id: int) -> Optional[int]:
+        return None
+
+    async def save(self, bot_id: int, offset: int):
+        self.saved.append(offset)
+
+
+class FakeCopyConnection:
+    """Pool and connection in one, recording copied records."""
+
+    def __init__(self):
+        self.copied_records: List[list] = []
+
+    async def acquire(self, timeout=None):
+        return self
+
+    async def release(self, conn):
+        pass
+
+    def transaction(self):
+        return self
+
+    async def start(self):
+        pass
+
+    async def commit(self):
+        pass
+
+    async def copy_records_to_table(self, table_name, *, records, columns):
+        self.copied_records.append(list(records))
+
+
+class SlowRouter:
+    def __init__(self, buffer: ForwardedMessageWriteBuffer):
+        self.buffer = buffer
+        self.started = asyncio.Event()
+        self.processed: List[int] = []
+
+    async def route(self, update):
+        self.started.set()
+        await asyncio.sleep(0.05)
+        await self.buffer.put([
+            ForwardedMessage(
+                forwarded_message_id=update.message.message_id,
+                target_chat_id=13,
+                origin_chat_id=update.message.chat.id,
+            )
+        ])
+        self.processed.append(update.update_id)
+
+
+@pytest.mark.asyncio
+async def test_sigterm_drains_updates_and_flushes_buffer():
+    pool = FakeCopyConnection()
+    buffer = ForwardedMessageWriteBuffer(
+        pool, batch_size=10, max_size=10, flush_interval=60
+    )
+    router = SlowRouter(buffer)
+    dp = InstrumentedDispatcher(
+        FakePollingBot([
+            {
+                "update_id": 7,
+                "message": {
+                    "message_id": 42,
+                    "date": 0,
+                    "chat": {"id": 37, "type": "private"},
+                    "text": "Hello",
+                },
+            }
+        ]),
+        router=router,
+    )
+    update_offsets = FakeUpdateOffsets()
+
+    @asynccontextmanager
+    async def get_update_offsets():
+        yield update_offsets
+
+    poller = UpdatePoller(dp)
+    polling = asyncio.ensure_future(
+        bot_module.poll_updates(poller, update_offsets=get_update_offsets)
+    )
+    await router.started.wait()
+
+    os.kill(os.getpid(), signal.SIGTERM)
+    await asyncio.wait_for(polling, 1)
+    assert router.processed == []
+
+    # Shutdown callbacks of the executor, closing resources flushes the buffer
+    await bot_module.drain(
+        dp,
+        readiness=Readiness(),
+        update_worker_pool=UpdateWorkerPool(shards=1, queue_size=1),
+        immediate_ack=False,
+        timeout=1,
+        poller=poller,
+    )
+    await buffer.close()
+
+    assert router.processed == [7]
+    assert update_offsets.saved == [8]
+    assert [
+        record[:3] for records in pool.copied_records for record in records
+    ] == [(42, 13, 37)]
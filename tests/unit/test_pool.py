@@ -0,0 +1,146 @@
+import itertools
+from typing import List
+
+import asyncpg
+import pytest
+
+from feedback_bot.adapters import statements
+from feedback_bot.adapters.pool import (
+    PoolHealthCheck,
+    bind_metrics,
+    pool_idle,
+    pool_size,
+)
+# Registers the statements of the repositories
+from feedback_bot.adapters.repositories import target_chat  # noqa: F401
+
+
+class FakeConnection:
+    _pids = itertools.count(1)
+
+    def __init__(self, broken: bool = False, broken_statements=()):
+        self.pid = next(self._pids)
+        self.broken = broken
+        self.broken_statements = set(broken_statements)
+        self.prepared: List[str] = []
+        self.terminated = False
+
+    async def _prepare(self, query, *, use_cache=False):
+        assert use_cache
+        if query in self.broken_statements:
+            raise asyncpg.UndefinedTableError("relation does not exist")
+        self.prepared.append(query)
+
+    async def execute(self, query, *, timeout=None):
+        if self.broken:
+            raise ConnectionResetError()
+        return "SELECT 1"
+
+    def get_server_pid(self):
+        return self.pid
+
+    def terminate(self):
+        self.terminated = True
+
+
+class FakePool:
+    def __init__(self, conns: List[FakeConnection]):
+        self.conns = conns
+        self.idle = list(conns)
+        self.max_acquired = 0
+
+    def get_size(self):
+        return len(self.conns)
+
+    def get_idle_size(self):
+        return len(self.idle)
+
+    async def acquire(self, timeout=None):
+        conn = self.idle.pop()
+        self.max_acquired = max(self.max_acquired, len(self.conns) - len(self.idle))
+        return conn
+
+    async def release(self, conn):
+        self.idle.append(conn)
+
+
+class TestStatements:
+    def test_duplicate_statement_name(self):
+        with pytest.raises(ValueError):
+            statements.statement("target_chat.get", "SELECT 1")
+
+    @pytest.mark.asyncio
+    async def test_all_statements_prepared(self):
+        conn = FakeConnection()
+
+        assert await statements.prepare_all(conn) == []
+        assert conn.prepared == list(statements.registered().values())
+
+    @pytest.mark.asyncio
+    async def test_failed_statement_doesnt_stop_preparing(self):
+        registered = statements.registered()
+        conn = FakeConnection(broken_statements=[registered["target_chat.get"]])
+
+        assert await statements.prepare_all(conn) == ["target_chat.get"]
+        assert len(conn.prepared) == len(registered) - 1
+
+    @pytest.mark.asyncio
+    async def test_public_prepare_fallback(self):
+        class PublicConnection:
+            def __init__(self):
+                self.prepared: List[str] = []
+
+            async def prepare(self, query):
+                self.prepared.append(query)
+
+        conn = PublicConnection()
+
+        assert await statements.prepare_all(conn) == []
+        assert conn.prepared == list(statements.registered().values())
+
+
+class TestPoolHealthCheck:
+    @pytest.mark.asyncio
+    async def test_broken_idle_connections_closed(self):
+        healthy, broken = FakeConnection(), FakeConnection(broken=True)
+        pool = FakePool([healthy, broken])
+        health_check = PoolHealthCheck(pool, interval=60, timeout=1)
+
+        assert await health_check.check() == 1
+        assert broken.terminated
+        assert not healthy.terminated
+        assert pool.get_idle_size() == 2
+        assert pool.max_acquired == 1
+
+    @pytest.mark.asyncio
+    async def test_stops_at_checked_connection(self):
+        healthy, broken = FakeConnection(), FakeConnection(broken=True)
+        # The pool hands the released healthy connection out again
+        pool = FakePool([broken, healthy])
+        health_check = PoolHealthCheck(pool, interval=60, timeout=1)
+
+        assert await health_check.check() == 0
+        assert not broken.terminated
+
+    @pytest.mark.asyncio
+    async def test_busy_connections_not_checked(self):
+        busy = FakeConnection(broken=True)
+        pool = FakePool([busy, FakeConnection()])
+        pool.idle.remove(busy)
+        health_check = PoolHealthCheck(pool, interval=60, timeout=1)
+
+        assert await health_check.check() == 0
+        assert not busy.terminated
+
+
+def test_pool_metrics_bound():
+    pool = FakePool([FakeConnection(), FakeConnection()])
+    bind_metrics(pool)
+    try:
+        pool.idle.pop()
+        assert pool_size.value == 2
+        assert pool_idle.value == 1
+    finally:
+        bind_metrics(None)
+
+    assert pool_size.value == 0
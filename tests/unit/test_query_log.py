@@ -0,0 +1,135 @@
+import logging
+from datetime import datetime
+from typing import List
+
+import asyncpg
+import pytest
+
+from feedback_bot.adapters.connection import LazyConnection, statement_duration
+from feedback_bot.adapters.query_log import SlowQueryLog, redact
+from feedback_bot.adapters.repositories import target_chat
+
+
+class FakeSavepoint:
+    def __init__(self, events: List[str]):
+        self._events = events
+
+    async def start(self):
+        self._events.append("savepoint")
+
+    async def rollback(self):
+        self._events.append("rollback to savepoint")
+
+
+class FakeConnection:
+    def __init__(self, fail_explain: bool = False):
+        self.events: List[str] = []
+        self.fail_explain = fail_explain
+
+    def transaction(self):
+        return FakeSavepoint(self.events)
+
+    async def fetch(self, query, *args):
+        self.events.append(query.split()[0])
+        if self.fail_explain:
+            raise asyncpg.UniqueViolationError("duplicate key value")
+        return [("Seq Scan on target_chat",), ("Planning Time: 0.1 ms",)]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_redact():
+    assert redact((42, "spam", datetime(2021, 1, 1))) == (
+        "$1: int, $2: str, $3: datetime"
+    )
+
+
+@pytest.mark.asyncio
+async def test_slow_statement_logged_without_parameters(caplog):
+    conn = FakeConnection()
+    slow_query_log = SlowQueryLog(threshold=0.5)
+
+    with caplog.at_level(logging.WARNING):
+        await slow_query_log.record(conn, "target_chat.get", "SELECT", (42,), 0.7)
+
+    assert "target_chat.get took 0.700s, parameters: ($1: int)" in caplog.text
+    assert "42" not in caplog.text
+    assert conn.events == []
+
+
+@pytest.mark.asyncio
+async def test_plan_captured_in_savepoint_once_per_interval(caplog):
+    conn = FakeConnection()
+    clock = FakeClock()
+    slow_query_log = SlowQueryLog(
+        threshold=0.5, explain=True, explain_interval=60, clock=clock
+    )
+
+    with caplog.at_level(logging.WARNING):
+        await slow_query_log.record(conn, "target_chat.get", "SELECT", (42,), 0.7)
+        clock.now = 30
+        await slow_query_log.record(conn, "target_chat.get", "SELECT", (42,), 0.7)
+
+    assert conn.events == ["savepoint", "EXPLAIN", "rollback to savepoint"]
+    assert "Seq Scan on target_chat" in caplog.text
+
+    clock.now = 61
+    await slow_query_log.record(conn, "target_chat.get", "SELECT", (42,), 0.7)
+    assert conn.events.count("EXPLAIN") == 2
+
+
+@pytest.mark.asyncio
+async def test_failed_explain_rolled_back():
+    conn = FakeConnection(fail_explain=True)
+    slow_query_log = SlowQueryLog(threshold=0.5, explain=True)
+
+    await slow_query_log.record(conn, "admin.add", "INSERT", (42, 13), 0.7)
+
+    assert conn.events == ["savepoint", "EXPLAIN", "rollback to savepoint"]
+
+
+class FakeTransaction:
+    async def start(self):
+        pass
+
+
+class SlowConnection:
+    def transaction(self):
+        return FakeTransaction()
+
+    async def fetchrow(self, query, *args):
+        return None
+
+
+class FakePool:
+    async def acquire(self, timeout=None):
+        return SlowConnection()
+
+
+class RecordingSlowQueryLog(SlowQueryLog):
+    def __init__(self):
+        super().__init__(threshold=0)
+        self.recorded: List[str] = []
+
+    async def record(self, conn, name, query, args, duration):
+        self.recorded.append(name)
+
+
+@pytest.mark.asyncio
+async def test_lazy_connection_times_statements_by_name():
+    slow_query_log = RecordingSlowQueryLog()
+    conn = LazyConnection(FakePool(), slow_query_log=slow_query_log)
+    histogram = statement_duration.labels("target_chat.get_latest")
+    count_before = histogram.count
+
+    await target_chat.PostgresTargetChatRepository(conn).get_latest()
+    await conn.fetchrow("SELECT 1")
+
+    assert histogram.count == count_before + 1
+    assert slow_query_log.recorded == ["target_chat.get_latest", "ad_hoc"]
@@ -0,0 +1,154 @@
+from typing import List, Tuple
+
+import pytest
+from aiogram import Bot, types
+
+from feedback_bot import bot as bot_module
+from feedback_bot import routing
+from feedback_bot.routing import decode_update, updates_dropped
+
+
+def _message(update_id: int, chat_type: str = "private", **fields) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": 13, "type": chat_type, "first_name": "Spam"},
+            "from": {"id": 42, "is_bot": False, "first_name": "Spam"},
+            **fields,
+        },
+    }
+
+
+def _my_chat_member(update_id: int, status: str) -> dict:
+    chat_member = {
+        "user": {"id": 1, "is_bot": True, "first_name": "Bot"},
+        "status": status,
+    }
+    return {
+        "update_id": update_id,
+        "my_chat_member": {
+            "chat": {"id": -13, "type": "group", "title": "Group"},
+            "from": {"id": 42, "is_bot": False, "first_name": "Spam"},
+            "date": 0,
+            "old_chat_member": {**chat_member, "status": "left"},
+            "new_chat_member": chat_member,
+        },
+    }
+
+
+def test_decode_message():
+    update = decode_update(
+        _message(
+            1,
+            text="/auth token",
+            reply_to_message={
+                "message_id": 7, "date": 0, "chat": {"id": 13, "type": "private"}
+            },
+            entities=[{"type": "bot_command", "offset": 0, "length": 5}],
+            photo=[{"file_id": "a", "file_unique_id": "b", "width": 1, "height": 1}],
+        )
+    )
+
+    assert update == routing.Update(
+        update_id=1,
+        message=routing.Message(
+            message_id=1,
+            chat=routing.Chat(id=13, type="private"),
+            from_user=routing.User(id=42),
+            reply_to_message=routing.ReplyToMessage(message_id=7),
+            text="/auth token",
+        ),
+    )
+    assert update.message.is_command()
+    assert update.message.get_args() == "token"
+
+
+def test_decode_my_chat_member():
+    update = decode_update(_my_chat_member(1, "kicked"))
+
+    assert update.type == "my_chat_member"
+    assert update.my_chat_member.chat == routing.Chat(
+        id=-13, type="group", title="Group"
+    )
+    assert update.my_chat_member.new_chat_member.status == "kicked"
+
+
+def test_decode_drops_update_types_without_handlers():
+    dropped = updates_dropped.labels("edited_message")
+    dropped_before = dropped.value
+
+    update = decode_update(
+        {"update_id": 1, "edited_message": _message(1)["message"]}
+    )
+
+    assert update is None
+    assert dropped.value == dropped_before + 1
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        # The username of the bot is needed to check mentions
+        _message(1, text="/auth@feedback_bot token"),
+        # Without the sender lean records can't be built
+        {"update_id": 1, "my_chat_member": {"chat": {"id": -13, "type": "group"}}},
+    ],
+)
+def test_decode_falls_back_to_aiogram(data):
+    assert isinstance(decode_update(data), types.Update)
+
+
+@pytest.fixture
+def handled(monkeypatch) -> List[Tuple[str, int, str]]:
+    handled = []
+
+    def handler(name: str):
+        async def handle(event):
+            handled.append((name, event.chat.id, getattr(event, "text", None)))
+
+        return handle
+
+    for name in (
+        "handle_auth_command",
+        "handle_my_chat_member_update",
+        "handle_private_message",
+        "handle_reply",
+    ):
+        monkeypatch.setattr(bot_module, name, handler(name))
+    return handled
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "data",
+    [
+        _message(1, text="/auth token"),
+        _message(2, text="/AUTH"),
+        _message(3, text="Hello"),
+        _message(4, caption="/auth token", photo=[]),
+        _message(5, text="/start"),
+        _message(6, chat_type="group", text="Hello"),
+        _message(7, chat_type="group", text="/auth token"),
+        _message(8, text="Reply", reply_to_message={"message_id": 1, "date": 0}),
+        _message(
+            9, chat_type="group", text="/auth token", reply_to_message={"message_id": 1}
+        ),
+        _message(10, text="/auth token", reply_to_message={"message_id": 1}),
+        _message(11),
+        _my_chat_member(12, "member"),
+        _my_chat_member(13, "kicked"),
+    ],
+)
+async def test_router_matches_dispatcher(handled, data):
+    bot = Bot(token="123:abc")
+    Bot.set_current(bot)
+    dp = bot_module.create_dispatcher(bot)
+
+    await dp.process_update(types.Update(**data))
+    await dp.process_update(decode_update(data))
+
+    # Either both or neither of the updates reach a handler, the same one
+    assert len(handled) in (0, 2)
+    assert handled[0::2] == handled[1::2]
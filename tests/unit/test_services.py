@@ -1,151 +1,16 @@
 from datetime import datetime
-from typing import Dict, List, NamedTuple, Optional, Tuple
 
 import pytest
 from dependency_injector import providers
 
-from feedback_bot.adapters.repositories.admin import AbstractAdminRepository
-from feedback_bot.adapters.repositories.forwarded_message import (
-    AbstractForwardedMessageRepository
-)
-from feedback_bot.adapters.repositories.target_chat import AbstractTargetChatRepository
-from feedback_bot.adapters.telegram import AbstractTelegramAPI
 from feedback_bot.model import Admin, ForwardedMessage, TargetChat
 from feedback_bot.service_layer import services
-from feedback_bot.service_layer.unit_of_work import AbstractUnitOfWork
-
-
-class InMemoryAdminRepository(AbstractAdminRepository):
-    def __init__(self, admins: Dict[int, Admin], target_chats: Dict[int, TargetChat]):
-        self._admins = admins
-        self._target_chats = target_chats 
-    
-    async def get(self, user_id: int):
-        return self._admins.get(user_id)
-
-    async def get_all(self):
-        return list(self._admins.values())
-    
-    async def add(self, admin: Admin):
-        self._admins[admin.user_id] = admin
-        self._target_chats[admin.target_chat.chat_id] = admin.target_chat
-
-
-class InMemoryForwardedMessageRepository(AbstractForwardedMessageRepository):
-    def __init__(self, forwarded_messages: Dict[Tuple[int, int], ForwardedMessage]):
-        self._forwarded_messages = forwarded_messages
-
-    async def get(self, forwarded_message_id: int, target_chat_id: int):
-        key = (forwarded_message_id, target_chat_id)
-        return self._forwarded_messages.get(key)
-
-    async def get_all(self):
-        return list(self._forwarded_messages.values())
-
-    async def add(self, forwarded_message: ForwardedMessage):
-        key = (forwarded_message.forwarded_message_id, forwarded_message.target_chat_id)
-        self._forwarded_messages[key] = forwarded_message
-
-
-class InMemoryTargetChatRepository(AbstractTargetChatRepository):
-    def __init__(self, target_chats: Dict[int, TargetChat]):
-        self._target_chats = target_chats
-
-    async def get(self, chat_id: int) -> Optional[TargetChat]:
-        return self._target_chats.get(chat_id)
-
-    async def get_latest(self):
-        return max(
-            self._target_chats.values(),
-            key=lambda group: group.created_at,
-            default=None,
-        )
-    
-    async def remove(self, chat_id: int):
-        return self._target_chats.pop(chat_id, None)
-    
-    async def add(self, target_chat: TargetChat):
-        self._target_chats[target_chat.chat_id] = target_chat
-
-
-class FakeSentMessage(NamedTuple):
-    to_chat_id: int
-    text: str
-
-
-class FakeForwardedMessage(NamedTuple):
-    from_chat_id: int
-    to_chat_id: int
-    message_id: int
-
-
-class FakeCopiedMessage(NamedTuple):
-    from_chat_id: int
-    to_chat_id: int
-    message_id: int
-
-
-class FakeTelegramAPI(AbstractTelegramAPI):
-    FAKE_FORWARDED_MESSAGE_ID = 42
-
-    def __init__(self):
-        self.sent_messages: List[FakeSentMessage] = []
-        self.forwarded_messages: List[FakeForwardedMessage] = []
-        self.copied_messages: List[FakeCopiedMessage] = []
-    
-    async def send_message(self, to_chat_id: int, text: str):
-        self.sent_messages.append(FakeSentMessage(to_chat_id=to_chat_id, text=text))
-
-    async def forward_message(
-        self, from_chat_id: int, to_chat_id: int, message_id: int
-    ):
-        self.forwarded_messages.append(
-            FakeForwardedMessage(
-                from_chat_id=from_chat_id,
-                to_chat_id=to_chat_id,
-                message_id=message_id
-            )
-        )
-        return self.FAKE_FORWARDED_MESSAGE_ID
-
-    async def copy_message(
-        self, from_chat_id: int, to_chat_id: int, message_id: int
-    ):
-        self.copied_messages.append(
-            FakeCopiedMessage(
-                from_chat_id=from_chat_id, to_chat_id=to_chat_id, message_id=message_id
-            )
-        )
-
-
-class InMemoryUnitOfWork(AbstractUnitOfWork):
-    target_chat_repository: InMemoryTargetChatRepository
-    telegram_api: FakeTelegramAPI
-
-    commited: bool
-    rolled_back: bool
-
-    def __init__(
-        self,
-        admins: Dict[int, Admin],
-        target_chats: Dict[int, TargetChat],
-        forwarded_messages: Dict[Tuple[int, int], ForwardedMessage],
-    ):
-        self.commited = False
-        self.rolled_back = False
-
-        self.admins = InMemoryAdminRepository(admins=admins, target_chats=target_chats)
-        self.target_chats = InMemoryTargetChatRepository(target_chats=target_chats)
-        self.forwarded_messages = InMemoryForwardedMessageRepository(
-            forwarded_messages=forwarded_messages
-        )
-        self.telegram_api = FakeTelegramAPI()
-    
-    async def _rollback(self):
-        self.rolled_back = True
-
-    async def _commit(self):
-        self.commited = True
+from tests.fakes import (
+    FakeCopiedMessage,
+    FakeForwardedMessage,
+    FakeSentMessage,
+    InMemoryUnitOfWork,
+)
 
 
 @pytest.fixture
@@ -0,0 +1,39 @@
+import os
+
+from benchmarks.startup import ImportTime, measure_imports, parse_import_times
+
+# Only needed to run migrations, in the release phase,
+# or with the PostgreSQL backend, once the pool is created
+_DEFERRED_MODULES = ("alembic", "psycopg2", "sqlalchemy", "asyncpg")
+
+_REPORT = """\
+import time: self [us] | cumulative | imported package
+import time:       120 |        120 |     dynaconf.utils
+import time:      1500 |       1620 |   feedback_bot.config
+some warning printed while importing
+import time:       300 |       1920 | feedback_bot.main
+"""
+
+
+def test_parse_import_times():
+    assert parse_import_times(_REPORT) == [
+        ImportTime("dynaconf.utils", 120, 120, 2),
+        ImportTime("feedback_bot.config", 1500, 1620, 1),
+        ImportTime("feedback_bot.main", 300, 1920, 0),
+    ]
+
+
+def test_runtime_imports():
+    # Without settings in the environment, as they're validated on startup
+    times = measure_imports(
+        "feedback_bot.main", env={"PATH": os.environ.get("PATH", "")}
+    )
+
+    # The imported module is reported last, at the top level
+    assert times[-1].module == "feedback_bot.main"
+    assert times[-1].depth == 0
+    modules = {time.module for time in times}
+    assert "feedback_bot.bootstrap" in modules
+    assert not [
+        module for module in modules if module.split(".")[0] in _DEFERRED_MODULES
+    ]
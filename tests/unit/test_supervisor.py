@@ -0,0 +1,69 @@
+import os
+import signal
+import threading
+import time
+
+import pytest
+
+from feedback_bot.bootstrap import worker_pool_size
+from feedback_bot.supervisor import Supervisor
+
+
+@pytest.fixture(autouse=True)
+def restore_signal_handlers():
+    handlers = {
+        signum: signal.getsignal(signum)
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGALRM)
+    }
+    yield
+    for signum, handler in handlers.items():
+        signal.signal(signum, handler)
+
+
+def _sleep_forever(worker_index: int):
+    time.sleep(60)
+
+
+def test_workers_stopped_once_one_exits():
+    def target(worker_index: int):
+        if worker_index == 0:
+            raise RuntimeError("Worker failed")
+        _sleep_forever(worker_index)
+
+    started_at = time.monotonic()
+    exit_code = Supervisor(workers=3, target=target).run()
+
+    assert exit_code == 1
+    assert time.monotonic() - started_at < 10
+
+
+def test_workers_stopped_on_sigterm():
+    timer = threading.Timer(0.2, os.kill, (os.getpid(), signal.SIGTERM))
+    timer.start()
+
+    exit_code = Supervisor(workers=2, target=_sleep_forever).run()
+
+    assert exit_code == 0
+
+
+def test_workers_killed_after_shutdown_timeout():
+    def target(worker_index: int):
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        _sleep_forever(worker_index)
+
+    timer = threading.Timer(0.2, os.kill, (os.getpid(), signal.SIGTERM))
+    timer.start()
+
+    started_at = time.monotonic()
+    exit_code = Supervisor(workers=2, target=target, shutdown_timeout=1).run()
+
+    assert exit_code == 0
+    assert time.monotonic() - started_at < 10
+
+
+@pytest.mark.parametrize(
+    "size, workers, expected",
+    [(10, 1, 10), (10, 3, 3), (2, 4, 1), (0, 4, 0)],
+)
+def test_worker_pool_size(size, workers, expected):
+    assert worker_pool_size(size, workers) == expected
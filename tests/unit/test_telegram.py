@@ -0,0 +1,147 @@
+import asyncio
+from typing import Dict, List
+
+import pytest
+from aiogram.utils.exceptions import RetryAfter
+
+from feedback_bot.adapters.telegram import OutboundScheduler, Priority, TokenBucket
+
+
+class TestTokenBucket:
+    def test_token_bucket_wait_time(self):
+        bucket = TokenBucket(rate=2, now=0)
+
+        assert bucket.wait_time(0) == 0
+        bucket.consume()
+        assert bucket.wait_time(0) == pytest.approx(0.5)
+        assert bucket.wait_time(0.5) == 0
+
+    def test_token_bucket_blocked(self):
+        bucket = TokenBucket(rate=2, now=0)
+
+        bucket.block(until=3)
+
+        assert bucket.wait_time(1) == pytest.approx(2)
+        assert bucket.wait_time(3) == 0
+
+
+class TestOutboundScheduler:
+    @pytest.mark.asyncio
+    async def test_requests_sent_in_priority_order(self):
+        scheduler = OutboundScheduler(
+            global_rate=1000, private_chat_rate=1000, group_chat_rate=1000
+        )
+        sent: List[str] = []
+
+        def send(name):
+            async def _send():
+                sent.append(name)
+            return _send
+
+        await asyncio.gather(
+            scheduler.submit(1, Priority.FORWARD, send("first")),
+            scheduler.submit(2, Priority.NOTIFICATION, send("notification")),
+            scheduler.submit(3, Priority.FORWARD, send("forward")),
+            scheduler.submit(4, Priority.REPLY, send("reply")),
+        )
+        await scheduler.close()
+
+        assert sent == ["reply", "first", "forward", "notification"]
+
+    @pytest.mark.asyncio
+    async def test_requests_to_same_chat_rate_limited(self):
+        scheduler = OutboundScheduler(
+            global_rate=1000, private_chat_rate=20, group_chat_rate=1000
+        )
+        loop = asyncio.get_event_loop()
+        sent_at: List[float] = []
+
+        async def send():
+            sent_at.append(loop.time())
+
+        await asyncio.gather(
+            *(scheduler.submit(42, Priority.FORWARD, send) for _ in range(3))
+        )
+        await scheduler.close()
+
+        assert sent_at[2] - sent_at[0] >= 0.09
+
+    @pytest.mark.asyncio
+    async def test_retry_after_honored(self):
+        scheduler = OutboundScheduler(
+            global_rate=1000, private_chat_rate=1000, group_chat_rate=1000
+        )
+        attempts = 0
+
+        async def send():
+            nonlocal attempts
+            attempts += 1
+            if attempts == 1:
+                raise RetryAfter(0)
+            return 42
+
+        result = await scheduler.submit(42, Priority.REPLY, send)
+        await scheduler.close()
+
+        assert result == 42
+        assert attempts == 2
+
+    @pytest.mark.asyncio
+    async def test_retry_after_pauses_other_chats(self):
+        scheduler = OutboundScheduler(
+            global_rate=1000, private_chat_rate=1000, group_chat_rate=1000
+        )
+        loop = asyncio.get_event_loop()
+        sent_at: Dict[int, float] = {}
+        attempts = 0
+
+        async def send_to_a():
+            nonlocal attempts
+            attempts += 1
+            if attempts == 1:
+                raise RetryAfter(1)
+            sent_at[1] = loop.time()
+
+        async def send_to_b():
+            sent_at[2] = loop.time()
+
+        started_at = loop.time()
+        retried = asyncio.ensure_future(scheduler.submit(1, Priority.REPLY, send_to_a))
+        # Let the first attempt fail before queueing the request for chat B
+        while not attempts:
+            await asyncio.sleep(0)
+        await scheduler.submit(2, Priority.REPLY, send_to_b)
+        await retried
+        await scheduler.close()
+
+        assert sent_at[2] - started_at >= 0.9
+        assert sent_at[1] - started_at >= 0.9
+
+    @pytest.mark.asyncio
+    async def test_close_returns_abandoned_requests(self):
+        scheduler = OutboundScheduler(
+            global_rate=1000, private_chat_rate=1, group_chat_rate=1000
+        )
+
+        async def send():
+            pass
+
+        await scheduler.submit(42, Priority.FORWARD, send)
+        queued = asyncio.ensure_future(scheduler.submit(42, Priority.FORWARD, send))
+        await asyncio.sleep(0)
+
+        assert await scheduler.close() == 1
+        queued.cancel()
+
+    @pytest.mark.asyncio
+    async def test_error_propagated(self):
+        scheduler = OutboundScheduler(
+            global_rate=1000, private_chat_rate=1000, group_chat_rate=1000
+        )
+
+        async def send():
+            raise ValueError
+
+        with pytest.raises(ValueError):
+            await scheduler.submit(42, Priority.REPLY, send)
+        await scheduler.close()
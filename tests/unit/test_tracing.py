@@ -0,0 +1,154 @@
+import json
+from typing import List
+
+import pytest
+
+from feedback_bot import tracing
+from feedback_bot.adapters.telegram import OutboundScheduler, Priority
+
+
+class InMemorySpanExporter(tracing.AbstractSpanExporter):
+    def __init__(self):
+        self.spans: List[tracing.Span] = []
+
+    async def export(self, spans: List[tracing.Span]):
+        self.spans.extend(spans)
+
+
+@tracing.traced("service")
+async def _service():
+    with tracing.span("query") as span:
+        span.set("statement", "target_chat.get")
+
+
+def _parents(spans: List[tracing.Span]) -> dict:
+    names = {span.span_id: span.name for span in spans}
+    return {span.name: names.get(span.parent_id) for span in spans}
+
+
+@pytest.mark.asyncio
+async def test_unsampled_update_records_nothing():
+    exporter = InMemorySpanExporter()
+    tracing.set_tracer(tracing.Tracer(sample_rate=0, exporter=exporter))
+    try:
+        with tracing.trace("update") as span:
+            assert span is tracing.NOOP_SPAN
+            assert tracing.span("query") is tracing.NOOP_SPAN
+            await _service()
+        await tracing._tracer.flush()
+    finally:
+        tracing.set_tracer(None)
+
+    assert exporter.spans == []
+
+
+@pytest.mark.asyncio
+async def test_sampled_update_spans_linked():
+    exporter = InMemorySpanExporter()
+    tracer = tracing.Tracer(sample_rate=1, exporter=exporter)
+    tracing.set_tracer(tracer)
+    try:
+        with tracing.trace("update") as span:
+            span.set("update_id", 42)
+            await _service()
+        await tracer.flush()
+    finally:
+        tracing.set_tracer(None)
+
+    assert [span.name for span in exporter.spans] == ["query", "service", "update"]
+    assert _parents(exporter.spans) == {
+        "update": None,
+        "service": "update",
+        "query": "service",
+    }
+    assert len({span.trace_id for span in exporter.spans}) == 1
+    assert exporter.spans[0].attributes == {"statement": "target_chat.get"}
+    assert exporter.spans[2].attributes == {"update_id": 42}
+    assert tracing.current_span() is None
+
+
+@pytest.mark.asyncio
+async def test_failed_span_marked():
+    exporter = InMemorySpanExporter()
+    tracer = tracing.Tracer(sample_rate=1, exporter=exporter)
+    tracing.set_tracer(tracer)
+    try:
+        with pytest.raises(RuntimeError):
+            with tracing.trace("update"):
+                raise RuntimeError()
+        await tracer.flush()
+    finally:
+        tracing.set_tracer(None)
+
+    assert exporter.spans[0].failed
+
+
+@pytest.mark.asyncio
+async def test_scheduled_requests_linked_to_their_update():
+    exporter = InMemorySpanExporter()
+    tracer = tracing.Tracer(sample_rate=1, exporter=exporter)
+    scheduler = OutboundScheduler(
+        global_rate=100, private_chat_rate=100, group_chat_rate=100
+    )
+
+    @tracing.traced("telegram.sendMessage")
+    async def send():
+        pass
+
+    tracing.set_tracer(tracer)
+    try:
+        for update_id in range(2):
+            with tracing.trace("update") as span:
+                span.set("update_id", update_id)
+                await scheduler.submit(13, Priority.REPLY, send)
+        await tracer.flush()
+    finally:
+        tracing.set_tracer(None)
+        await scheduler.close()
+
+    traces = {}
+    for span in exporter.spans:
+        traces.setdefault(span.trace_id, []).append(span)
+    assert len(traces) == 2
+    for spans in traces.values():
+        assert _parents(spans) == {
+            "update": None,
+            "telegram.outbound": "update",
+            "telegram.sendMessage": "telegram.outbound",
+        }
+
+
+@pytest.mark.asyncio
+async def test_file_exporter_writes_json_lines(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    tracer = tracing.Tracer(
+        sample_rate=1, exporter=tracing.FileSpanExporter(str(path))
+    )
+    tracing.set_tracer(tracer)
+    try:
+        with tracing.trace("update"):
+            await _service()
+        await tracer.close()
+    finally:
+        tracing.set_tracer(None)
+
+    spans = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [span["name"] for span in spans] == ["query", "service", "update"]
+    assert spans[2]["parent_id"] is None
+    assert spans[1]["parent_id"] == spans[2]["span_id"]
+
+
+def test_tracer_drops_spans_over_queue_size():
+    tracer = tracing.Tracer(
+        sample_rate=1, exporter=InMemorySpanExporter(), max_queue_size=2
+    )
+    dropped = tracing.spans_dropped.value
+
+    for _ in range(2):
+        with tracer.start_trace("update"):
+            pass
+    with tracer.start_trace("update"):
+        with tracing.span("query"):
+            pass
+
+    assert tracing.spans_dropped.value == dropped + 2
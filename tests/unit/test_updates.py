@@ -0,0 +1,175 @@
+import asyncio
+from typing import List
+
+import pytest
+from aiogram import Bot, Dispatcher, types
+
+from feedback_bot.updates import (
+    InFlightUpdates,
+    InstrumentedDispatcher,
+    UpdateWorkerPool,
+    queue_wait,
+    updates_processed,
+)
+
+
+class FakeDispatcher(Dispatcher):
+    def __init__(self):
+        super().__init__(Bot(token="123:abc"))
+        self.processed: List[int] = []
+        self.release = asyncio.Event()
+
+    async def process_update(self, update: types.Update):
+        await self.release.wait()
+        # Later updates of a chat finish sooner, unless processed in order
+        await asyncio.sleep(0.001 * (10 - update.update_id % 10))
+        if update.update_id == 2:
+            raise RuntimeError("Handler failed")
+        self.processed.append(update.update_id)
+
+
+def _message_update(update_id: int, chat_id: int) -> types.Update:
+    return types.Update(
+        update_id=update_id,
+        message={
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": chat_id, "type": "private"},
+        },
+    )
+
+
+@pytest.mark.asyncio
+async def test_put_waits_while_queue_is_full():
+    dp = FakeDispatcher()
+    worker_pool = UpdateWorkerPool(shards=1, queue_size=2)
+    worker_pool.start(dp)
+
+    for update_id in range(3):
+        await worker_pool.put(types.Update(update_id=update_id))
+    # The first update is taken by the worker, the queue is full now
+    await asyncio.sleep(0)
+    put = asyncio.ensure_future(worker_pool.put(types.Update(update_id=3)))
+    await asyncio.sleep(0.01)
+    assert not put.done()
+
+    dp.release.set()
+    await put
+    await worker_pool.close()
+
+    assert dp.processed == [0, 1, 3]
+
+
+@pytest.mark.asyncio
+async def test_close_processes_queued_updates():
+    dp = FakeDispatcher()
+    dp.release.set()
+    observed = queue_wait.count
+    worker_pool = UpdateWorkerPool(shards=3, queue_size=10)
+    worker_pool.start(dp)
+
+    for update_id in range(5):
+        await worker_pool.put(types.Update(update_id=update_id))
+    await worker_pool.close()
+
+    assert sorted(dp.processed) == [0, 1, 3, 4]
+    assert len(worker_pool) == 0
+    assert queue_wait.count == observed + 5
+
+
+@pytest.mark.asyncio
+async def test_close_returns_abandoned_updates():
+    dp = FakeDispatcher()
+    worker_pool = UpdateWorkerPool(shards=1, queue_size=10)
+    worker_pool.start(dp)
+
+    for update_id in range(3):
+        await worker_pool.put(types.Update(update_id=update_id))
+    abandoned = await worker_pool.close(timeout=0.01)
+
+    # One update is cancelled while being processed, two are still queued
+    assert abandoned == 3
+    assert dp.processed == []
+
+
+@pytest.mark.asyncio
+async def test_updates_of_same_chat_processed_in_order():
+    dp = FakeDispatcher()
+    dp.release.set()
+    worker_pool = UpdateWorkerPool(shards=4, queue_size=100)
+    worker_pool.start(dp)
+
+    for update_id in range(20):
+        await worker_pool.put(_message_update(update_id, chat_id=update_id % 3))
+    await worker_pool.close()
+
+    for chat_id in range(3):
+        chat_updates = [
+            update_id for update_id in dp.processed if update_id % 3 == chat_id
+        ]
+        assert chat_updates == sorted(chat_updates)
+    assert len(dp.processed) == 19
+
+
+def test_chats_spread_between_shards():
+    worker_pool = UpdateWorkerPool(shards=4, queue_size=100)
+
+    shards = {
+        worker_pool.shard(_message_update(1, chat_id=chat_id))
+        for chat_id in (-1001, -1002, 13, 16)
+    }
+
+    assert shards == {0, 1, 2, 3}
+    assert worker_pool.shard(_message_update(1, chat_id=13)) == worker_pool.shard(
+        _message_update(2, chat_id=13)
+    )
+
+
+@pytest.mark.asyncio
+async def test_instrumented_dispatcher_counts_updates():
+    dp = InstrumentedDispatcher(Bot(token="123:abc"))
+
+    async def handle_message(message: types.Message):
+        if message.chat.id == 13:
+            raise RuntimeError("Handler failed")
+
+    dp.register_message_handler(
+        handle_message, content_types=types.ContentTypes.ANY
+    )
+
+    def update(update_id: int, chat_id: int) -> types.Update:
+        update = _message_update(update_id, chat_id)
+        update.message.from_user = types.User(
+            id=chat_id, is_bot=False, first_name="Spam"
+        )
+        return update
+
+    processed = updates_processed.labels("message", "processed")
+    failed = updates_processed.labels("message", "failed")
+    processed_before, failed_before = processed.value, failed.value
+
+    await dp.process_update(update(1, 37))
+    with pytest.raises(RuntimeError):
+        await dp.process_update(update(2, 13))
+
+    assert processed.value == processed_before + 1
+    assert failed.value == failed_before + 1
+
+
+@pytest.mark.asyncio
+async def test_in_flight_updates_wait():
+    in_flight = InFlightUpdates()
+    release = asyncio.Event()
+
+    async def process():
+        with in_flight.track():
+            await release.wait()
+
+    tasks = [asyncio.ensure_future(process()) for _ in range(2)]
+    await asyncio.sleep(0)
+    assert len(in_flight) == 2
+    assert await in_flight.wait(timeout=0.01) == 2
+
+    release.set()
+    assert await in_flight.wait(timeout=1) == 0
+    await asyncio.gather(*tasks)
@@ -0,0 +1,117 @@
+import asyncio
+from types import SimpleNamespace
+from typing import List
+
+import pytest
+from aiogram import Bot, types
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+
+from feedback_bot import bot as bot_module
+from feedback_bot.bootstrap import shutdown_abandoned
+from feedback_bot.updates import InstrumentedDispatcher, UpdateWorkerPool
+from feedback_bot.webhook import (
+    HEALTHZ_PATH,
+    READINESS_KEY,
+    READYZ_PATH,
+    Readiness,
+    handle_healthz,
+    handle_readyz,
+)
+
+
+class FakeWebhookBot:
+    def __init__(self, url: str):
+        self.url = url
+        self.set_urls: List[str] = []
+
+    async def get_webhook_info(self) -> types.WebhookInfo:
+        return types.WebhookInfo(url=self.url, pending_update_count=0)
+
+    async def set_webhook(self, url: str):
+        self.set_urls.append(url)
+        self.url = url
+
+
+def _app(readiness: Readiness) -> web.Application:
+    app = web.Application()
+    app[READINESS_KEY] = readiness
+    return app
+
+
+@pytest.mark.asyncio
+async def test_healthz():
+    request = make_mocked_request("GET", HEALTHZ_PATH, app=_app(Readiness()))
+
+    response = await handle_healthz(request)
+
+    assert response.status == 200
+
+
+@pytest.mark.asyncio
+async def test_readyz():
+    readiness = Readiness()
+    request = make_mocked_request("GET", READYZ_PATH, app=_app(readiness))
+
+    assert (await handle_readyz(request)).status == 503
+    readiness.ready = True
+    assert (await handle_readyz(request)).status == 200
+
+
+@pytest.mark.asyncio
+async def test_set_webhook():
+    fake_bot = FakeWebhookBot(url="")
+
+    await bot_module.set_webhook(
+        SimpleNamespace(bot=fake_bot),
+        webhook_host="https://example.com",
+        webhook_path="webhook",
+    )
+
+    assert fake_bot.set_urls == ["https://example.com/webhook"]
+
+
+@pytest.mark.asyncio
+async def test_set_webhook_already_set():
+    fake_bot = FakeWebhookBot(url="https://example.com/webhook")
+
+    await bot_module.set_webhook(
+        SimpleNamespace(bot=fake_bot),
+        webhook_host="https://example.com",
+        webhook_path="/webhook",
+    )
+
+    assert not fake_bot.set_urls
+
+
+@pytest.mark.asyncio
+async def test_drain(caplog):
+    dp = InstrumentedDispatcher(Bot(token="123:abc"))
+    readiness = Readiness()
+    readiness.ready = True
+
+    async def process(done: asyncio.Event):
+        with dp.in_flight.track():
+            await done.wait()
+
+    abandoned_before = shutdown_abandoned.labels("updates").value
+    released = asyncio.Event()
+    finished = asyncio.ensure_future(process(released))
+    abandoned = asyncio.ensure_future(process(asyncio.Event()))
+    await asyncio.sleep(0)
+    asyncio.get_event_loop().call_later(0.01, released.set)
+
+    await bot_module.drain(
+        dp,
+        readiness=readiness,
+        update_worker_pool=UpdateWorkerPool(shards=1, queue_size=1),
+        immediate_ack=False,
+        timeout=0.1,
+    )
+
+    assert not readiness.ready
+    assert finished.done()
+    assert not abandoned.done()
+    assert "Drained 1 updates, abandoned 1" in caplog.text
+    assert shutdown_abandoned.labels("updates").value == abandoned_before + 1
+    abandoned.cancel()